@@ -1,12 +1,25 @@
+import os
+import copy
+import glob
 import numpy as np
 import pandas as pd
 import database as db
+import specs as sp
+import sessions as ss
 import metrics as mt
+import engine as eg
+import fills as fl
 import matplotlib.pyplot as plt
 from math import floor
-from collections import deque
+from ledger import ledger
+from journal import journal
 
 
+# 跨日状态 (checkpoint), 每日开始时重置的变量不保存
+STATE_VERSION = 1
+STATE_FIELDS  = ['lpos', 'spos', 'yst_pos', 'open_pos', 'realized', 'unrealized', 'order_id',
+                 'ticks', 'terminate', 'spec_row']
+
 class backtest(object):
     def __init__(self,                  
                  instrument=None,
@@ -32,12 +45,7 @@ class backtest(object):
         assert instrument != None, 'Instrument Must be Valid'
 
         # Bacaktest Param
-        self.open_fee       = db.GetFees(instrument, 'open')
-        self.close_tdy_fee  = db.GetFees(instrument, 'closeT')
-        self.close_yst_fee  = db.GetFees(instrument, 'closeN')
-        self.ticksize       = db.GetTickSize(instrument)
-        self.size           = db.GetContractSize(instrument)
-        self.margin         = db.GetMargin(instrument)
+        self.SetSpec(sp.GetRow(instrument))
         self.instrument     = instrument
         self.freq           = freq
         self.slippage       = slippage
@@ -52,14 +60,17 @@ class backtest(object):
         self.lot            = 1
         self.halt_time      = 15 * 60
         self.halt           = False
+        self.fill           = None # fills.fillmodel, None 为按 lot 全部成交
         self.dates          = []
 
         # Metric Param
-        self.reports         = []
+        self.reports         = journal()
+        self.mtm             = [] # 每日 (开始时间, ms 偏移 int32, pnl float32, 保证金 float32)
+        self.mtm_freq        = None # None 逐 tick, 或 '1min' 等按 bar 取最后一个 tick
         self.lpos            = 0
         self.spos            = 0
-        self.long_avg_price  = []
-        self.short_avg_price = [] 
+        self.long_avg_price  = ledger()
+        self.short_avg_price = ledger()
         self.realized        = 0
         self.unrealized      = 0
         self.yst_pos         = 0
@@ -67,22 +78,25 @@ class backtest(object):
         self.order_id        = 0
         self.ticks           = 0
         
+    def SetSpec(self, row):
+        """
+        Tick size, contract size, margin and fee kernels from specs row
+        """
+        spec = sp.SPECS[row]
+        self.spec_row = row
+        self.fees     = sp.GetFeeKernel(spec).tolist() # [open, closeT, closeN] x (rate, flat)
+        self.ticksize = float(spec['ticksize'])
+        self.size     = float(spec['size'])
+        self.margin   = float(spec['margin'])
+        return 0
+
     # Calculate Fees
     def GetFees(self, price, qty, action='open'):
-        if action == 'open':
-            fee = self.open_fee
-        elif action == 'closeT':
-            fee = self.close_tdy_fee
-        elif action == 'closeN':
-            fee = self.close_yst_fee
-        else:
+        if action not in sp.FEE_ACTIONS:
             print('Cannot understand action {}'.format(action))
             raise TypeError
-
-        if fee < 1:
-            ex_fee = round(price * qty * fee * self.size, 2) 
-        else:    
-            ex_fee = round(qty * fee, 2)
+        rate, flat = self.fees[sp.FEE_ACTIONS[action]]
+        ex_fee = round(price * qty * rate * self.size + qty * flat, 2)
                 
         if self.broker_rate < 1:
             br_fee = ex_fee * (1 + self.broker_rate)
@@ -105,16 +119,53 @@ class backtest(object):
         maxpos = floor((current_capital - used_margin) / margin)
         return maxpos
 
-    def GetAvgPrice(self, q:list):
-        if len(q) != 0:
-            avg_price = sum(q) / len(q)
-        else:
-            avg_price = 0
-        return avg_price
+    def GetMTM(self, bp1, ap1):
+        """
+        Mark to market PnL of open positions: longs at bid, shorts at ask
+        """
+        return (bp1 * self.lpos - self.long_avg_price.cost) * self.size + (self.short_avg_price.cost - ap1 * self.spos) * self.size
+
+    def IsFrozen(self, bp1, ap1):
+        """
+        Mark to market equity under the freeze line (capital * freeze_rate)
+        """
+        return self.capital + self.realized + self.GetMTM(bp1, ap1) < self.capital * self.freeze_rate
+
+    def mark(self, i):
+        """
+        Record the position state after the fills at tick i
+        """
+        self.path.append((i, self.lpos, self.spos, self.long_avg_price.cost, self.short_avg_price.cost, self.realized))
+        return 0
+
+    def MarkToMarket(self, bp1, ap1, price):
+        """
+        Per tick pnl (realized + MTM) and used margin from the day's position path, vectorized after the loop
+        """
+        idx, lpos, spos, lcost, scost, realized = np.array(self.path, dtype=np.float64).T
+        k = np.searchsorted(idx, np.arange(len(bp1)), side='right') - 1
+        bp1 = np.asarray(bp1, dtype=np.float64)
+        ap1 = np.asarray(ap1, dtype=np.float64)
+        pnl    = realized[k] + (bp1 * lpos[k] - lcost[k]) * self.size + (scost[k] - ap1 * spos[k]) * self.size
+        margin = (lpos[k] + spos[k]) * self.margin * np.asarray(price, dtype=np.float64) * self.size
+        stamps = self.stamps
+        if self.mtm_freq is not None:
+            # 每个 bar 保留最后一个 tick
+            bar  = stamps // pd.Timedelta(self.mtm_freq).value
+            last = np.flatnonzero(np.diff(bar, append=bar[-1] + 1))
+            stamps, pnl, margin = stamps[last], pnl[last], margin[last]
+        offset = ((stamps - stamps[0]) // 1_000_000).astype(np.int32)
+        self.mtm.append((int(stamps[0]), offset, pnl.astype(np.float32), margin.astype(np.float32)))
+        return 0
 
-    def GetRealize(self, q, price, qty, side):
-        x = q[:qty]
-        avg = sum(x) / len(x)
+    def GetAvgPrice(self, q:ledger):
+        return q.avg()
+
+    def GetRealize(self, q:ledger, price, qty, side):
+        """
+        FIFO: pop qty lots from ledger q and realize against price
+        """
+        avg = q.pop(qty) / qty
         if side == 'long':
             realize = round((price - avg) * self.size * qty,2)
         elif side == 'short':
@@ -133,7 +184,7 @@ class backtest(object):
         open_price = price + self.slippage * self.ticksize 
         ex_fee, br_fee, rebate = self.GetFees(open_price, qty, action='open')
         total_fee = ex_fee + br_fee - rebate
-        self.long_avg_price = self.long_avg_price + [open_price] * qty
+        self.long_avg_price.push(open_price, qty)
         self.lpos += qty
         self.realized += -total_fee
         self.open_pos += qty
@@ -142,26 +193,25 @@ class backtest(object):
         lunrealize =      round((open_price - lavg_price) * np.abs(self.lpos) * self.size,2) if lavg_price != 0 else 0
         sunrealize = -1 * round((open_price - savg_price) * np.abs(self.spos) * self.size,2) if savg_price != 0 else 0
         self.unrealized = lunrealize + sunrealize
-        self.reports.append({
-            'account_id': self.acc_id,
-            'order_id'  : self.order_id,
-            'datetime'  : self.index[i],
-            'code'      : self.contract,
-            'price'     : open_price,
-            'direction' : '多',
-            'action'    : '开',
-            'volume'    : qty,
-            'value'     : qty * price * self.size,
-            'ex_fee'    : ex_fee,
-            'total_fee' : total_fee,
-            'lpos'      : self.lpos,
-            'spos'      : self.spos,
-            'total_pos' : self.lpos + self.spos,
-            'u_pnl'     : self.unrealized,
-            'r_pnl'     : -1 * total_fee,
-            'total_pnl' : self.unrealized + self.realized,
-            'total_rpnl': self.realized,
-            })
+        self.reports.append(
+            account_id = self.acc_id,
+            order_id   = self.order_id,
+            datetime   = self.stamps[i],
+            code       = self.contract,
+            price      = open_price,
+            direction  = '多',
+            action     = '开',
+            volume     = qty,
+            value      = qty * price * self.size,
+            ex_fee     = ex_fee,
+            total_fee  = total_fee,
+            lpos       = self.lpos,
+            spos       = self.spos,
+            u_pnl      = self.unrealized,
+            r_pnl      = -1 * total_fee,
+            total_pnl  = self.unrealized + self.realized,
+            total_rpnl = self.realized,
+            )
         return 0
 
     def open_short(self, price, qty, i):
@@ -172,7 +222,7 @@ class backtest(object):
         open_price = price - self.slippage * self.ticksize
         ex_fee, br_fee, rebate = self.GetFees(open_price, qty, action='open')
         total_fee = ex_fee + br_fee - rebate
-        self.short_avg_price = self.short_avg_price + [open_price] * qty
+        self.short_avg_price.push(open_price, qty)
         self.spos += qty
         self.realized += -total_fee
         self.open_pos += qty
@@ -181,26 +231,25 @@ class backtest(object):
         lunrealize =      round((open_price - lavg_price) * np.abs(self.lpos) * self.size,2) if lavg_price != 0 else 0
         sunrealize = -1 * round((open_price - savg_price) * np.abs(self.spos) * self.size,2) if savg_price != 0 else 0
         self.unrealized = lunrealize + sunrealize
-        self.reports.append({
-            'account_id': self.acc_id,
-            'order_id'  : self.order_id,
-            'datetime'  : self.index[i],
-            'code'      : self.contract,
-            'price'     : open_price,
-            'direction' : '空',
-            'action'    : '开',
-            'volume'    : qty,
-            'value'     : qty * price * self.size,
-            'ex_fee'    : ex_fee,
-            'total_fee' : total_fee,
-            'lpos'      : self.lpos,
-            'spos'      : self.spos,
-            'total_pos' : self.lpos + self.spos,
-            'u_pnl'     : self.unrealized,
-            'r_pnl'     : -1 * total_fee,
-            'total_pnl' : self.unrealized + self.realized,
-            'total_rpnl': self.realized,
-            })
+        self.reports.append(
+            account_id = self.acc_id,
+            order_id   = self.order_id,
+            datetime   = self.stamps[i],
+            code       = self.contract,
+            price      = open_price,
+            direction  = '空',
+            action     = '开',
+            volume     = qty,
+            value      = qty * price * self.size,
+            ex_fee     = ex_fee,
+            total_fee  = total_fee,
+            lpos       = self.lpos,
+            spos       = self.spos,
+            u_pnl      = self.unrealized,
+            r_pnl      = -1 * total_fee,
+            total_pnl  = self.unrealized + self.realized,
+            total_rpnl = self.realized,
+            )
         return 0
 
     def add_long(self, price, qty, i):
@@ -211,7 +260,7 @@ class backtest(object):
         open_price = price + self.slippage * self.ticksize
         ex_fee, br_fee, rebate = self.GetFees(open_price, qty, action='open')
         total_fee = ex_fee + br_fee - rebate
-        self.long_avg_price = self.long_avg_price + [open_price] * qty
+        self.long_avg_price.push(open_price, qty)
         self.lpos += qty
         self.realized += -total_fee
         self.open_pos += qty
@@ -220,26 +269,25 @@ class backtest(object):
         lunrealize =      round((open_price - lavg_price) * np.abs(self.lpos) * self.size,2) if lavg_price != 0 else 0
         sunrealize = -1 * round((open_price - savg_price) * np.abs(self.spos) * self.size,2) if savg_price != 0 else 0
         self.unrealized = lunrealize + sunrealize
-        self.reports.append({
-            'account_id': self.acc_id,
-            'order_id'  : self.order_id,
-            'datetime'  : self.index[i],
-            'code'      : self.contract,
-            'price'     : open_price,
-            'direction' : '多',
-            'action'    : '加',
-            'volume'    : qty,
-            'value'     : qty * price * self.size,
-            'ex_fee'    : ex_fee,
-            'total_fee' : total_fee,
-            'lpos'      : self.lpos,
-            'spos'      : self.spos,
-            'total_pos' : self.lpos + self.spos,
-            'u_pnl'     : self.unrealized,
-            'r_pnl'     : -1 * total_fee,
-            'total_pnl' : self.unrealized + self.realized,
-            'total_rpnl': self.realized,
-            })
+        self.reports.append(
+            account_id = self.acc_id,
+            order_id   = self.order_id,
+            datetime   = self.stamps[i],
+            code       = self.contract,
+            price      = open_price,
+            direction  = '多',
+            action     = '加',
+            volume     = qty,
+            value      = qty * price * self.size,
+            ex_fee     = ex_fee,
+            total_fee  = total_fee,
+            lpos       = self.lpos,
+            spos       = self.spos,
+            u_pnl      = self.unrealized,
+            r_pnl      = -1 * total_fee,
+            total_pnl  = self.unrealized + self.realized,
+            total_rpnl = self.realized,
+            )
         return 0
 
     def add_short(self, price, qty, i):
@@ -250,7 +298,7 @@ class backtest(object):
         open_price = price - self.slippage * self.ticksize
         ex_fee, br_fee, rebate = self.GetFees(open_price, qty, action='open')
         total_fee = ex_fee + br_fee - rebate
-        self.short_avg_price = self.short_avg_price + [open_price] * qty
+        self.short_avg_price.push(open_price, qty)
         self.spos += qty
         self.realized += -total_fee
         self.open_pos += qty
@@ -259,26 +307,25 @@ class backtest(object):
         lunrealize =      round((open_price - lavg_price) * np.abs(self.lpos) * self.size,2) if lavg_price != 0 else 0
         sunrealize = -1 * round((open_price - savg_price) * np.abs(self.spos) * self.size,2) if savg_price != 0 else 0
         self.unrealized = lunrealize + sunrealize
-        self.reports.append({
-            'account_id': self.acc_id,
-            'order_id'  : self.order_id,
-            'datetime'  : self.index[i],
-            'code'      : self.contract,
-            'price'     : open_price,
-            'direction' : '空',
-            'action'    : '加',
-            'volume'    : qty,
-            'value'     : qty * price * self.size,
-            'ex_fee'    : ex_fee,
-            'total_fee' : total_fee,
-            'lpos'      : self.lpos,
-            'spos'      : self.spos,
-            'total_pos' : self.lpos + self.spos,
-            'u_pnl'     : self.unrealized,
-            'r_pnl'     : -1 * total_fee,
-            'total_pnl' : self.unrealized + self.realized,
-            'total_rpnl': self.realized,
-            })
+        self.reports.append(
+            account_id = self.acc_id,
+            order_id   = self.order_id,
+            datetime   = self.stamps[i],
+            code       = self.contract,
+            price      = open_price,
+            direction  = '空',
+            action     = '加',
+            volume     = qty,
+            value      = qty * price * self.size,
+            ex_fee     = ex_fee,
+            total_fee  = total_fee,
+            lpos       = self.lpos,
+            spos       = self.spos,
+            u_pnl      = self.unrealized,
+            r_pnl      = -1 * total_fee,
+            total_pnl  = self.unrealized + self.realized,
+            total_rpnl = self.realized,
+            )
         return 0
 
     def minus_long(self, price, qty, i):
@@ -311,11 +358,7 @@ class backtest(object):
         # Realize PNL -> FIFO
         self.lpos -= qty
         realized = self.GetRealize(self.long_avg_price, close_price, qty, 'long')
-        if self.lpos == 0:
-            self.long_avg_price = []
-            assert len(self.long_avg_price) == self.lpos, 'Queue and Pos length not match. Deque {}, lpos {}'.format(len(self.long_avg_price), self.lpos)
-        else:
-            self.long_avg_price = self.long_avg_price[qty:]
+        assert len(self.long_avg_price) == self.lpos, 'Queue and Pos length not match. Deque {}, lpos {}'.format(len(self.long_avg_price), self.lpos)
 
         lavg_price = self.GetAvgPrice(self.long_avg_price)
         savg_price = self.GetAvgPrice(self.short_avg_price)
@@ -323,26 +366,25 @@ class backtest(object):
         sunrealize = -1 * round((close_price - savg_price) * np.abs(self.spos) * self.size,2) if savg_price != 0 else 0
         self.unrealized = lunrealize + sunrealize
         self.realized   += (realized - total_fee)
-        self.reports.append({
-            'account_id': self.acc_id,
-            'order_id'  : self.order_id,
-            'datetime'  : self.index[i],
-            'code'      : self.contract,
-            'price'     : close_price,
-            'direction' : '多',
-            'action'    : action,
-            'volume'    : qty,
-            'value'     : qty * price * self.size,
-            'ex_fee'    : ex_fee,
-            'total_fee' : total_fee,
-            'lpos'      : self.lpos,
-            'spos'      : self.spos,
-            'total_pos' : self.lpos + self.spos,
-            'u_pnl'     : self.unrealized,
-            'r_pnl'     : realized - total_fee,
-            'total_pnl' : self.unrealized + self.realized,
-            'total_rpnl': self.realized,
-            })
+        self.reports.append(
+            account_id = self.acc_id,
+            order_id   = self.order_id,
+            datetime   = self.stamps[i],
+            code       = self.contract,
+            price      = close_price,
+            direction  = '多',
+            action     = action,
+            volume     = qty,
+            value      = qty * price * self.size,
+            ex_fee     = ex_fee,
+            total_fee  = total_fee,
+            lpos       = self.lpos,
+            spos       = self.spos,
+            u_pnl      = self.unrealized,
+            r_pnl      = realized - total_fee,
+            total_pnl  = self.unrealized + self.realized,
+            total_rpnl = self.realized,
+            )
         return 0
 
     def minus_short(self, price, qty, i):
@@ -374,11 +416,7 @@ class backtest(object):
 
         self.spos -= qty
         realized = self.GetRealize(self.short_avg_price, close_price, qty, 'short')
-        if self.spos == 0:
-            self.short_avg_price = []
-            assert len(self.short_avg_price) == self.spos, 'Queue and Pos length not match. Deque {}, spos {}'.format(len(self.short_avg_price), self.spos)
-        else:
-            self.short_avg_price = self.short_avg_price[qty:]
+        assert len(self.short_avg_price) == self.spos, 'Queue and Pos length not match. Deque {}, spos {}'.format(len(self.short_avg_price), self.spos)
 
         lavg_price = self.GetAvgPrice(self.long_avg_price)
         savg_price = self.GetAvgPrice(self.short_avg_price)
@@ -386,26 +424,25 @@ class backtest(object):
         sunrealize = -1 * round((close_price - savg_price) * np.abs(self.spos) * self.size,2) if savg_price != 0 else 0
         self.unrealized = lunrealize + sunrealize
         self.realized += (realized - total_fee)
-        self.reports.append({
-            'account_id': self.acc_id,
-            'order_id'  : self.order_id,
-            'datetime'  : self.index[i],
-            'code'      : self.contract,
-            'price'     : close_price,
-            'direction' : '空',
-            'action'    : action,
-            'volume'    : qty,
-            'value'     : qty * price * self.size,
-            'ex_fee'    : ex_fee,
-            'total_fee' : total_fee,
-            'lpos'      : self.lpos,
-            'spos'      : self.spos,
-            'total_pos' : self.lpos + self.spos,
-            'u_pnl'     : self.unrealized,
-            'r_pnl'     : realized - total_fee,
-            'total_pnl' : self.unrealized + self.realized,
-            'total_rpnl': self.realized,
-            })
+        self.reports.append(
+            account_id = self.acc_id,
+            order_id   = self.order_id,
+            datetime   = self.stamps[i],
+            code       = self.contract,
+            price      = close_price,
+            direction  = '空',
+            action     = action,
+            volume     = qty,
+            value      = qty * price * self.size,
+            ex_fee     = ex_fee,
+            total_fee  = total_fee,
+            lpos       = self.lpos,
+            spos       = self.spos,
+            u_pnl      = self.unrealized,
+            r_pnl      = realized - total_fee,
+            total_pnl  = self.unrealized + self.realized,
+            total_rpnl = self.realized,
+            )
         return 0
 
     def close_long(self, price, i):
@@ -439,11 +476,7 @@ class backtest(object):
 
         self.lpos -= qty
         realized = self.GetRealize(self.long_avg_price, close_price, qty, 'long')
-        if self.lpos == 0:
-            self.long_avg_price = []
-            assert len(self.long_avg_price) == self.lpos, 'Queue and Pos length not match. Deque {}, lpos {}'.format(len(self.long_avg_price), self.lpos)
-        else:
-            self.long_avg_price = self.long_avg_price[qty:]
+        assert len(self.long_avg_price) == self.lpos, 'Queue and Pos length not match. Deque {}, lpos {}'.format(len(self.long_avg_price), self.lpos)
 
         lavg_price = self.GetAvgPrice(self.long_avg_price)
         savg_price = self.GetAvgPrice(self.short_avg_price)
@@ -451,26 +484,25 @@ class backtest(object):
         sunrealize = -1 * round((close_price - savg_price) * np.abs(self.spos) * self.size,2) if savg_price != 0 else 0
         self.unrealized = lunrealize + sunrealize
         self.realized   += (realized - total_fee)
-        self.reports.append({
-            'account_id': self.acc_id,
-            'order_id'  : self.order_id,
-            'datetime'  : self.index[i],
-            'code'      : self.contract,
-            'price'     : close_price,
-            'direction' : '多',
-            'action'    : action,
-            'volume'    : qty,
-            'value'     : qty * price * self.size,
-            'ex_fee'    : ex_fee,
-            'total_fee' : total_fee,
-            'lpos'      : self.lpos,
-            'spos'      : self.spos,
-            'total_pos' : self.lpos + self.spos,
-            'u_pnl'     : self.unrealized,
-            'r_pnl'     : realized - total_fee,
-            'total_pnl' : self.unrealized + self.realized,
-            'total_rpnl': self.realized,
-            })
+        self.reports.append(
+            account_id = self.acc_id,
+            order_id   = self.order_id,
+            datetime   = self.stamps[i],
+            code       = self.contract,
+            price      = close_price,
+            direction  = '多',
+            action     = action,
+            volume     = qty,
+            value      = qty * price * self.size,
+            ex_fee     = ex_fee,
+            total_fee  = total_fee,
+            lpos       = self.lpos,
+            spos       = self.spos,
+            u_pnl      = self.unrealized,
+            r_pnl      = realized - total_fee,
+            total_pnl  = self.unrealized + self.realized,
+            total_rpnl = self.realized,
+            )
         return 0
 
     def close_short(self, price, i):
@@ -500,11 +532,7 @@ class backtest(object):
 
         self.spos -= qty
         realized = self.GetRealize(self.short_avg_price, close_price, qty, 'short')
-        if self.spos == 0:
-            self.short_avg_price = []
-            assert len(self.short_avg_price) == self.spos, 'Queue and Pos length not match. Deque {}, spos {}'.format(len(self.short_avg_price), self.spos)
-        else:
-            self.short_avg_price = self.short_avg_price[qty:]
+        assert len(self.short_avg_price) == self.spos, 'Queue and Pos length not match. Deque {}, spos {}'.format(len(self.short_avg_price), self.spos)
 
         lavg_price = self.GetAvgPrice(self.long_avg_price)
         savg_price = self.GetAvgPrice(self.short_avg_price)
@@ -512,26 +540,25 @@ class backtest(object):
         sunrealize = -1 * round((close_price - savg_price) * np.abs(self.spos) * self.size,2) if savg_price != 0 else 0
         self.unrealized = lunrealize + sunrealize
         self.realized   += (realized - total_fee)
-        self.reports.append({
-            'account_id': self.acc_id,
-            'order_id'  : self.order_id,
-            'datetime'  : self.index[i],
-            'code'      : self.contract,
-            'price'     : close_price,
-            'direction' : '空',
-            'action'    : action,
-            'volume'    : qty,
-            'value'     : qty * price * self.size,
-            'ex_fee'    : ex_fee,
-            'total_fee' : total_fee,
-            'lpos'      : self.lpos,
-            'spos'      : self.spos,
-            'total_pos' : self.lpos + self.spos,
-            'u_pnl'     : self.unrealized,
-            'r_pnl'     : realized - total_fee,
-            'total_pnl' : self.unrealized + self.realized,
-            'total_rpnl': self.realized,
-            })
+        self.reports.append(
+            account_id = self.acc_id,
+            order_id   = self.order_id,
+            datetime   = self.stamps[i],
+            code       = self.contract,
+            price      = close_price,
+            direction  = '空',
+            action     = action,
+            volume     = qty,
+            value      = qty * price * self.size,
+            ex_fee     = ex_fee,
+            total_fee  = total_fee,
+            lpos       = self.lpos,
+            spos       = self.spos,
+            u_pnl      = self.unrealized,
+            r_pnl      = realized - total_fee,
+            total_pnl  = self.unrealized + self.realized,
+            total_rpnl = self.realized,
+            )
         return 0
 
     def close_all(self, bp1, ap1, i):
@@ -562,11 +589,7 @@ class backtest(object):
 
             self.lpos -= qty
             realized = self.GetRealize(self.long_avg_price, close_price, qty, 'long')
-            if self.lpos == 0:
-                self.long_avg_price = []
-                assert len(self.long_avg_price) == self.lpos, 'Queue and Pos length not match. Deque {}, lpos {}'.format(len(self.long_avg_price), self.lpos)
-            else:
-                self.long_avg_price = self.long_avg_price[qty:]
+            assert len(self.long_avg_price) == self.lpos, 'Queue and Pos length not match. Deque {}, lpos {}'.format(len(self.long_avg_price), self.lpos)
 
             lavg_price = self.GetAvgPrice(self.long_avg_price)
             savg_price = self.GetAvgPrice(self.short_avg_price)
@@ -574,26 +597,25 @@ class backtest(object):
             sunrealize = -1 * round((close_price - savg_price) * np.abs(self.spos) * self.size,2) if savg_price != 0 else 0
             self.unrealized = lunrealize + sunrealize
             self.realized   += (realized - total_fee)
-            self.reports.append({
-                'account_id': self.acc_id,
-                'order_id'  : self.order_id,
-                'datetime'  : self.index[i],
-                'code'      : self.contract,
-                'price'     : close_price,
-                'direction' : '多',
-                'action'    : action,
-                'volume'    : qty,
-                'value'     : qty * bp1 * self.size,
-                'ex_fee'    : ex_fee,
-                'total_fee' : total_fee,
-                'lpos'      : self.lpos,
-                'spos'      : self.spos,
-                'total_pos' : self.lpos + self.spos,
-                'u_pnl'     : self.unrealized,
-                'r_pnl'     : realized - total_fee,
-                'total_pnl' : self.unrealized + self.realized,
-                'total_rpnl': self.realized,
-                })
+            self.reports.append(
+                account_id = self.acc_id,
+                order_id   = self.order_id,
+                datetime   = self.stamps[i],
+                code       = self.contract,
+                price      = close_price,
+                direction  = '多',
+                action     = action,
+                volume     = qty,
+                value      = qty * bp1 * self.size,
+                ex_fee     = ex_fee,
+                total_fee  = total_fee,
+                lpos       = self.lpos,
+                spos       = self.spos,
+                u_pnl      = self.unrealized,
+                r_pnl      = realized - total_fee,
+                total_pnl  = self.unrealized + self.realized,
+                total_rpnl = self.realized,
+                )
         if self.spos > 0:
             close_price = ap1 + self.slippage * self.ticksize
             qty = abs(self.spos)
@@ -620,11 +642,7 @@ class backtest(object):
 
             self.spos -= qty
             realized = self.GetRealize(self.short_avg_price, close_price, qty, 'short')
-            if self.spos == 0:
-                self.short_avg_price = []
-                assert len(self.short_avg_price) == self.spos, 'Queue and Pos length not match. Deque {}, spos {}'.format(len(self.short_avg_price), self.spos)
-            else:
-                self.short_avg_price = self.short_avg_price[qty:]
+            assert len(self.short_avg_price) == self.spos, 'Queue and Pos length not match. Deque {}, spos {}'.format(len(self.short_avg_price), self.spos)
 
             lavg_price = self.GetAvgPrice(self.long_avg_price)
             savg_price = self.GetAvgPrice(self.short_avg_price)
@@ -632,26 +650,25 @@ class backtest(object):
             sunrealize = -1 * round((close_price - savg_price) * np.abs(self.spos) * self.size,2) if savg_price != 0 else 0
             self.unrealized = lunrealize + sunrealize
             self.realized   += (realized - total_fee)
-            self.reports.append({
-                'account_id': self.acc_id,
-                'order_id'  : self.order_id,
-                'datetime'  : self.index[i],
-                'code'      : self.contract,
-                'price'     : close_price,
-                'direction' : '空',
-                'action'    : action,
-                'volume'    : qty,
-                'value'     : qty * ap1 * self.size,
-                'ex_fee'    : ex_fee,
-                'total_fee' : total_fee,
-                'lpos'      : self.lpos,
-                'spos'      : self.spos,
-                'total_pos' : self.lpos + self.spos,
-                'u_pnl'     : self.unrealized,
-                'r_pnl'     : realized - total_fee,
-                'total_pnl' : self.unrealized + self.realized,
-                'total_rpnl': self.realized,
-                })
+            self.reports.append(
+                account_id = self.acc_id,
+                order_id   = self.order_id,
+                datetime   = self.stamps[i],
+                code       = self.contract,
+                price      = close_price,
+                direction  = '空',
+                action     = action,
+                volume     = qty,
+                value      = qty * ap1 * self.size,
+                ex_fee     = ex_fee,
+                total_fee  = total_fee,
+                lpos       = self.lpos,
+                spos       = self.spos,
+                u_pnl      = self.unrealized,
+                r_pnl      = realized - total_fee,
+                total_pnl  = self.unrealized + self.realized,
+                total_rpnl = self.realized,
+                )
         return 0
 
     def reverse_long(self, price, qty, i):
@@ -683,11 +700,7 @@ class backtest(object):
             raise TypeError('Case not addressed')
         self.spos -= qty
         realized = self.GetRealize(self.short_avg_price, close_price, qty, 'short')
-        if self.spos == 0:
-            self.short_avg_price = []
-            assert len(self.short_avg_price) == self.spos, 'Queue and Pos length not match. Deque {}, spos {}'.format(len(self.short_avg_price), self.spos)
-        else:
-            self.short_avg_price = self.short_avg_price[qty:]
+        assert len(self.short_avg_price) == self.spos, 'Queue and Pos length not match. Deque {}, spos {}'.format(len(self.short_avg_price), self.spos)
 
         lavg_price = self.GetAvgPrice(self.long_avg_price)
         savg_price = self.GetAvgPrice(self.short_avg_price)
@@ -695,30 +708,29 @@ class backtest(object):
         sunrealize = -1 * round((close_price - savg_price) * np.abs(self.spos) * self.size,2) if savg_price != 0 else 0
         self.unrealized = lunrealize + sunrealize
         self.realized += (realized - total_fee)
-        self.reports.append({
-            'account_id': self.acc_id,
-            'order_id'  : self.order_id,
-            'datetime'  : self.index[i],
-            'code'      : self.contract,
-            'price'     : close_price,
-            'direction' : '空',
-            'action'    : action,
-            'volume'    : qty,
-            'value'     : qty * price * self.size,
-            'ex_fee'    : ex_fee,
-            'total_fee' : total_fee,
-            'lpos'      : self.lpos,
-            'spos'      : self.spos,
-            'total_pos' : self.lpos + self.spos,
-            'u_pnl'     : self.unrealized,
-            'r_pnl'     : realized - total_fee,
-            'total_pnl' : self.unrealized + self.realized,
-            'total_rpnl': self.realized,
-            })
+        self.reports.append(
+            account_id = self.acc_id,
+            order_id   = self.order_id,
+            datetime   = self.stamps[i],
+            code       = self.contract,
+            price      = close_price,
+            direction  = '空',
+            action     = action,
+            volume     = qty,
+            value      = qty * price * self.size,
+            ex_fee     = ex_fee,
+            total_fee  = total_fee,
+            lpos       = self.lpos,
+            spos       = self.spos,
+            u_pnl      = self.unrealized,
+            r_pnl      = realized - total_fee,
+            total_pnl  = self.unrealized + self.realized,
+            total_rpnl = self.realized,
+            )
         # Open Long or Add Long
         ex_fee, br_fee, rebate = self.GetFees(open_price, qty, action='open')
         total_fee = ex_fee + br_fee - rebate
-        self.long_avg_price = self.long_avg_price + [open_price] * qty
+        self.long_avg_price.push(open_price, qty)
         self.lpos += qty
         self.realized += -total_fee
         self.open_pos += qty
@@ -727,26 +739,25 @@ class backtest(object):
         lunrealize =      round((close_price - lavg_price) * np.abs(self.lpos) * self.size,2) if lavg_price != 0 else 0
         sunrealize = -1 * round((close_price - savg_price) * np.abs(self.spos) * self.size,2) if savg_price != 0 else 0
         self.unrealized = lunrealize + sunrealize
-        self.reports.append({
-            'account_id': self.acc_id,
-            'order_id'  : self.order_id,
-            'datetime'  : self.index[i],
-            'code'      : self.contract,
-            'price'     : open_price,
-            'direction' : '多',
-            'action'    : '反开',
-            'volume'    : qty,
-            'value'     : qty * price * self.size,
-            'ex_fee'    : ex_fee,
-            'total_fee' : total_fee,
-            'lpos'      : self.lpos,
-            'spos'      : self.spos,
-            'total_pos' : self.lpos + self.spos,
-            'u_pnl'     : self.unrealized,
-            'r_pnl'     : -1 * total_fee,
-            'total_pnl' : self.unrealized + self.realized,
-            'total_rpnl': self.realized,
-            })
+        self.reports.append(
+            account_id = self.acc_id,
+            order_id   = self.order_id,
+            datetime   = self.stamps[i],
+            code       = self.contract,
+            price      = open_price,
+            direction  = '多',
+            action     = '反开',
+            volume     = qty,
+            value      = qty * price * self.size,
+            ex_fee     = ex_fee,
+            total_fee  = total_fee,
+            lpos       = self.lpos,
+            spos       = self.spos,
+            u_pnl      = self.unrealized,
+            r_pnl      = -1 * total_fee,
+            total_pnl  = self.unrealized + self.realized,
+            total_rpnl = self.realized,
+            )
         assert abs_pos == self.lpos + self.spos, 'Position Not Equal after Reverse Long'
         return 0
 
@@ -780,11 +791,7 @@ class backtest(object):
         
         self.lpos -= qty
         realized = self.GetRealize(self.long_avg_price, close_price, qty, 'long')
-        if self.lpos == 0:
-            self.long_avg_price = []
-            assert len(self.long_avg_price) == self.lpos, 'Queue and Pos length not match. Deque {}, lpos {}'.format(len(self.long_avg_price), self.lpos)
-        else:
-            self.long_avg_price = self.long_avg_price[qty:]
+        assert len(self.long_avg_price) == self.lpos, 'Queue and Pos length not match. Deque {}, lpos {}'.format(len(self.long_avg_price), self.lpos)
 
         lavg_price = self.GetAvgPrice(self.long_avg_price)
         savg_price = self.GetAvgPrice(self.short_avg_price)
@@ -792,30 +799,29 @@ class backtest(object):
         sunrealize = -1 * round((close_price - savg_price) * np.abs(self.spos) * self.size,2) if savg_price != 0 else 0
         self.unrealized = lunrealize + sunrealize
         self.realized   += (realized - total_fee)
-        self.reports.append({
-            'account_id': self.acc_id,
-            'order_id'  : self.order_id,
-            'datetime'  : self.index[i],
-            'code'      : self.contract,
-            'price'     : close_price,
-            'direction' : '多',
-            'action'    : action,
-            'volume'    : qty,
-            'value'     : qty * price * self.size,
-            'ex_fee'    : ex_fee,
-            'total_fee' : total_fee,
-            'lpos'      : self.lpos,
-            'spos'      : self.spos,
-            'total_pos' : self.lpos + self.spos,
-            'u_pnl'     : self.unrealized,
-            'r_pnl'     : realized - total_fee,
-            'total_pnl' : self.unrealized + self.realized,
-            'total_rpnl': self.realized,
-            })
+        self.reports.append(
+            account_id = self.acc_id,
+            order_id   = self.order_id,
+            datetime   = self.stamps[i],
+            code       = self.contract,
+            price      = close_price,
+            direction  = '多',
+            action     = action,
+            volume     = qty,
+            value      = qty * price * self.size,
+            ex_fee     = ex_fee,
+            total_fee  = total_fee,
+            lpos       = self.lpos,
+            spos       = self.spos,
+            u_pnl      = self.unrealized,
+            r_pnl      = realized - total_fee,
+            total_pnl  = self.unrealized + self.realized,
+            total_rpnl = self.realized,
+            )
 
         ex_fee, br_fee, rebate = self.GetFees(open_price, qty, action='open')
         total_fee = ex_fee + br_fee - rebate
-        self.short_avg_price = self.short_avg_price + [open_price] * qty
+        self.short_avg_price.push(open_price, qty)
         self.spos += qty
         self.realized += -total_fee
         self.open_pos += qty
@@ -824,178 +830,487 @@ class backtest(object):
         lunrealize =      round((close_price - lavg_price) * np.abs(self.lpos) * self.size,2) if lavg_price != 0 else 0
         sunrealize = -1 * round((close_price - savg_price) * np.abs(self.spos) * self.size,2) if savg_price != 0 else 0
         self.unrealized = lunrealize + sunrealize
-        self.reports.append({
-            'account_id': self.acc_id,
-            'order_id'  : self.order_id,
-            'datetime'  : self.index[i],
-            'code'      : self.contract,
-            'price'     : open_price,
-            'direction' : '空',
-            'action'    : '反开',
-            'volume'    : qty,
-            'value'     : qty * price * self.size,
-            'ex_fee'    : ex_fee,
-            'total_fee' : total_fee,
-            'lpos'      : self.lpos,
-            'spos'      : self.spos,
-            'total_pos' : self.lpos + self.spos,
-            'u_pnl'     : self.unrealized,
-            'r_pnl'     : -1 * total_fee,
-            'total_pnl' : self.unrealized + self.realized,
-            'total_rpnl': self.realized,
-            })
+        self.reports.append(
+            account_id = self.acc_id,
+            order_id   = self.order_id,
+            datetime   = self.stamps[i],
+            code       = self.contract,
+            price      = open_price,
+            direction  = '空',
+            action     = '反开',
+            volume     = qty,
+            value      = qty * price * self.size,
+            ex_fee     = ex_fee,
+            total_fee  = total_fee,
+            lpos       = self.lpos,
+            spos       = self.spos,
+            u_pnl      = self.unrealized,
+            r_pnl      = -1 * total_fee,
+            total_pnl  = self.unrealized + self.realized,
+            total_rpnl = self.realized,
+            )
         assert abs_pos == self.lpos + self.spos, 'Position Not Equal after Reverse Short'
         return 0
 
+    def GetQty(self, i, side, qty=None, legs=1):
+        """
+        Filled qty of an aggressive order at tick i under the fill model (side fills.BUY / SELL),
+        qty defaults to lot, reverse orders trade legs=2 times qty on one side
+        """
+        qty = self.lot if qty is None else qty
+        if self.caps is None:
+            return qty
+        return int(min(qty, self.caps[side][i] // legs))
+
+    def trade(self, action, price, i, side, legs=1, pos=None):
+        """
+        Send lot (at most pos when reducing a position) through the fill model, the unfilled part is cancelled
+        """
+        qty = self.GetQty(i, side, self.lot if pos is None else min(self.lot, pos), legs)
+        if qty > 0:
+            action(price, qty, i)
+        return 0
+
+    def exit_long(self, price, i):
+        """
+        平多仓, 成交不足时只减仓
+        """
+        qty = self.GetQty(i, fl.SELL, self.lpos)
+        if qty == self.lpos:
+            self.close_long(price, i)
+        elif qty > 0:
+            self.minus_long(price, qty, i)
+        return 0
+
+    def exit_short(self, price, i):
+        """
+        平空仓, 成交不足时只减仓
+        """
+        qty = self.GetQty(i, fl.BUY, self.spos)
+        if qty == self.spos:
+            self.close_short(price, i)
+        elif qty > 0:
+            self.minus_short(price, qty, i)
+        return 0
+
     def do_nothing(self):
         return 0
 
 
-    def run(self, df, date_str):
+    def run(self, df, date_str, engine='python'):
         """
         Input DataFrame For Training. Daily 
+        engine: 'python' 逐tick执行; 'numba' 编译主循环; 'event' 只在可能有动作的 tick 执行. 报表与 python 引擎一致
+        """
+        if not self.start(df, date_str):
+            return None
+        bp1, ap1, bv1, av1, price, time, sigl, sigs = self.arrays
+        upl, lwl = self.limits
+
+        if engine == 'numba':
+            self.RunCompiled(bp1, ap1, bv1, av1, price, time, sigl, sigs, upl, lwl)
+        elif engine == 'event':
+            self.RunEvents(bp1, ap1, time, sigl, sigs, upl, lwl)
+        elif engine == 'python':
+            # Main Loop
+            for i in range(len(time)):
+                if self.step(i):
+                    break
+        else:
+            raise ValueError('No such engine = {}'.format(engine))
+        self.end()
+        return None
+
+
+    def start(self, df, date_str):
+        """
+        Set up one trading day: contract spec, day arrays, limits and halt state.
+        Returns False when the backtest is terminated
         """
         # 当terminate True， 交易不进行
         try: 
             assert self.terminate == False
         except AssertionError:
             print('Date {} will not run: Backtest is terminated'.format(date_str))
-            return None
+            return False
 
         self.index         = df.index
+        self.stamps        = np.asarray(df.index, dtype='datetime64[ns]').view(np.int64)
         self.contract      = df['InstrumentID'].iloc[0]
+        if sp.GetRow(self.instrument, self.contract) != self.spec_row:
+            # 合约月份有单独的参数 (如交割月保证金)
+            self.SetSpec(sp.GetRow(self.instrument, self.contract))
         self.yst_pos       = self.open_pos
         self.open_pos      = 0
         self.ticks         += df.shape[0]
         self.halt          = False
 
         self.dates.append(date_str)
+        self.path = []
+        self.mark(-1)
         # ----- Data Array Set up for Main Logic -----
         bp1   = df['BidPrice1'].values
         bv1   = df['BidVolume1'].values
         ap1   = df['AskPrice1'].values
         av1   = df['AskVolume1'].values
         price = df['MidPrice'].values
-        time  = db.GetSecond(df.index)
+        time  = ss.GetTradingSeconds(self.stamps, self.instrument)
         sigl  = df['sigl'].values
         sigs  = df['sigs'].values 
 
         # ----- Value Set Up for this trading Day -----
         upl   = df['UpperLimitPrice'].iloc[0]
         lwl   = df['LowerLimitPrice'].iloc[0]
-        lot   = 1
-        t     = 0
         assert len(time) == len(bp1) == len(ap1), 'Length not Match'
 
-        # Main Loop
-        for i in range(len(time)):
-            if t > self.halt_time and (ap1[i] > upl - self.ticksize * self.stoplosstick or bp1[i] < lwl + self.ticksize * self.stoplosstick):
-            # 如果过了15分钟还是触发停盘condition， 当天交易终止
-                print('{} Stop Trading. Limit Reached after 15 mins'.format(self.index[i]))
+        self.arrays      = (bp1, ap1, bv1, av1, price, time, sigl, sigs)
+        self.limits      = (upl, lwl)
+        # 成交模型: 每个 tick 主动买/卖最多能成交的手数
+        self.caps        = None if self.fill is None else self.fill.GetCaps(bv1, av1, df['Volume'].values if 'Volume' in df else None)
+        self.downtime    = 0 # 停盘以后经过的时间
+        self.record_time = 0
+        return True
+
+    def end(self):
+        """
+        Close the trading day: mark to market equity of the day
+        """
+        bp1, ap1, bv1, av1, price = self.arrays[:5]
+        self.MarkToMarket(bp1, ap1, price)
+        return 0
+
+
+    def step(self, i):
+        """
+        One tick of the main loop, returns True when trading stops for the day
+        """
+        bp1, ap1, bv1, av1, price, time, sigl, sigs = self.arrays
+        upl, lwl = self.limits
+        if self.downtime > self.halt_time and (ap1[i] > upl - self.ticksize * self.stoplosstick or bp1[i] < lwl + self.ticksize * self.stoplosstick):
+        # 如果过了15分钟还是触发停盘condition， 当天交易终止
+            print('{} Stop Trading. Limit Reached after 15 mins'.format(self.index[i]))
+            return True
+        elif self.downtime < self.halt_time and self.halt:
+        # 计算停盘以后的 downtime 
+            self.downtime = time[i] - self.record_time
+
+        elif (self.lpos > 0 or self.spos > 0) and (ap1[i] > upl - (self.ticksize * self.stoplosstick) or bp1[i] < lwl + (self.ticksize * self.stoplosstick)):
+        # 接近涨跌停板， 触发交易暂停, 15分钟后恢复交易
+            self.close_all(bp1[i], ap1[i], i)
+            self.mark(i)
+            self.record_time = time[i]
+            self.halt = True
+            print('{} Stop Limit: Trading in Halt, Close All'.format(self.index[i]))
+            print('AP1 {} UpTrigger {} BP1 {} DNTrigger {}'.format(ap1[i], upl - (self.ticksize * self.stoplosstick),
+                                                                   bp1[i], lwl + (self.ticksize * self.stoplosstick)))
+        elif (self.lpos > 0 or self.spos > 0) and (sigl[i] == 6 or sigs[i] == 6): 
+        # 信号6， 不触发停止交易
+            self.close_all(bp1[i], ap1[i], i)
+            self.mark(i)
+            print('{} Signal 6: Close All'.format(self.index[i]))
+        elif (self.lpos > 0 or self.spos > 0) and self.IsFrozen(bp1[i], ap1[i]): 
+        # 总本金 (按盘口逐笔盯市) 少于保险线， 出发停止交易，交易永远终止
+            self.close_all(bp1[i], ap1[i], i)
+            self.mark(i)
+            self.terminate = True 
+            print('{} Under Margin: Close all, End Trading'.format(self.index[i]))
+            return True
+        else:
+            self.halt = False
+            if (sigl[i] > 0 or sigs[i] < 0):
+                # Check Position Available
+                max_available_pos = self.GetMaxPos(price[i]) # Use MidPrice to Estimate MaxPos
+                abs_pos = abs(self.lpos) + abs(self.spos)
+                self.order_id += 1
+                # Long Position Logic
+                if self.lpos == 0 and abs_pos < max_available_pos and av1[i] > 0: # 没有多仓 + 绝对仓位少于最大开仓数
+                    if sigl[i] == 1: # 开多仓
+                        self.trade(self.open_long, ap1[i], i, fl.BUY)
+
+                elif self.lpos > 0 and abs_pos < max_available_pos and av1[i] > 0: # 已有多仓位 + 绝对仓位少于最大开仓数
+                    if sigl[i] == 1: # 开多仓/加多仓
+                        self.trade(self.open_long, ap1[i], i, fl.BUY)
+                    elif sigl[i] == 3: # 减多仓
+                        self.trade(self.minus_long, bp1[i], i, fl.SELL, pos=self.lpos)
+                    elif sigl[i] == 4: # 平多仓
+                        self.exit_long(bp1[i], i)
+                    elif sigl[i] == 5: # 反手开空
+                        self.trade(self.reverse_short, ap1[i], i, fl.SELL, legs=2, pos=self.lpos)
+                    else:
+                        self.do_nothing()
+
+                elif self.lpos > 0 and abs_pos >= max_available_pos and av1[i] > 0: # 已有多仓为 + 绝对仓位 >= 最大开仓数
+                    if sigl[i] == 3: # 减多仓
+                        self.trade(self.minus_long, bp1[i], i, fl.SELL, pos=self.lpos)
+                    elif sigl[i] == 4: # 平多仓
+                        self.exit_long(bp1[i], i)
+                    elif sigl[i] == 5: # 反手开空
+                        self.trade(self.reverse_short, ap1[i], i, fl.SELL, legs=2, pos=self.lpos)
+                    else:
+                        self.do_nothing()
+                else:
+                    self.do_nothing()
+
+                # Short Position Logic
+                if self.spos == 0 and abs_pos < max_available_pos and bv1[i] > 0: # 没有空仓 + 绝对仓位少于最大开仓数
+                    if sigs[i] == -1: # 开多仓
+                        self.trade(self.open_short, ap1[i], i, fl.SELL)
+
+                elif self.spos > 0 and abs_pos < max_available_pos and bv1[i] > 0: # 已有空仓位 + 绝对仓位少于最大开仓数
+                    if sigs[i] == -1: # 加空仓
+                        self.trade(self.open_short, ap1[i], i, fl.SELL)
+                    elif sigs[i] == -3: # 减空仓
+                        self.trade(self.minus_short, ap1[i], i, fl.BUY, pos=self.spos)
+                    elif sigs[i] == -4: # 平空仓
+                        self.exit_short(ap1[i], i)
+                    elif sigs[i] == -5: # 反手开多
+                        self.trade(self.reverse_long, ap1[i], i, fl.BUY, legs=2, pos=self.spos)
+                    else:
+                        self.do_nothing()
+
+                elif self.spos > 0 and abs_pos >= max_available_pos and bv1[i] > 0: # 已有空仓为 + 绝对仓位 >= 最大开仓数
+                    if sigs[i] == -3: # 减空仓
+                        self.trade(self.minus_short, ap1[i], i, fl.BUY, pos=self.spos)
+                    elif sigs[i] == -4: # 平空仓
+                        self.exit_short(ap1[i], i)
+                    elif sigs[i] == -5: # 反手开多
+                        self.trade(self.reverse_long, ap1[i], i, fl.BUY, legs=2, pos=self.spos)
+                    else:
+                        self.do_nothing()
+                else:
+                    self.do_nothing()
+                self.mark(i)
+            #print(self.index[i], sigl[i], sigs[i], self.long_avg_price, self.short_avg_price)          
+            else:
+                self.do_nothing()
+        return False
+
+    def RunEvents(self, bp1, ap1, time, sigl, sigs, upl, lwl):
+        """
+        Event-sparse loop: step() only runs at ticks where something can happen, same result as the python loop.
+        Candidates are ticks near the price limits, ticks with a signal, the first tick under the freeze line
+        for the current position, and the end of a halt (ticks inside a halt only advance downtime)
+        """
+        n    = len(time)
+        near = (ap1 > upl - self.ticksize * self.stoplosstick) | (bp1 < lwl + self.ticksize * self.stoplosstick)
+        cand = np.flatnonzero(near | (sigl > 0) | (sigs < 0) | (sigl == 6) | (sigs == 6)).tolist() + [n]
+        i, c = -1, 0
+        while True:
+            if self.halt and self.downtime < self.halt_time:
+                # 停盘期间只更新 downtime, 直接跳到停盘结束的 tick
+                rest = time[i + 1:]
+                k = np.searchsorted(rest, self.record_time + self.halt_time, side='left')
+                # 二分用的是 record_time + halt_time, 边界上按 downtime 的原始算法校正
+                while k > 0 and rest[k - 1] - self.record_time >= self.halt_time:
+                    k -= 1
+                while k < len(rest) and rest[k] - self.record_time < self.halt_time:
+                    k += 1
+                if k == len(rest):
+                    self.downtime = rest[-1] - self.record_time if len(rest) > 0 else self.downtime
+                    break
+                i += 1 + k
+                self.downtime = rest[k] - self.record_time
+                continue
+            while cand[c] <= i:
+                c += 1
+            nxt = cand[c]
+            if self.halt:
+                nxt = min(nxt, i + 1)
+            if (self.lpos > 0 or self.spos > 0) and nxt > i + 1:
+                # 持仓不变, 盯市权益第一次低于保险线的 tick
+                under = self.capital + self.realized + self.GetMTM(bp1[i + 1:nxt], ap1[i + 1:nxt]) < self.capital * self.freeze_rate
+                if under.any():
+                    nxt = i + 1 + int(np.argmax(under))
+            if nxt >= n:
                 break
-            elif t < self.halt_time and self.halt:
-            # 计算停盘以后的 downtime 
-                t = time[i] - record_time
+            i = nxt
+            if self.step(i):
+                break
+        return 0
 
-            elif (self.lpos > 0 or self.spos > 0) and (ap1[i] > upl - (self.ticksize * self.stoplosstick) or bp1[i] < lwl + (self.ticksize * self.stoplosstick)):
-            # 接近涨跌停板， 触发交易暂停, 15分钟后恢复交易
+    def RunCompiled(self, bp1, ap1, bv1, av1, price, time, sigl, sigs, upl, lwl):
+        """
+        编译引擎: engine.RunTicks 决定每个tick的动作, 再由 replay 逐个重放生成报表
+        """
+        if eg.njit is None:
+            raise ImportError("engine='numba' requires numba")
+        n = len(time)
+        p = np.array([self.ticksize, self.size, self.margin, self.slippage, self.capital,
+                      self.broker_rate, self.ex_rebate, self.br_rebate,
+                      self.freeze_rate, self.stoplosstick, self.halt_time, self.lot,
+                      *self.fees[0], *self.fees[1], *self.fees[2]], dtype=np.float64)
+        s = np.array([self.lpos, self.spos, self.yst_pos, self.open_pos,
+                      self.realized, self.unrealized, self.order_id, self.halt,
+                      self.long_avg_price.cost, self.short_avg_price.cost, self.terminate], dtype=np.float64)
+        # 一个 tick 同一边最多 push 两次 (开仓 + 反手), head 只前进, pop 不释放空间
+        lq, lv = self.long_avg_price.ToArrays(extra=2 * n + 1)
+        sq, sv = self.short_avg_price.ToArrays(extra=2 * n + 1)
+        lh = np.array([0, len(self.long_avg_price.lots)], dtype=np.int64)
+        sh = np.array([0, len(self.short_avg_price.lots)], dtype=np.int64)
+        ev_i = np.zeros(2 * n + 1, dtype=np.int64)
+        ev_c = np.zeros(2 * n + 1, dtype=np.int64)
+        ev_o = np.zeros(2 * n + 1, dtype=np.float64)
+        qb, qs = self.caps if self.caps is not None else (np.full(n, np.inf), np.full(n, np.inf))
+        k = eg.RunTicks(np.asarray(bp1, dtype=np.float64), np.asarray(ap1, dtype=np.float64),
+                        np.asarray(bv1, dtype=np.float64), np.asarray(av1, dtype=np.float64),
+                        np.asarray(price, dtype=np.float64), np.asarray(time, dtype=np.float64),
+                        np.asarray(sigl, dtype=np.float64), np.asarray(sigs, dtype=np.float64), qb, qs,
+                        float(upl), float(lwl), p, s, lq, lv, lh, sq, sv, sh, ev_i, ev_c, ev_o)
+        self.replay(ev_i[:k], ev_c[:k], ev_o[:k], bp1, ap1, upl, lwl)
+        self.order_id = int(s[eg.S_ORDER_ID])
+        self.halt     = bool(s[eg.S_HALT])
+        assert self.lpos == s[eg.S_LPOS] and self.spos == s[eg.S_SPOS], 'Compiled engine and replay not match'
+        return None
+
+    def replay(self, ev_i, ev_c, ev_o, bp1, ap1, upl, lwl):
+        """
+        按顺序重放事件 (tick index, event code, order id), 调用与 python 引擎相同的动作
+        """
+        for i, code, order_id in zip(ev_i.tolist(), ev_c.tolist(), ev_o.tolist()):
+            self.order_id = int(order_id)
+            if code == eg.OPEN_LONG:
+                self.trade(self.open_long, ap1[i], i, fl.BUY)
+            elif code == eg.MINUS_LONG:
+                self.trade(self.minus_long, bp1[i], i, fl.SELL, pos=self.lpos)
+            elif code == eg.CLOSE_LONG:
+                self.exit_long(bp1[i], i)
+            elif code == eg.REVERSE_SHORT:
+                self.trade(self.reverse_short, ap1[i], i, fl.SELL, legs=2, pos=self.lpos)
+            elif code == eg.OPEN_SHORT:
+                self.trade(self.open_short, ap1[i], i, fl.SELL)
+            elif code == eg.MINUS_SHORT:
+                self.trade(self.minus_short, ap1[i], i, fl.BUY, pos=self.spos)
+            elif code == eg.CLOSE_SHORT:
+                self.exit_short(ap1[i], i)
+            elif code == eg.REVERSE_LONG:
+                self.trade(self.reverse_long, ap1[i], i, fl.BUY, legs=2, pos=self.spos)
+            elif code == eg.HALT_CLOSE:
                 self.close_all(bp1[i], ap1[i], i)
-                record_time = time[i]
-                self.halt = True
                 print('{} Stop Limit: Trading in Halt, Close All'.format(self.index[i]))
                 print('AP1 {} UpTrigger {} BP1 {} DNTrigger {}'.format(ap1[i], upl - (self.ticksize * self.stoplosstick),
                                                                        bp1[i], lwl + (self.ticksize * self.stoplosstick)))
-            elif (self.lpos > 0 or self.spos > 0) and (sigl[i] == 6 or sigs[i] == 6): 
-            # 信号6， 不触发停止交易
+            elif code == eg.SIGNAL_CLOSE:
                 self.close_all(bp1[i], ap1[i], i)
                 print('{} Signal 6: Close All'.format(self.index[i]))
-            elif (self.lpos > 0 or self.spos > 0) and (self.capital + self.realized + self.unrealized < self.capital * self.freeze_rate): 
-            # 总本金少于保险线， 出发停止交易，交易永远终止
+            elif code == eg.FREEZE_CLOSE:
                 self.close_all(bp1[i], ap1[i], i)
-                self.terminate = True 
+                self.terminate = True
                 print('{} Under Margin: Close all, End Trading'.format(self.index[i]))
-                break
+            elif code == eg.LIMIT_STOP:
+                print('{} Stop Trading. Limit Reached after 15 mins'.format(self.index[i]))
             else:
-                self.halt = False
-                if (sigl[i] > 0 or sigs[i] < 0):
-                    # Check Position Available
-                    max_available_pos = self.GetMaxPos(price[i]) # Use MidPrice to Estimate MaxPos
-                    abs_pos = abs(self.lpos) + abs(self.spos)
-                    self.order_id += 1
-                    # Long Position Logic
-                    if self.lpos == 0 and abs_pos < max_available_pos and av1[i] > 0: # 没有多仓 + 绝对仓位少于最大开仓数
-                        if sigl[i] == 1: # 开多仓
-                            self.open_long(ap1[i], self.lot, i)
-
-                    elif self.lpos > 0 and abs_pos < max_available_pos and av1[i] > 0: # 已有多仓位 + 绝对仓位少于最大开仓数
-                        if sigl[i] == 1: # 开多仓/加多仓
-                            self.open_long(ap1[i], self.lot, i)
-                        elif sigl[i] == 3: # 减多仓
-                            self.minus_long(bp1[i], self.lot, i)
-                        elif sigl[i] == 4: # 平多仓
-                            self.close_long(bp1[i], i)
-                        elif sigl[i] == 5: # 反手开空
-                            self.reverse_short(ap1[i], self.lot, i)
-                        else:
-                            self.do_nothing()
-
-                    elif self.lpos > 0 and abs_pos >= max_available_pos and av1[i] > 0: # 已有多仓为 + 绝对仓位 >= 最大开仓数
-                        if sigl[i] == 3: # 减多仓
-                            self.minus_long(bp1[i], self.lot, i)
-                        elif sigl[i] == 4: # 平多仓
-                            self.close_long(bp1[i], i)
-                        elif sigl[i] == 5: # 反手开空
-                            self.reverse_short(ap1[i], self.lot, i)
-                        else:
-                            self.do_nothing()
-                    else:
-                        self.do_nothing()
-
-                    # Short Position Logic
-                    if self.spos == 0 and abs_pos < max_available_pos and bv1[i] > 0: # 没有空仓 + 绝对仓位少于最大开仓数
-                        if sigs[i] == -1: # 开多仓
-                            self.open_short(ap1[i], self.lot, i)
-
-                    elif self.spos > 0 and abs_pos < max_available_pos and bv1[i] > 0: # 已有空仓位 + 绝对仓位少于最大开仓数
-                        if sigs[i] == -1: # 加空仓
-                            self.open_short(ap1[i], self.lot, i)    
-                        elif sigs[i] == -3: # 减空仓
-                            self.minus_short(ap1[i], self.lot, i)
-                        elif sigs[i] == -4: # 平空仓
-                            self.close_short(ap1[i], i)
-                        elif sigs[i] == -5: # 反手开多
-                            self.reverse_long(ap1[i], self.lot, i)
-                        else:
-                            self.do_nothing()
-
-                    elif self.spos > 0 and abs_pos >= max_available_pos and bv1[i] > 0: # 已有空仓为 + 绝对仓位 >= 最大开仓数
-                        if sigs[i] == -3: # 减空仓
-                            self.minus_short(ap1[i], self.lot, i)
-                        elif sigs[i] == -4: # 平空仓
-                            self.close_short(ap1[i], i)
-                        elif sigs[i] == -5: # 反手开多
-                            self.reverse_long(ap1[i], self.lot, i)
-                        else:
-                            self.do_nothing()
-                    else:
-                        self.do_nothing()
-                #print(self.index[i], sigl[i], sigs[i], self.long_avg_price, self.short_avg_price)          
-                else:
-                    self.do_nothing()
-
-        
-        return None
+                raise ValueError('No such event code = {}'.format(code))
+            self.mark(i)
+        return 0
 
-    
     def result(self):
         """
         ----- 结算表 -----
         """
-        res = pd.DataFrame(self.reports)
-        res['total_pnl'] = res['total_pnl'] + self.capital
-        res['total_rpnl'] = res['total_rpnl'] + self.capital
-        return res
+        return self.reports.frame(self.capital).copy()
     
+    def equity(self):
+        """
+        ----- 逐 tick 盯市权益 -----
+        pnl (realized + MTM), equity, used margin and margin usage for every day run
+        """
+        stamps = np.concatenate([start + offset.astype(np.int64) * 1_000_000 for start, offset, _, _ in self.mtm])
+        pnl    = np.concatenate([x[2] for x in self.mtm]).astype(np.float64)
+        margin = np.concatenate([x[3] for x in self.mtm]).astype(np.float64)
+        res = pd.DataFrame({'pnl': pnl, 'equity': self.capital + pnl, 'margin': margin},
+                           index=pd.DatetimeIndex(stamps.astype('datetime64[ns]'), name='datetime'))
+        res['usage'] = res['margin'] / res['equity']
+        return res
+
+    def GetState(self, history=True, fills=0, days=0):
+        """
+        ----- 状态快照 -----
+        Engine state between trading days as a dict of arrays: positions, FIFO lots (with running cost),
+        PnL, order counter and the journal / equity offsets. history adds the fills and the daily
+        equity arrays, so a new process can resume with the full reports. fills / days: history only
+        from that fill / day on, for incremental checkpoints applied on top of the earlier ones
+        """
+        lq, lv = self.long_avg_price.ToArrays()
+        sq, sv = self.short_avg_price.ToArrays()
+        state = {name: np.array(getattr(self, name)) for name in STATE_FIELDS}
+        state.update({
+            'version'   : np.array(STATE_VERSION),
+            'instrument': np.array(self.instrument),
+            'dates'     : np.array(self.dates, dtype=str),
+            'long_lots' : np.stack([lq, lv]),
+            'short_lots': np.stack([sq, sv]),
+            'lcost'     : np.array(self.long_avg_price.cost),
+            'scost'     : np.array(self.short_avg_price.cost),
+            'journal'   : np.array(len(self.reports)),
+            'days'      : np.array(len(self.mtm)),
+        })
+        if history:
+            mtm = self.mtm[days:]
+            state.update(self.reports.GetState(fills))
+            state['mtm_first'] = np.array(days)
+            state['mtm_start'] = np.array([x[0] for x in mtm], dtype=np.int64)
+            state['mtm_len']   = np.array([len(x[1]) for x in mtm], dtype=np.int64)
+            for k, name in [(1, 'mtm_offset'), (2, 'mtm_pnl'), (3, 'mtm_margin')]:
+                state[name] = np.concatenate([x[k] for x in mtm]) if len(mtm) > 0 else np.zeros(0, dtype=np.float32)
+        return state
+
+    def SetState(self, state):
+        """
+        Restore a GetState snapshot. Without history the reports and equity kept in this object
+        are cut back to the snapshot offsets (rewind / fork from an earlier day). Incremental history
+        (fills / days > 0) replaces what this object holds after those offsets
+        """
+        assert int(state['version']) == STATE_VERSION, 'State version {} not supported'.format(state['version'])
+        assert str(state['instrument']) == self.instrument, 'State of {} cannot restore {}'.format(state['instrument'], self.instrument)
+        self.SetSpec(int(state['spec_row']))
+        for name in STATE_FIELDS:
+            setattr(self, name, state[name].item())
+        self.dates = [str(x) for x in state['dates']]
+        self.long_avg_price.FromArrays(state['long_lots'][0], state['long_lots'][1], state['lcost'].item())
+        self.short_avg_price.FromArrays(state['short_lots'][0], state['short_lots'][1], state['scost'].item())
+        if 'journal_order_id' in state:
+            days = int(state['mtm_first']) if 'mtm_first' in state else 0
+            assert days <= len(self.mtm), 'Equity has {} days, cannot append from {}'.format(len(self.mtm), days)
+            self.reports.SetState(state)
+            bounds = np.concatenate([[0], np.cumsum(state['mtm_len'])])
+            self.mtm = self.mtm[:days] + [(int(start), state['mtm_offset'][a:b], state['mtm_pnl'][a:b], state['mtm_margin'][a:b])
+                                          for start, a, b in zip(state['mtm_start'], bounds[:-1], bounds[1:])]
+        else:
+            self.reports.truncate(min(int(state['journal']), len(self.reports)))
+            self.mtm = self.mtm[:int(state['days'])]
+        assert len(self.long_avg_price) == self.lpos and len(self.short_avg_price) == self.spos, 'Lots and Pos not match'
+        return 0
+
+    def save(self, path, history=True, fills=0, days=0):
+        """
+        Write GetState to an .npz file, replaced atomically so a crash keeps the last checkpoint
+        """
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, **self.GetState(history, fills, days))
+        os.replace(tmp, path)
+        return 0
+
+    def restore(self, path):
+        """
+        path: .npz from save, or a directory of incremental day checkpoints (runner.GetBacktest)
+        restored in file name order
+        """
+        paths = sorted(p for p in glob.glob(os.path.join(path, '*.npz')) if not p.endswith('.tmp.npz')) if os.path.isdir(path) else [path]
+        for p in paths:
+            with np.load(p) as state:
+                self.SetState(dict(state))
+        return 0
+
+    def fork(self, **attrs):
+        """
+        Independent copy for a what-if branch, attrs (freeze_rate, slippage, ...) set on the copy
+        """
+        bt = copy.deepcopy(self)
+        for k, v in attrs.items():
+            assert hasattr(bt, k), 'No such backtest param = {}'.format(k)
+            setattr(bt, k, v)
+        return bt
+
     def account(self):
         """
         ----- 账号设定 -----
@@ -1023,19 +1338,20 @@ class backtest(object):
         清仓次数。 多仓，空仓。
         `
         """
-        res = pd.DataFrame(self.reports)
-        res['total_pnl'] = res['total_pnl'] + self.capital
-        res['total_rpnl'] = res['total_rpnl'] + self.capital
+        res   = self.reports.frame(self.capital)
+        flags = mt.EncodeReport(res)['flags']
+        long  = (res['direction'] == '多').values
+        short = (res['direction'] == '空').values
         stats = pd.DataFrame({
-            '开多': len(res[(res['direction']== '多') & (res['action'].str.contains('开'))]),
-            '开空': len(res[(res['direction']== '空') & (res['action'].str.contains('开'))]),
-            '减多': len(res[(res['direction']== '多') & (res['action'].str.contains('减'))]),
-            '减空': len(res[(res['direction']== '空') & (res['action'].str.contains('减'))]),
-            '反开': len(res[(res['direction']== '多') & (res['action'].str.contains('反'))]),
-            '反空': len(res[(res['direction']== '空') & (res['action'].str.contains('反'))]),
-            '平开': len(res[(res['direction']== '多') & (res['action'].str.contains('平'))]),
-            '平空': len(res[(res['direction']== '空') & (res['action'].str.contains('平'))]),
-            '全平(双边)': len(res[(res['action'].str.contains('清'))]),
+            '开多': int(np.sum(long  & flags['开'])),
+            '开空': int(np.sum(short & flags['开'])),
+            '减多': int(np.sum(long  & flags['减'])),
+            '减空': int(np.sum(short & flags['减'])),
+            '反开': int(np.sum(long  & flags['反'])),
+            '反空': int(np.sum(short & flags['反'])),
+            '平开': int(np.sum(long  & flags['平'])),
+            '平空': int(np.sum(short & flags['平'])),
+            '全平(双边)': int(np.sum(flags['清'])),
         }, index=['Value'])
         return stats
 
@@ -1049,34 +1365,14 @@ class backtest(object):
         Tick Modelled. Bar Modelled.
         """
 
-        res = pd.DataFrame(self.reports)
-        res['total_pnl'] = res['total_pnl'] + self.capital
-        res['total_rpnl'] = res['total_rpnl'] + self.capital
-        metric = pd.DataFrame({
-                'Ticks Modelled': int(self.ticks),
-                'Initial Capital': self.capital,
-                'Final Capital': res['total_rpnl'].iloc[-1],
-                'Realized PnL': res['r_pnl'].sum(),
-                'Return': round((res['total_rpnl'].iloc[-1] / self.capital  - 1) * 100,1) ,
-                'MaxDrawdown': mt.GetDrawdown(res, ratio=False),
-                'MaxDrawdown Ratio': mt.GetDrawdown(res, ratio=True),
-                'Win Rate': mt.GetWinRate(res),
-                'Win Rate (Long)': mt.GetWinRate(res, side='long'),
-                'Win Rate (Short)': mt.GetWinRate(res, side='short'),
-                'PnL Ratio': mt.GetPnLRatio(res),
-                'PnL Ratio (Long)': mt.GetPnLRatio(res, side='long'),
-                'PnL Ratio (Short)': mt.GetPnLRatio(res, side='short'),
-                'EPO': mt.GetEPO(res),
-                'EPO (Long)': mt.GetEPO(res, 'long'),
-                'EPO (Short)': mt.GetEPO(res, 'short'),
-            }, index=['Value'])
+        res = self.reports.frame(self.capital)
+        metric = mt.GetAccount(res, self.ticks, self.capital)
+        metric.index = ['Value']
         return metric
 
     def plot(self):
-        res = pd.DataFrame(self.reports)
-        res['total_pnl'] = res['total_pnl'] + self.capital
-        res['total_rpnl'] = res['total_rpnl'] + self.capital
-        res.set_index('datetime', inplace=True)
+        res = self.reports.frame(self.capital)
+        res = res.set_index('datetime')
         fig = plt.figure(figsize=(10, 4))
         plt.plot(res['total_pnl'], '-', color='blue', label='Unrealize PnL')
         plt.plot(res['total_rpnl'], '-', color='red', label='Realize PnL')
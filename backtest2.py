@@ -1,8 +1,11 @@
 import numpy as np
 import pandas as pd
 import database as db
+import specs as sp
+import sessions as ss
 from math import floor
-from collections import deque
+from ledger import ledger
+from journal import journal
 
 
 class backtest(object):
@@ -17,12 +20,8 @@ class backtest(object):
                 ):
 
         # Bacaktest Param
-        self.open_fee       = db.GetFees(instrument, 'open')
-        self.close_tdy_fee  = db.GetFees(instrument, 'closeT')
-        self.close_yst_fee  = db.GetFees(instrument, 'closeN')
-        self.ticksize       = db.GetTickSize(instrument)
-        self.size           = db.GetContractSize(instrument)
-        self.margin         = db.GetMargin(instrument)
+        self.SetSpec(sp.GetRow(instrument))
+        self.instrument     = instrument
         self.slippage       = slippage
         self.acc_id         = acc_id
         self.capital        = capital
@@ -31,11 +30,11 @@ class backtest(object):
         self.br_rebate      = br_rebate
 
         # Metric Param
-        self.reports         = []
+        self.reports         = journal()
         self.lpos            = 0
         self.spos            = 0
-        self.long_avg_price  = []
-        self.short_avg_price = [] 
+        self.long_avg_price  = ledger()
+        self.short_avg_price = ledger()
         self.realized        = 0
         self.unrealized      = 0
         self.yst_pos         = 0
@@ -43,22 +42,25 @@ class backtest(object):
         self.order_id        = 0
         self.ticks           = 0
         
+    def SetSpec(self, row):
+        """
+        Tick size, contract size, margin and fee kernels from specs row
+        """
+        spec = sp.SPECS[row]
+        self.spec_row = row
+        self.fees     = sp.GetFeeKernel(spec).tolist() # [open, closeT, closeN] x (rate, flat)
+        self.ticksize = float(spec['ticksize'])
+        self.size     = float(spec['size'])
+        self.margin   = float(spec['margin'])
+        return 0
+
     # Calculate Fees
     def GetFees(self, price, qty, action='open'):
-        if action == 'open':
-            fee = self.open_fee
-        elif action == 'closeT':
-            fee = self.close_tdy_fee
-        elif action == 'closeN':
-            fee = self.close_yst_fee
-        else:
+        if action not in sp.FEE_ACTIONS:
             print('Cannot understand action {}'.format(action))
             raise TypeError
-
-        if fee < 1:
-            ex_fee = round(price * qty * fee * self.size, 2) 
-        else:    
-            ex_fee = round(qty * fee, 2)
+        rate, flat = self.fees[sp.FEE_ACTIONS[action]]
+        ex_fee = round(price * qty * rate * self.size + qty * flat, 2)
                 
         if self.broker_rate < 1:
             br_fee = ex_fee * (1 + self.broker_rate)
@@ -81,16 +83,14 @@ class backtest(object):
         maxpos = floor((current_capital - used_margin) / margin)
         return maxpos
 
-    def GetAvgPrice(self, q:list):
-        if len(q) != 0:
-            avg_price = sum(q) / len(q)
-        else:
-            avg_price = 0
-        return avg_price
+    def GetAvgPrice(self, q:ledger):
+        return q.avg()
 
-    def GetRealize(self, q, price, qty, side):
-        x = q[:qty]
-        avg = sum(x) / len(x)
+    def GetRealize(self, q:ledger, price, qty, side):
+        """
+        FIFO: pop qty lots from ledger q and realize against price
+        """
+        avg = q.pop(qty) / qty
         if side == 'long':
             realize = round((price - avg) * self.size * qty,2)
         elif side == 'short':
@@ -109,7 +109,7 @@ class backtest(object):
         open_price = price + self.slippage * self.ticksize 
         ex_fee, br_fee, rebate = self.GetFees(open_price, qty, action='open')
         total_fee = ex_fee + br_fee - rebate
-        self.long_avg_price = self.long_avg_price + [open_price] * qty
+        self.long_avg_price.push(open_price, qty)
         self.lpos += qty
         self.realized += -total_fee
         self.open_pos += qty
@@ -118,26 +118,25 @@ class backtest(object):
         lunrealize =      round((open_price - lavg_price) * np.abs(self.lpos) * self.size,2) if lavg_price != 0 else 0
         sunrealize = -1 * round((open_price - savg_price) * np.abs(self.spos) * self.size,2) if savg_price != 0 else 0
         self.unrealized = lunrealize + sunrealize
-        self.reports.append({
-            'account_id': self.acc_id,
-            'order_id'  : self.order_id,
-            'datetime'  : self.index[i],
-            'code'      : self.contract,
-            'price'     : open_price,
-            'direction' : '多',
-            'action'    : '开',
-            'volume'    : qty,
-            'value'     : qty * price * self.size,
-            'ex_fee'    : ex_fee,
-            'total_fee' : total_fee,
-            'lpos'      : self.lpos,
-            'spos'      : self.spos,
-            'total_pos' : self.lpos + self.spos,
-            'u_pnl'     : self.unrealized,
-            'r_pnl'     : -1 * total_fee,
-            'total_pnl' : self.unrealized + self.realized,
-            'total_rpnl': self.realized,
-            })
+        self.reports.append(
+            account_id = self.acc_id,
+            order_id   = self.order_id,
+            datetime   = self.stamps[i],
+            code       = self.contract,
+            price      = open_price,
+            direction  = '多',
+            action     = '开',
+            volume     = qty,
+            value      = qty * price * self.size,
+            ex_fee     = ex_fee,
+            total_fee  = total_fee,
+            lpos       = self.lpos,
+            spos       = self.spos,
+            u_pnl      = self.unrealized,
+            r_pnl      = -1 * total_fee,
+            total_pnl  = self.unrealized + self.realized,
+            total_rpnl = self.realized,
+            )
         return 0
 
     def open_short(self, price, qty, i):
@@ -148,7 +147,7 @@ class backtest(object):
         open_price = price - self.slippage * self.ticksize
         ex_fee, br_fee, rebate = self.GetFees(open_price, qty, action='open')
         total_fee = ex_fee + br_fee - rebate
-        self.short_avg_price = self.short_avg_price + [open_price] * qty
+        self.short_avg_price.push(open_price, qty)
         self.spos += qty
         self.realized += -total_fee
         self.open_pos += qty
@@ -157,26 +156,25 @@ class backtest(object):
         lunrealize =      round((open_price - lavg_price) * np.abs(self.lpos) * self.size,2) if lavg_price != 0 else 0
         sunrealize = -1 * round((open_price - savg_price) * np.abs(self.spos) * self.size,2) if savg_price != 0 else 0
         self.unrealized = lunrealize + sunrealize
-        self.reports.append({
-            'account_id': self.acc_id,
-            'order_id'  : self.order_id,
-            'datetime'  : self.index[i],
-            'code'      : self.contract,
-            'price'     : open_price,
-            'direction' : '空',
-            'action'    : '开',
-            'volume'    : qty,
-            'value'     : qty * price * self.size,
-            'ex_fee'    : ex_fee,
-            'total_fee' : total_fee,
-            'lpos'      : self.lpos,
-            'spos'      : self.spos,
-            'total_pos' : self.lpos + self.spos,
-            'u_pnl'     : self.unrealized,
-            'r_pnl'     : -1 * total_fee,
-            'total_pnl' : self.unrealized + self.realized,
-            'total_rpnl': self.realized,
-            })
+        self.reports.append(
+            account_id = self.acc_id,
+            order_id   = self.order_id,
+            datetime   = self.stamps[i],
+            code       = self.contract,
+            price      = open_price,
+            direction  = '空',
+            action     = '开',
+            volume     = qty,
+            value      = qty * price * self.size,
+            ex_fee     = ex_fee,
+            total_fee  = total_fee,
+            lpos       = self.lpos,
+            spos       = self.spos,
+            u_pnl      = self.unrealized,
+            r_pnl      = -1 * total_fee,
+            total_pnl  = self.unrealized + self.realized,
+            total_rpnl = self.realized,
+            )
         return 0
 
     def add_long(self, price, qty, i):
@@ -187,7 +185,7 @@ class backtest(object):
         open_price = price + self.slippage * self.ticksize
         ex_fee, br_fee, rebate = self.GetFees(open_price, qty, action='open')
         total_fee = ex_fee + br_fee - rebate
-        self.long_avg_price = self.long_avg_price + [open_price] * qty
+        self.long_avg_price.push(open_price, qty)
         self.lpos += qty
         self.realized += -total_fee
         self.open_pos += qty
@@ -196,26 +194,25 @@ class backtest(object):
         lunrealize =      round((open_price - lavg_price) * np.abs(self.lpos) * self.size,2) if lavg_price != 0 else 0
         sunrealize = -1 * round((open_price - savg_price) * np.abs(self.spos) * self.size,2) if savg_price != 0 else 0
         self.unrealized = lunrealize + sunrealize
-        self.reports.append({
-            'account_id': self.acc_id,
-            'order_id'  : self.order_id,
-            'datetime'  : self.index[i],
-            'code'      : self.contract,
-            'price'     : open_price,
-            'direction' : '多',
-            'action'    : '加',
-            'volume'    : qty,
-            'value'     : qty * price * self.size,
-            'ex_fee'    : ex_fee,
-            'total_fee' : total_fee,
-            'lpos'      : self.lpos,
-            'spos'      : self.spos,
-            'total_pos' : self.lpos + self.spos,
-            'u_pnl'     : self.unrealized,
-            'r_pnl'     : -1 * total_fee,
-            'total_pnl' : self.unrealized + self.realized,
-            'total_rpnl': self.realized,
-            })
+        self.reports.append(
+            account_id = self.acc_id,
+            order_id   = self.order_id,
+            datetime   = self.stamps[i],
+            code       = self.contract,
+            price      = open_price,
+            direction  = '多',
+            action     = '加',
+            volume     = qty,
+            value      = qty * price * self.size,
+            ex_fee     = ex_fee,
+            total_fee  = total_fee,
+            lpos       = self.lpos,
+            spos       = self.spos,
+            u_pnl      = self.unrealized,
+            r_pnl      = -1 * total_fee,
+            total_pnl  = self.unrealized + self.realized,
+            total_rpnl = self.realized,
+            )
         return 0
 
     def add_short(self, price, qty, i):
@@ -226,7 +223,7 @@ class backtest(object):
         open_price = price - self.slippage * self.ticksize
         ex_fee, br_fee, rebate = self.GetFees(open_price, qty, action='open')
         total_fee = ex_fee + br_fee - rebate
-        self.short_avg_price = self.short_avg_price + [open_price] * qty
+        self.short_avg_price.push(open_price, qty)
         self.spos += qty
         self.realized += -total_fee
         self.open_pos += qty
@@ -235,26 +232,25 @@ class backtest(object):
         lunrealize =      round((open_price - lavg_price) * np.abs(self.lpos) * self.size,2) if lavg_price != 0 else 0
         sunrealize = -1 * round((open_price - savg_price) * np.abs(self.spos) * self.size,2) if savg_price != 0 else 0
         self.unrealized = lunrealize + sunrealize
-        self.reports.append({
-            'account_id': self.acc_id,
-            'order_id'  : self.order_id,
-            'datetime'  : self.index[i],
-            'code'      : self.contract,
-            'price'     : open_price,
-            'direction' : '空',
-            'action'    : '加',
-            'volume'    : qty,
-            'value'     : qty * price * self.size,
-            'ex_fee'    : ex_fee,
-            'total_fee' : total_fee,
-            'lpos'      : self.lpos,
-            'spos'      : self.spos,
-            'total_pos' : self.lpos + self.spos,
-            'u_pnl'     : self.unrealized,
-            'r_pnl'     : -1 * total_fee,
-            'total_pnl' : self.unrealized + self.realized,
-            'total_rpnl': self.realized,
-            })
+        self.reports.append(
+            account_id = self.acc_id,
+            order_id   = self.order_id,
+            datetime   = self.stamps[i],
+            code       = self.contract,
+            price      = open_price,
+            direction  = '空',
+            action     = '加',
+            volume     = qty,
+            value      = qty * price * self.size,
+            ex_fee     = ex_fee,
+            total_fee  = total_fee,
+            lpos       = self.lpos,
+            spos       = self.spos,
+            u_pnl      = self.unrealized,
+            r_pnl      = -1 * total_fee,
+            total_pnl  = self.unrealized + self.realized,
+            total_rpnl = self.realized,
+            )
         return 0
 
     def minus_long(self, price, qty, i):
@@ -287,11 +283,7 @@ class backtest(object):
         # Realize PNL -> FIFO
         self.lpos -= qty
         realized = self.GetRealize(self.long_avg_price, close_price, qty, 'long')
-        if self.lpos == 0:
-            self.long_avg_price = []
-            assert len(self.long_avg_price) == self.lpos, 'Queue and Pos length not match. Deque {}, lpos {}'.format(len(self.long_avg_price), self.lpos)
-        else:
-            self.long_avg_price = self.long_avg_price[qty:]
+        assert len(self.long_avg_price) == self.lpos, 'Queue and Pos length not match. Deque {}, lpos {}'.format(len(self.long_avg_price), self.lpos)
 
         lavg_price = self.GetAvgPrice(self.long_avg_price)
         savg_price = self.GetAvgPrice(self.short_avg_price)
@@ -299,26 +291,25 @@ class backtest(object):
         sunrealize = -1 * round((close_price - savg_price) * np.abs(self.spos) * self.size,2) if savg_price != 0 else 0
         self.unrealized = lunrealize + sunrealize
         self.realized   += (realized - total_fee)
-        self.reports.append({
-            'account_id': self.acc_id,
-            'order_id'  : self.order_id,
-            'datetime'  : self.index[i],
-            'code'      : self.contract,
-            'price'     : close_price,
-            'direction' : '多',
-            'action'    : action,
-            'volume'    : qty,
-            'value'     : qty * price * self.size,
-            'ex_fee'    : ex_fee,
-            'total_fee' : total_fee,
-            'lpos'      : self.lpos,
-            'spos'      : self.spos,
-            'total_pos' : self.lpos + self.spos,
-            'u_pnl'     : self.unrealized,
-            'r_pnl'     : realized - total_fee,
-            'total_pnl' : self.unrealized + self.realized,
-            'total_rpnl': self.realized,
-            })
+        self.reports.append(
+            account_id = self.acc_id,
+            order_id   = self.order_id,
+            datetime   = self.stamps[i],
+            code       = self.contract,
+            price      = close_price,
+            direction  = '多',
+            action     = action,
+            volume     = qty,
+            value      = qty * price * self.size,
+            ex_fee     = ex_fee,
+            total_fee  = total_fee,
+            lpos       = self.lpos,
+            spos       = self.spos,
+            u_pnl      = self.unrealized,
+            r_pnl      = realized - total_fee,
+            total_pnl  = self.unrealized + self.realized,
+            total_rpnl = self.realized,
+            )
         return 0
 
     def minus_short(self, price, qty, i):
@@ -350,11 +341,7 @@ class backtest(object):
 
         self.spos -= qty
         realized = self.GetRealize(self.short_avg_price, close_price, qty, 'short')
-        if self.spos == 0:
-            self.short_avg_price = []
-            assert len(self.short_avg_price) == self.spos, 'Queue and Pos length not match. Deque {}, spos {}'.format(len(self.short_avg_price), self.spos)
-        else:
-            self.short_avg_price = self.short_avg_price[qty:]
+        assert len(self.short_avg_price) == self.spos, 'Queue and Pos length not match. Deque {}, spos {}'.format(len(self.short_avg_price), self.spos)
 
         lavg_price = self.GetAvgPrice(self.long_avg_price)
         savg_price = self.GetAvgPrice(self.short_avg_price)
@@ -362,26 +349,25 @@ class backtest(object):
         sunrealize = -1 * round((close_price - savg_price) * np.abs(self.spos) * self.size,2) if savg_price != 0 else 0
         self.unrealized = lunrealize + sunrealize
         self.realized += (realized - total_fee)
-        self.reports.append({
-            'account_id': self.acc_id,
-            'order_id'  : self.order_id,
-            'datetime'  : self.index[i],
-            'code'      : self.contract,
-            'price'     : close_price,
-            'direction' : '空',
-            'action'    : action,
-            'volume'    : qty,
-            'value'     : qty * price * self.size,
-            'ex_fee'    : ex_fee,
-            'total_fee' : total_fee,
-            'lpos'      : self.lpos,
-            'spos'      : self.spos,
-            'total_pos' : self.lpos + self.spos,
-            'u_pnl'     : self.unrealized,
-            'r_pnl'     : realized - total_fee,
-            'total_pnl' : self.unrealized + self.realized,
-            'total_rpnl': self.realized,
-            })
+        self.reports.append(
+            account_id = self.acc_id,
+            order_id   = self.order_id,
+            datetime   = self.stamps[i],
+            code       = self.contract,
+            price      = close_price,
+            direction  = '空',
+            action     = action,
+            volume     = qty,
+            value      = qty * price * self.size,
+            ex_fee     = ex_fee,
+            total_fee  = total_fee,
+            lpos       = self.lpos,
+            spos       = self.spos,
+            u_pnl      = self.unrealized,
+            r_pnl      = realized - total_fee,
+            total_pnl  = self.unrealized + self.realized,
+            total_rpnl = self.realized,
+            )
         return 0
 
     def close_long(self, price, i):
@@ -415,11 +401,7 @@ class backtest(object):
 
         self.lpos -= qty
         realized = self.GetRealize(self.long_avg_price, close_price, qty, 'long')
-        if self.lpos == 0:
-            self.long_avg_price = []
-            assert len(self.long_avg_price) == self.lpos, 'Queue and Pos length not match. Deque {}, lpos {}'.format(len(self.long_avg_price), self.lpos)
-        else:
-            self.long_avg_price = self.long_avg_price[qty:]
+        assert len(self.long_avg_price) == self.lpos, 'Queue and Pos length not match. Deque {}, lpos {}'.format(len(self.long_avg_price), self.lpos)
 
         lavg_price = self.GetAvgPrice(self.long_avg_price)
         savg_price = self.GetAvgPrice(self.short_avg_price)
@@ -427,26 +409,25 @@ class backtest(object):
         sunrealize = -1 * round((close_price - savg_price) * np.abs(self.spos) * self.size,2) if savg_price != 0 else 0
         self.unrealized = lunrealize + sunrealize
         self.realized   += (realized - total_fee)
-        self.reports.append({
-            'account_id': self.acc_id,
-            'order_id'  : self.order_id,
-            'datetime'  : self.index[i],
-            'code'      : self.contract,
-            'price'     : close_price,
-            'direction' : '多',
-            'action'    : action,
-            'volume'    : qty,
-            'value'     : qty * price * self.size,
-            'ex_fee'    : ex_fee,
-            'total_fee' : total_fee,
-            'lpos'      : self.lpos,
-            'spos'      : self.spos,
-            'total_pos' : self.lpos + self.spos,
-            'u_pnl'     : self.unrealized,
-            'r_pnl'     : realized - total_fee,
-            'total_pnl' : self.unrealized + self.realized,
-            'total_rpnl': self.realized,
-            })
+        self.reports.append(
+            account_id = self.acc_id,
+            order_id   = self.order_id,
+            datetime   = self.stamps[i],
+            code       = self.contract,
+            price      = close_price,
+            direction  = '多',
+            action     = action,
+            volume     = qty,
+            value      = qty * price * self.size,
+            ex_fee     = ex_fee,
+            total_fee  = total_fee,
+            lpos       = self.lpos,
+            spos       = self.spos,
+            u_pnl      = self.unrealized,
+            r_pnl      = realized - total_fee,
+            total_pnl  = self.unrealized + self.realized,
+            total_rpnl = self.realized,
+            )
         return 0
 
     def close_short(self, price, i):
@@ -476,11 +457,7 @@ class backtest(object):
 
         self.spos -= qty
         realized = self.GetRealize(self.short_avg_price, close_price, qty, 'short')
-        if self.spos == 0:
-            self.short_avg_price = []
-            assert len(self.short_avg_price) == self.spos, 'Queue and Pos length not match. Deque {}, spos {}'.format(len(self.short_avg_price), self.spos)
-        else:
-            self.short_avg_price = self.short_avg_price[qty:]
+        assert len(self.short_avg_price) == self.spos, 'Queue and Pos length not match. Deque {}, spos {}'.format(len(self.short_avg_price), self.spos)
 
         lavg_price = self.GetAvgPrice(self.long_avg_price)
         savg_price = self.GetAvgPrice(self.short_avg_price)
@@ -488,26 +465,25 @@ class backtest(object):
         sunrealize = -1 * round((close_price - savg_price) * np.abs(self.spos) * self.size,2) if savg_price != 0 else 0
         self.unrealized = lunrealize + sunrealize
         self.realized   += (realized - total_fee)
-        self.reports.append({
-            'account_id': self.acc_id,
-            'order_id'  : self.order_id,
-            'datetime'  : self.index[i],
-            'code'      : self.contract,
-            'price'     : close_price,
-            'direction' : '空',
-            'action'    : action,
-            'volume'    : qty,
-            'value'     : qty * price * self.size,
-            'ex_fee'    : ex_fee,
-            'total_fee' : total_fee,
-            'lpos'      : self.lpos,
-            'spos'      : self.spos,
-            'total_pos' : self.lpos + self.spos,
-            'u_pnl'     : self.unrealized,
-            'r_pnl'     : realized - total_fee,
-            'total_pnl' : self.unrealized + self.realized,
-            'total_rpnl': self.realized,
-            })
+        self.reports.append(
+            account_id = self.acc_id,
+            order_id   = self.order_id,
+            datetime   = self.stamps[i],
+            code       = self.contract,
+            price      = close_price,
+            direction  = '空',
+            action     = action,
+            volume     = qty,
+            value      = qty * price * self.size,
+            ex_fee     = ex_fee,
+            total_fee  = total_fee,
+            lpos       = self.lpos,
+            spos       = self.spos,
+            u_pnl      = self.unrealized,
+            r_pnl      = realized - total_fee,
+            total_pnl  = self.unrealized + self.realized,
+            total_rpnl = self.realized,
+            )
         return 0
 
     def close_all(self, bp1, ap1, i):
@@ -537,11 +513,7 @@ class backtest(object):
 
         self.lpos -= qty
         realized = self.GetRealize(self.long_avg_price, close_price, qty, 'long')
-        if self.lpos == 0:
-            self.long_avg_price = []
-            assert len(self.long_avg_price) == self.lpos, 'Queue and Pos length not match. Deque {}, lpos {}'.format(len(self.long_avg_price), self.lpos)
-        else:
-            self.long_avg_price = self.long_avg_price[qty:]
+        assert len(self.long_avg_price) == self.lpos, 'Queue and Pos length not match. Deque {}, lpos {}'.format(len(self.long_avg_price), self.lpos)
 
         lavg_price = self.GetAvgPrice(self.long_avg_price)
         savg_price = self.GetAvgPrice(self.short_avg_price)
@@ -549,26 +521,25 @@ class backtest(object):
         sunrealize = -1 * round((close_price - savg_price) * np.abs(self.spos) * self.size,2) if savg_price != 0 else 0
         self.unrealized = lunrealize + sunrealize
         self.realized   += (realized - total_fee)
-        self.reports.append({
-            'account_id': self.acc_id,
-            'order_id'  : self.order_id,
-            'datetime'  : self.index[i],
-            'code'      : self.contract,
-            'price'     : close_price,
-            'direction' : '多',
-            'action'    : action,
-            'volume'    : qty,
-            'value'     : qty * bp1 * self.size,
-            'ex_fee'    : ex_fee,
-            'total_fee' : total_fee,
-            'lpos'      : self.lpos,
-            'spos'      : self.spos,
-            'total_pos' : self.lpos + self.spos,
-            'u_pnl'     : self.unrealized,
-            'r_pnl'     : realized - total_fee,
-            'total_pnl' : self.unrealized + self.realized,
-            'total_rpnl': self.realized,
-            })
+        self.reports.append(
+            account_id = self.acc_id,
+            order_id   = self.order_id,
+            datetime   = self.stamps[i],
+            code       = self.contract,
+            price      = close_price,
+            direction  = '多',
+            action     = action,
+            volume     = qty,
+            value      = qty * bp1 * self.size,
+            ex_fee     = ex_fee,
+            total_fee  = total_fee,
+            lpos       = self.lpos,
+            spos       = self.spos,
+            u_pnl      = self.unrealized,
+            r_pnl      = realized - total_fee,
+            total_pnl  = self.unrealized + self.realized,
+            total_rpnl = self.realized,
+            )
 
         close_price = ap1 + self.slippage * self.ticksize
         qty = abs(self.spos)
@@ -595,11 +566,7 @@ class backtest(object):
 
         self.spos -= qty
         realized = self.GetRealize(self.short_avg_price, close_price, qty, 'short')
-        if self.spos == 0:
-            self.short_avg_price = []
-            assert len(self.short_avg_price) == self.spos, 'Queue and Pos length not match. Deque {}, spos {}'.format(len(self.short_avg_price), self.spos)
-        else:
-            self.short_avg_price = self.short_avg_price[qty:]
+        assert len(self.short_avg_price) == self.spos, 'Queue and Pos length not match. Deque {}, spos {}'.format(len(self.short_avg_price), self.spos)
 
         lavg_price = self.GetAvgPrice(self.long_avg_price)
         savg_price = self.GetAvgPrice(self.short_avg_price)
@@ -607,26 +574,25 @@ class backtest(object):
         sunrealize = -1 * round((close_price - savg_price) * np.abs(self.spos) * self.size,2) if savg_price != 0 else 0
         self.unrealized = lunrealize + sunrealize
         self.realized   += (realized - total_fee)
-        self.reports.append({
-            'account_id': self.acc_id,
-            'order_id'  : self.order_id,
-            'datetime'  : self.index[i],
-            'code'      : self.contract,
-            'price'     : close_price,
-            'direction' : '空',
-            'action'    : action,
-            'volume'    : qty,
-            'value'     : qty * ap1 * self.size,
-            'ex_fee'    : ex_fee,
-            'total_fee' : total_fee,
-            'lpos'      : self.lpos,
-            'spos'      : self.spos,
-            'total_pos' : self.lpos + self.spos,
-            'u_pnl'     : self.unrealized,
-            'r_pnl'     : realized - total_fee,
-            'total_pnl' : self.unrealized + self.realized,
-            'total_rpnl': self.realized,
-            })
+        self.reports.append(
+            account_id = self.acc_id,
+            order_id   = self.order_id,
+            datetime   = self.stamps[i],
+            code       = self.contract,
+            price      = close_price,
+            direction  = '空',
+            action     = action,
+            volume     = qty,
+            value      = qty * ap1 * self.size,
+            ex_fee     = ex_fee,
+            total_fee  = total_fee,
+            lpos       = self.lpos,
+            spos       = self.spos,
+            u_pnl      = self.unrealized,
+            r_pnl      = realized - total_fee,
+            total_pnl  = self.unrealized + self.realized,
+            total_rpnl = self.realized,
+            )
         return 0
 
     def reverse_long(self, price, qty, i):
@@ -658,11 +624,7 @@ class backtest(object):
             raise TypeError('Case not addressed')
         self.spos -= qty
         realized = self.GetRealize(self.short_avg_price, close_price, qty, 'short')
-        if self.spos == 0:
-            self.short_avg_price = []
-            assert len(self.short_avg_price) == self.spos, 'Queue and Pos length not match. Deque {}, spos {}'.format(len(self.short_avg_price), self.spos)
-        else:
-            self.short_avg_price = self.short_avg_price[qty:]
+        assert len(self.short_avg_price) == self.spos, 'Queue and Pos length not match. Deque {}, spos {}'.format(len(self.short_avg_price), self.spos)
 
         lavg_price = self.GetAvgPrice(self.long_avg_price)
         savg_price = self.GetAvgPrice(self.short_avg_price)
@@ -670,30 +632,29 @@ class backtest(object):
         sunrealize = -1 * round((close_price - savg_price) * np.abs(self.spos) * self.size,2) if savg_price != 0 else 0
         self.unrealized = lunrealize + sunrealize
         self.realized += (realized - total_fee)
-        self.reports.append({
-            'account_id': self.acc_id,
-            'order_id'  : self.order_id,
-            'datetime'  : self.index[i],
-            'code'      : self.contract,
-            'price'     : close_price,
-            'direction' : '空',
-            'action'    : action,
-            'volume'    : qty,
-            'value'     : qty * price * self.size,
-            'ex_fee'    : ex_fee,
-            'total_fee' : total_fee,
-            'lpos'      : self.lpos,
-            'spos'      : self.spos,
-            'total_pos' : self.lpos + self.spos,
-            'u_pnl'     : self.unrealized,
-            'r_pnl'     : realized - total_fee,
-            'total_pnl' : self.unrealized + self.realized,
-            'total_rpnl': self.realized,
-            })
+        self.reports.append(
+            account_id = self.acc_id,
+            order_id   = self.order_id,
+            datetime   = self.stamps[i],
+            code       = self.contract,
+            price      = close_price,
+            direction  = '空',
+            action     = action,
+            volume     = qty,
+            value      = qty * price * self.size,
+            ex_fee     = ex_fee,
+            total_fee  = total_fee,
+            lpos       = self.lpos,
+            spos       = self.spos,
+            u_pnl      = self.unrealized,
+            r_pnl      = realized - total_fee,
+            total_pnl  = self.unrealized + self.realized,
+            total_rpnl = self.realized,
+            )
         # Open Long or Add Long
         ex_fee, br_fee, rebate = self.GetFees(open_price, qty, action='open')
         total_fee = ex_fee + br_fee - rebate
-        self.long_avg_price = self.long_avg_price + [open_price] * qty
+        self.long_avg_price.push(open_price, qty)
         self.lpos += qty
         self.realized += -total_fee
         self.open_pos += qty
@@ -702,26 +663,25 @@ class backtest(object):
         lunrealize =      round((close_price - lavg_price) * np.abs(self.lpos) * self.size,2) if lavg_price != 0 else 0
         sunrealize = -1 * round((close_price - savg_price) * np.abs(self.spos) * self.size,2) if savg_price != 0 else 0
         self.unrealized = lunrealize + sunrealize
-        self.reports.append({
-            'account_id': self.acc_id,
-            'order_id'  : self.order_id,
-            'datetime'  : self.index[i],
-            'code'      : self.contract,
-            'price'     : open_price,
-            'direction' : '多',
-            'action'    : '反开',
-            'volume'    : qty,
-            'value'     : qty * price * self.size,
-            'ex_fee'    : ex_fee,
-            'total_fee' : total_fee,
-            'lpos'      : self.lpos,
-            'spos'      : self.spos,
-            'total_pos' : self.lpos + self.spos,
-            'u_pnl'     : self.unrealized,
-            'r_pnl'     : -1 * total_fee,
-            'total_pnl' : self.unrealized + self.realized,
-            'total_rpnl': self.realized,
-            })
+        self.reports.append(
+            account_id = self.acc_id,
+            order_id   = self.order_id,
+            datetime   = self.stamps[i],
+            code       = self.contract,
+            price      = open_price,
+            direction  = '多',
+            action     = '反开',
+            volume     = qty,
+            value      = qty * price * self.size,
+            ex_fee     = ex_fee,
+            total_fee  = total_fee,
+            lpos       = self.lpos,
+            spos       = self.spos,
+            u_pnl      = self.unrealized,
+            r_pnl      = -1 * total_fee,
+            total_pnl  = self.unrealized + self.realized,
+            total_rpnl = self.realized,
+            )
         assert abs_pos == self.lpos + self.spos, 'Position Not Equal after Reverse Long'
         return 0
 
@@ -755,11 +715,7 @@ class backtest(object):
         
         self.lpos -= qty
         realized = self.GetRealize(self.long_avg_price, close_price, qty, 'long')
-        if self.lpos == 0:
-            self.long_avg_price = []
-            assert len(self.long_avg_price) == self.lpos, 'Queue and Pos length not match. Deque {}, lpos {}'.format(len(self.long_avg_price), self.lpos)
-        else:
-            self.long_avg_price = self.long_avg_price[qty:]
+        assert len(self.long_avg_price) == self.lpos, 'Queue and Pos length not match. Deque {}, lpos {}'.format(len(self.long_avg_price), self.lpos)
 
         lavg_price = self.GetAvgPrice(self.long_avg_price)
         savg_price = self.GetAvgPrice(self.short_avg_price)
@@ -767,30 +723,29 @@ class backtest(object):
         sunrealize = -1 * round((close_price - savg_price) * np.abs(self.spos) * self.size,2) if savg_price != 0 else 0
         self.unrealized = lunrealize + sunrealize
         self.realized   += (realized - total_fee)
-        self.reports.append({
-            'account_id': self.acc_id,
-            'order_id'  : self.order_id,
-            'datetime'  : self.index[i],
-            'code'      : self.contract,
-            'price'     : close_price,
-            'direction' : '多',
-            'action'    : action,
-            'volume'    : qty,
-            'value'     : qty * price * self.size,
-            'ex_fee'    : ex_fee,
-            'total_fee' : total_fee,
-            'lpos'      : self.lpos,
-            'spos'      : self.spos,
-            'total_pos' : self.lpos + self.spos,
-            'u_pnl'     : self.unrealized,
-            'r_pnl'     : realized - total_fee,
-            'total_pnl' : self.unrealized + self.realized,
-            'total_rpnl': self.realized,
-            })
+        self.reports.append(
+            account_id = self.acc_id,
+            order_id   = self.order_id,
+            datetime   = self.stamps[i],
+            code       = self.contract,
+            price      = close_price,
+            direction  = '多',
+            action     = action,
+            volume     = qty,
+            value      = qty * price * self.size,
+            ex_fee     = ex_fee,
+            total_fee  = total_fee,
+            lpos       = self.lpos,
+            spos       = self.spos,
+            u_pnl      = self.unrealized,
+            r_pnl      = realized - total_fee,
+            total_pnl  = self.unrealized + self.realized,
+            total_rpnl = self.realized,
+            )
 
         ex_fee, br_fee, rebate = self.GetFees(open_price, qty, action='open')
         total_fee = ex_fee + br_fee - rebate
-        self.short_avg_price = self.short_avg_price + [open_price] * qty
+        self.short_avg_price.push(open_price, qty)
         self.spos += qty
         self.realized += -total_fee
         self.open_pos += qty
@@ -799,26 +754,25 @@ class backtest(object):
         lunrealize =      round((close_price - lavg_price) * np.abs(self.lpos) * self.size,2) if lavg_price != 0 else 0
         sunrealize = -1 * round((close_price - savg_price) * np.abs(self.spos) * self.size,2) if savg_price != 0 else 0
         self.unrealized = lunrealize + sunrealize
-        self.reports.append({
-            'account_id': self.acc_id,
-            'order_id'  : self.order_id,
-            'datetime'  : self.index[i],
-            'code'      : self.contract,
-            'price'     : open_price,
-            'direction' : '空',
-            'action'    : '反开',
-            'volume'    : qty,
-            'value'     : qty * price * self.size,
-            'ex_fee'    : ex_fee,
-            'total_fee' : total_fee,
-            'lpos'      : self.lpos,
-            'spos'      : self.spos,
-            'total_pos' : self.lpos + self.spos,
-            'u_pnl'     : self.unrealized,
-            'r_pnl'     : -1 * total_fee,
-            'total_pnl' : self.unrealized + self.realized,
-            'total_rpnl': self.realized,
-            })
+        self.reports.append(
+            account_id = self.acc_id,
+            order_id   = self.order_id,
+            datetime   = self.stamps[i],
+            code       = self.contract,
+            price      = open_price,
+            direction  = '空',
+            action     = '反开',
+            volume     = qty,
+            value      = qty * price * self.size,
+            ex_fee     = ex_fee,
+            total_fee  = total_fee,
+            lpos       = self.lpos,
+            spos       = self.spos,
+            u_pnl      = self.unrealized,
+            r_pnl      = -1 * total_fee,
+            total_pnl  = self.unrealized + self.realized,
+            total_rpnl = self.realized,
+            )
         assert abs_pos == self.lpos + self.spos, 'Position Not Equal after Reverse Short'
         return 0
 
@@ -831,6 +785,7 @@ class backtest(object):
         Input DataFrame For Training. Daily 
         """
         self.index         = df.index
+        self.stamps        = np.asarray(df.index, dtype='datetime64[ns]').view(np.int64)
         self.contract      = df['InstrumentID'].iloc[0]
         self.yst_pos       = self.open_pos
         self.open_pos      = 0
@@ -839,7 +794,7 @@ class backtest(object):
         bp1   = df['BidPrice1'].values
         ap1   = df['AskPrice1'].values
         price = df['MidPrice'].values
-        time  = db.GetSecond(df.index)
+        time  = ss.GetTradingSeconds(np.asarray(df.index, dtype='datetime64[ns]').view(np.int64), self.instrument)
         sigl  = df['sigl'].values
         sigs  = df['sigs'].values 
         
@@ -923,10 +878,7 @@ class backtest(object):
 
 
     def result(self):
-        res = pd.DataFrame(self.reports)
-        res['total_pnl'] = res['total_pnl'] + self.capital
-        res['total_rpnl'] = res['total_rpnl'] + self.capital
-        return res
+        return self.reports.frame(self.capital).copy()
     
 
 
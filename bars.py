@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+import sessions as ss
+from engine import jit
+
+
+BAR_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+
+
+@jit
+def Aggregate(time, price, volume, sid, widths, cur, acc, out_t, out_b, count):
+    """
+    One pass over ticks updating the open bar of every width.
+    Bars are left-closed [t, t + width), labeled by their right edge and never span two sessions.
+    cur[k] = (label, session) of the open bar, acc[k] = open, high, low, close, volume.
+    Finished bars are written to out_t[k, count[k]], out_b[k, count[k]]
+    """
+    for i in range(len(time)):
+        if sid[i] < 0 or price[i] != price[i]:
+            continue
+        for k in range(len(widths)):
+            label = (time[i] // widths[k] + 1) * widths[k]
+            if label != cur[k, 0] or sid[i] != cur[k, 1]:
+                if cur[k, 0] != 0:
+                    out_t[k, count[k]] = cur[k, 0]
+                    out_b[k, count[k]] = acc[k]
+                    count[k] += 1
+                cur[k, 0] = label
+                cur[k, 1] = sid[i]
+                acc[k, 0] = price[i]
+                acc[k, 1] = price[i]
+                acc[k, 2] = price[i]
+                acc[k, 3] = price[i]
+                acc[k, 4] = volume[i]
+            else:
+                acc[k, 1] = max(acc[k, 1], price[i])
+                acc[k, 2] = min(acc[k, 2], price[i])
+                acc[k, 3] = price[i]
+                acc[k, 4] += volume[i]
+    return 0
+
+
+class barbuilder(object):
+    """
+    Streaming OHLCV bars for several frequencies at once.
+    Feed tick chunks in time order with update(), each call returns the bars finished so far;
+    flush() returns the bars still open. Bars follow the instrument's session calendar (sessions.py).
+    """
+    def __init__(self, instrument, freqs=('15min',), grace=60):
+        self.freqs    = list(freqs)
+        self.widths   = np.array([pd.Timedelta(f).value for f in self.freqs], dtype=np.int64)
+        self.sessions = ss.GetSessions(instrument)
+        self.grace    = grace
+        self.cur      = np.zeros((len(self.freqs), 2), dtype=np.int64)
+        self.acc      = np.zeros((len(self.freqs), len(BAR_COLUMNS)))
+        self.volume   = 0.0 # 上一个 tick 的累计成交量
+
+    def update(self, time, price, volume, new_day=True):
+        """
+        time: int64 ns, price: MidPrice, volume: cumulative Volume (restarts on new_day).
+        Returns {freq: DataFrame of finished bars}
+        """
+        time   = np.asarray(time, dtype=np.int64)
+        volume = np.asarray(volume, dtype=np.float64)
+        vol    = np.diff(np.concatenate([[0.0 if new_day else self.volume], volume]))
+        if len(volume) > 0:
+            self.volume = volume[-1]
+        sid   = ss.GetSessionID(time, self.sessions, self.grace)
+        out_t = np.zeros((len(self.freqs), len(time) + 1), dtype=np.int64)
+        out_b = np.zeros((len(self.freqs), len(time) + 1, len(BAR_COLUMNS)))
+        count = np.zeros(len(self.freqs), dtype=np.int64)
+        Aggregate(time, np.asarray(price, dtype=np.float64), vol, sid, self.widths, self.cur, self.acc, out_t, out_b, count)
+        return {f: self.frame(out_t[k, :count[k]], out_b[k, :count[k]]) for k, f in enumerate(self.freqs)}
+
+    def flush(self):
+        """
+        Emit and reset the open bars
+        """
+        res = {}
+        for k, f in enumerate(self.freqs):
+            n = 1 if self.cur[k, 0] != 0 else 0
+            res[f] = self.frame(self.cur[k:k + 1, 0][:n], self.acc[k:k + 1][:n])
+        self.cur[:] = 0
+        self.acc[:] = 0
+        return res
+
+    def frame(self, labels, values):
+        index = pd.DatetimeIndex(labels.astype('datetime64[ns]'), name='datetime')
+        return pd.DataFrame(values.copy(), index=index, columns=BAR_COLUMNS)
+
+
+def GetBars(df, instrument, freqs=('15min',), grace=60):
+    """
+    One trading day of ticks (MidPrice, Volume) -> {freq: OHLCV DataFrame}, one pass for all freqs
+    """
+    builder = barbuilder(instrument, freqs, grace)
+    time = np.asarray(df.index, dtype='datetime64[ns]').view(np.int64)
+    res  = builder.update(time, df['MidPrice'].values, df['Volume'].values)
+    last = builder.flush()
+    return {f: pd.concat([res[f], last[f]], axis=0) for f in freqs}
@@ -0,0 +1,100 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+
+
+VERSION = 1
+
+
+class colstore(object):
+    """
+    Append-only columnar store: <path>/<column>.bin raw arrays + <path>/meta.json
+    Object columns are stored as int32 codes with their categories in meta.
+    meta.json is written last, so columns longer than meta['rows'] (crash mid append) are truncated on open.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.meta_path = os.path.join(path, 'meta.json')
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                self.meta = json.load(f)
+            assert self.meta['version'] == VERSION, 'Column store version {} not supported'.format(self.meta['version'])
+            for name, dtype in self.meta['columns'].items():
+                size = self.meta['rows'] * np.dtype(dtype).itemsize
+                if os.path.getsize(self.file(name)) > size:
+                    os.truncate(self.file(name), size)
+        else:
+            self.meta = {'version': VERSION, 'rows': 0, 'columns': {}, 'categories': {}, 'extra': {}}
+
+    def __len__(self):
+        return self.meta['rows']
+
+    def file(self, name):
+        return os.path.join(self.path, name + '.bin')
+
+    def encode(self, name, values):
+        cats   = self.meta['categories'].setdefault(name, [])
+        lookup = {x: k for k, x in enumerate(cats)}
+        uniques, inverse = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+        codes = np.empty(len(uniques), dtype=np.int32)
+        for k, x in enumerate(uniques.tolist()):
+            if x not in lookup:
+                lookup[x] = len(cats)
+                cats.append(x)
+            codes[k] = lookup[x]
+        return codes[inverse]
+
+    def append(self, cols, extra=None):
+        """
+        cols: dict name -> array, same length and same columns on every append
+        extra: dict merged into meta['extra'] (indexes, states)
+        """
+        n = len(next(iter(cols.values())))
+        if self.meta['rows'] > 0:
+            assert set(cols.keys()) == set(self.meta['columns'].keys()), 'Columns not match {}'.format(list(self.meta['columns']))
+        os.makedirs(self.path, exist_ok=True)
+        for name, values in cols.items():
+            values = np.asarray(values)
+            assert len(values) == n, 'Column {} length {} not match {}'.format(name, len(values), n)
+            if values.dtype == object or values.dtype.kind in 'UST':
+                values = self.encode(name, values)
+            dtype = self.meta['columns'].setdefault(name, values.dtype.str)
+            with open(self.file(name), 'ab') as f:
+                f.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+        self.meta['rows'] += n
+        if extra is not None:
+            self.meta['extra'].update(extra)
+        self.flush()
+        return 0
+
+    def flush(self):
+        tmp = self.meta_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, self.meta_path)
+        return 0
+
+    def read(self, name, start=0, stop=None):
+        """
+        Zero-copy memmap view of rows [start, stop) of one column (codes for categorical columns)
+        """
+        rows = self.meta['rows']
+        stop = rows if stop is None else stop
+        if rows == 0 or start >= stop:
+            return np.zeros(0, dtype=self.meta['columns'].get(name, '<f8'))
+        return np.memmap(self.file(name), dtype=self.meta['columns'][name], mode='r', shape=(rows,))[start:stop]
+
+    def frame(self, start=0, stop=None, columns=None):
+        """
+        DataFrame of rows [start, stop), categorical columns decoded as pd.Categorical
+        """
+        columns = list(self.meta['columns'].keys()) if columns is None else columns
+        data = {}
+        for name in columns:
+            values = self.read(name, start, stop)
+            if name in self.meta['categories']:
+                data[name] = pd.Categorical.from_codes(np.array(values), categories=self.meta['categories'][name])
+            else:
+                data[name] = np.array(values)
+        return pd.DataFrame(data)
@@ -0,0 +1,196 @@
+import os
+import time
+import shutil
+import argparse
+import numpy as np
+import pandas as pd
+import roundtrips as rt
+from colstore import colstore
+from settlestore import settlestore, Ingest
+from concurrent.futures import ProcessPoolExecutor
+
+
+# 数据立方体: 每个 (账号, 交易日, 合约, 小时) 一行
+KEYS     = ['account', 'date', 'code', 'hour']
+MEASURES = {
+    'fills'       : '<i4', # 成交笔数
+    'volume'      : '<i4', # 成交手数
+    'turnover'    : '<f8', # 成交额
+    'fee'         : '<f8', # 交易所手续费
+    'pnl'         : '<f8', # 平仓盈亏 (FIFO, 记在平仓的小时)
+    'orders'      : '<i4', # 委托笔数
+    'order_volume': '<i4',
+    'cancelled'   : '<i4', # 撤单笔数
+    'filled'      : '<i4', # 全部成交笔数
+}
+COLUMNS = {'account': 'cat', 'date': '<i4', 'code': 'cat', 'hour': '|i1', **MEASURES}
+
+
+def GetHour(stamps):
+    """
+    int64 ns / datetime64 -> hour of day (exchange local time) as int8
+    """
+    return ((np.asarray(stamps, dtype='datetime64[ns]').view(np.int64) // 3_600_000_000_000) % 24).astype(np.int8)
+
+
+def GetCells(trades, orders, trips):
+    """
+    Measures per (account, date, code, hour) from one account's trades, orders and round trips
+    """
+    offset = np.asarray(trades['offset'], dtype=object)
+    price  = np.asarray(trades['price'], dtype=np.float64)
+    volume = np.asarray(trades['volume'], dtype=np.int64)
+    unit, size = rt.GetUnitFees(np.asarray(trades['code'], dtype=object), offset, price)
+    status = np.asarray(orders['status'], dtype=object)
+    frames = [
+        pd.DataFrame({'account': np.asarray(trades['account'], dtype=object), 'date': np.asarray(trades['date']),
+                      'code': np.asarray(trades['code'], dtype=object), 'hour': GetHour(trades['datetime']),
+                      'fills': 1, 'volume': volume, 'turnover': price * volume * size, 'fee': unit * volume}),
+        pd.DataFrame({'account': np.asarray(trips['account'], dtype=object), 'date': np.asarray(trips['close_date']),
+                      'code': np.asarray(trips['code'], dtype=object), 'hour': GetHour(trips['close_time']),
+                      'pnl': np.nan_to_num(np.asarray(trips['pnl'], dtype=np.float64))}),
+        pd.DataFrame({'account': np.asarray(orders['account'], dtype=object), 'date': np.asarray(orders['date']),
+                      'code': np.asarray(orders['code'], dtype=object), 'hour': GetHour(orders['datetime']),
+                      'orders': 1, 'order_volume': np.asarray(orders['volume'], dtype=np.int64),
+                      'cancelled': (status == '已撤销').astype(np.int64), 'filled': (status == '全部成交').astype(np.int64)}),
+    ]
+    res = pd.concat(frames, axis=0, ignore_index=True)
+    res = res.groupby(KEYS, sort=True).sum(min_count=0).fillna(0).reset_index()
+    return {name: res[name].values.astype(object if dtype == 'cat' else dtype) for name, dtype in COLUMNS.items()}
+
+
+def RunAccount(task):
+    """
+    Cube cells of the new dates of one account. Round trips run over the account's whole history,
+    so closes of new dates are matched with older opens
+    """
+    store_path, account, dates = task
+    start  = time.time()
+    trades = settlestore(store_path, 'trade').load(account)
+    orders = settlestore(store_path, 'order').load(account, min(dates), max(dates))
+    trips  = rt.GetRoundTrips(trades)
+    keep   = [np.isin(np.asarray(x[k]), dates) for x, k in [(trades, 'date'), (orders, 'date'), (trips, 'close_date')]]
+    cells  = GetCells(trades[keep[0]], orders[keep[1]], trips[keep[2]])
+    print('{} Done Cube {} dates {} cells {}'.format(account, len(dates), len(cells['date']), time.time() - start))
+    return cells
+
+
+def GetSources(store_path):
+    """
+    {'account/date': [trade size, mtime, order size, mtime]} of the settlestore files, -1 when missing
+    """
+    sources = {}
+    for k, kind in enumerate(['trade', 'order']):
+        index = settlestore(store_path, kind).index()
+        for account, date, size, mtime in zip(index['account'], index['date'], index['size'], index['mtime']):
+            sources.setdefault('{}/{}'.format(account, date), [-1, -1, -1, -1])[2 * k: 2 * k + 2] = [int(size), int(mtime)]
+    return sources
+
+
+def Update(store_path, cube_path, settle_path=None, workers=None):
+    """
+    Append the cells of (account, date)s not in the cube yet, one task per account in parallel.
+    A source file that changed, or a new date before an account's last cube date (FIFO pnl of later
+    days would change), rebuilds the cube. settle_path: ingest new settlement files first.
+    Returns the number of (account, date)s added
+    """
+    if settle_path is not None:
+        Ingest(settle_path, store_path, workers=workers)
+    start   = time.time()
+    sources = GetSources(store_path)
+    store   = colstore(cube_path)
+    done    = store.meta['extra'].get('sources', {})
+    new     = sorted(k for k in sources if k not in done)
+    last    = {}
+    for k in done:
+        account, date = k.rsplit('/', 1)
+        last[account] = max(last.get(account, 0), int(date))
+    if any(sources.get(k) != v for k, v in done.items()) or any(int(k.rsplit('/', 1)[1]) < last.get(k.rsplit('/', 1)[0], 0) for k in new):
+        print('Sources changed, rebuild {}'.format(cube_path))
+        shutil.rmtree(cube_path)
+        store = colstore(cube_path)
+        done  = {}
+        new   = sorted(sources)
+
+    accounts = {}
+    for k in new:
+        account, date = k.rsplit('/', 1)
+        accounts.setdefault(account, []).append(int(date))
+    tasks = [(store_path, account, dates) for account, dates in accounts.items()]
+    if workers == 1 or len(tasks) < 2:
+        res = [RunAccount(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            res = list(pool.map(RunAccount, tasks))
+    if len(new) > 0:
+        cells = {name: np.concatenate([r[name] for r in res]) for name in COLUMNS}
+        store.append(cells, extra={'sources': dict(done, **{k: sources[k] for k in new})})
+        print('Cube {} account dates {} cells {}'.format(len(new), len(cells['date']), time.time() - start))
+    return len(new)
+
+
+def AddRatios(df):
+    """
+    Ratios from the summed counts: cancel ratio, full fill ratio, order to fill, net pnl
+    """
+    orders = df['orders'].where(df['orders'] > 0)
+    df['cancel_ratio']  = df['cancelled'] / orders
+    df['fill_ratio']    = df['filled'] / orders
+    df['order_to_fill'] = df['orders'] / df['fills'].where(df['fills'] > 0)
+    df['net_pnl']       = df['pnl'] - df['fee']
+    return df
+
+
+class cube(object):
+    """
+    Settlement data cube on a colstore: measures per (account, date, code, hour).
+    Selections read the key columns, then only the selected rows of the measures
+    """
+    def __init__(self, cube_path):
+        self.store = colstore(cube_path)
+        assert len(self.store) > 0, 'Empty cube {}, run Update first'.format(cube_path)
+
+    def GetMask(self, accounts=None, start_date=None, end_date=None, codes=None):
+        mask = np.ones(len(self.store), dtype=bool)
+        date = self.store.read('date')
+        if start_date is not None:
+            mask &= date >= int(start_date)
+        if end_date is not None:
+            mask &= date <= int(end_date)
+        for name, values in [('account', accounts), ('code', codes)]:
+            if values is not None:
+                cats  = self.store.meta['categories'][name]
+                keep  = [cats.index(x) for x in ([values] if isinstance(values, str) else values) if x in cats]
+                mask &= np.isin(self.store.read(name), keep)
+        return mask
+
+    def load(self, accounts=None, start_date=None, end_date=None, codes=None):
+        """
+        Cells of the selected accounts, dates (YYYYMMDD int, inclusive) and contracts
+        """
+        rows = np.flatnonzero(self.GetMask(accounts, start_date, end_date, codes))
+        data = {}
+        for name in COLUMNS:
+            values = self.store.read(name)[rows]
+            if name in self.store.meta['categories']:
+                data[name] = pd.Categorical.from_codes(values, categories=self.store.meta['categories'][name])
+            else:
+                data[name] = values
+        return pd.DataFrame(data)
+
+    def slice(self, by=('account', 'date'), **filters):
+        """
+        Measures summed over the other keys, with AddRatios. filters: accounts, start_date, end_date, codes
+        """
+        res = self.load(**filters).groupby(list(by), sort=True, observed=True)[list(MEASURES)].sum()
+        return AddRatios(res)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Update the settlement data cube')
+    parser.add_argument('store_path', help='settlestore directory')
+    parser.add_argument('cube_path', help='Output directory')
+    parser.add_argument('--settle_path', default=None, help='Ingest new settlement files first')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    Update(args.store_path, args.cube_path, args.settle_path, args.workers)
@@ -0,0 +1,304 @@
+import numpy as np
+from math import floor
+try:
+    from numba import njit
+except ImportError: # numba 为可选依赖, 只有 engine='numba' 需要
+    njit = None
+
+
+# Event Codes: 编译引擎输出的动作, 由 backtest.replay 按顺序重放
+OPEN_LONG     = 1
+MINUS_LONG    = 2
+CLOSE_LONG    = 3
+REVERSE_SHORT = 4
+OPEN_SHORT    = 5
+MINUS_SHORT   = 6
+CLOSE_SHORT   = 7
+REVERSE_LONG  = 8
+HALT_CLOSE    = 9  # 接近涨跌停板, 全平并暂停
+SIGNAL_CLOSE  = 10 # 信号6, 全平
+FREEZE_CLOSE  = 11 # 低于保险线, 全平并终止
+LIMIT_STOP    = 12 # 暂停后仍在涨跌停板附近, 当天终止
+
+# Param Slots
+P_TICKSIZE, P_SIZE, P_MARGIN, P_SLIPPAGE, P_CAPITAL          = 0, 1, 2, 3, 4
+P_BROKER_RATE, P_EX_REBATE, P_BR_REBATE                      = 5, 6, 7
+P_FREEZE_RATE, P_STOPLOSSTICK, P_HALT_TIME, P_LOT            = 8, 9, 10, 11
+P_OPEN_RATE, P_OPEN_FLAT, P_CLOSE_TDY_RATE, P_CLOSE_TDY_FLAT  = 12, 13, 14, 15
+P_CLOSE_YST_RATE, P_CLOSE_YST_FLAT                           = 16, 17
+
+# State Slots
+S_LPOS, S_SPOS, S_YST_POS, S_OPEN_POS                        = 0, 1, 2, 3
+S_REALIZED, S_UNREALIZED, S_ORDER_ID, S_HALT                 = 4, 5, 6, 7
+S_LCOST, S_SCOST, S_TERMINATE                                = 8, 9, 10
+
+
+def jit(func):
+    if njit is None:
+        return func
+    return njit(cache=True)(func)
+
+
+@jit
+def _fees(price, qty, k, p):
+    """
+    k: first param slot of the (rate, flat) fee kernel
+    """
+    ex_fee = round(price * qty * p[k] * p[P_SIZE] + qty * p[k + 1], 2)
+    if p[P_BROKER_RATE] < 1:
+        br_fee = ex_fee * (1 + p[P_BROKER_RATE])
+    else:
+        br_fee = qty * p[P_BROKER_RATE]
+    rebate = ex_fee * p[P_EX_REBATE] * p[P_BR_REBATE]
+    return ex_fee, br_fee, rebate
+
+
+@jit
+def _open(price, qty, s, p):
+    """
+    开仓手续费
+    """
+    ex_fee, br_fee, rebate = _fees(price, qty, P_OPEN_RATE, p)
+    s[S_REALIZED] += -(ex_fee + br_fee - rebate)
+    s[S_OPEN_POS] += qty
+
+
+@jit
+def _close(price, qty, s, p):
+    """
+    平仓手续费, 昨仓/今仓逻辑与 backtest 保持一致
+    """
+    yst_pos = s[S_YST_POS]
+    if yst_pos == 0:
+        ex_fee, br_fee, rebate = _fees(price, qty, P_CLOSE_YST_RATE, p)
+        total_fee = ex_fee + br_fee - rebate
+    elif yst_pos < qty:
+        ex_fee1, br_fee1, rebate1 = _fees(price, yst_pos, P_CLOSE_TDY_RATE, p)
+        ex_fee2, br_fee2, rebate2 = _fees(price, qty - yst_pos, P_CLOSE_YST_RATE, p)
+        total_fee = (ex_fee1 + br_fee2 - rebate1) + (ex_fee1 + br_fee2 - rebate2)
+        s[S_YST_POS] = 0
+    else:
+        ex_fee, br_fee, rebate = _fees(price, qty, P_CLOSE_YST_RATE, p)
+        total_fee = ex_fee + br_fee - rebate
+        s[S_YST_POS] = yst_pos - qty
+    return total_fee
+
+
+@jit
+def _push(lq, lv, lh, price, qty):
+    if lh[1] >= len(lq): # numba 不检查越界
+        raise IndexError('Ledger arrays full')
+    lq[lh[1]] = price
+    lv[lh[1]] = qty
+    lh[1] += 1
+
+
+@jit
+def _pop(lq, lv, lh, qty):
+    cost = 0.0
+    left = qty
+    while left > 0:
+        k = lh[0]
+        if lv[k] > left:
+            cost  += lq[k] * left
+            lv[k] -= left
+            left   = 0
+        else:
+            cost += lq[k] * lv[k]
+            left -= lv[k]
+            lh[0] += 1
+    return cost
+
+
+@jit
+def _unrealize(price, s, p):
+    lpos = s[S_LPOS]
+    spos = s[S_SPOS]
+    lavg = s[S_LCOST] / lpos if lpos != 0 else 0.0
+    savg = s[S_SCOST] / spos if spos != 0 else 0.0
+    lunrealize =      round((price - lavg) * lpos * p[P_SIZE], 2) if lavg != 0 else 0.0
+    sunrealize = -1 * round((price - savg) * spos * p[P_SIZE], 2) if savg != 0 else 0.0
+    s[S_UNREALIZED] = lunrealize + sunrealize
+
+
+@jit
+def _mtm(bp1, ap1, s, p):
+    """
+    Mark to market: longs at bid, shorts at ask, same formula as backtest.GetMTM
+    """
+    return (bp1 * s[S_LPOS] - s[S_LCOST]) * p[P_SIZE] + (s[S_SCOST] - ap1 * s[S_SPOS]) * p[P_SIZE]
+
+
+@jit
+def _open_long(price, qty, s, p, lq, lv, lh):
+    open_price = price + p[P_SLIPPAGE] * p[P_TICKSIZE]
+    _open(open_price, qty, s, p)
+    _push(lq, lv, lh, open_price, qty)
+    s[S_LPOS]  += qty
+    s[S_LCOST] += open_price * qty
+    _unrealize(open_price, s, p)
+
+
+@jit
+def _open_short(price, qty, s, p, sq, sv, sh):
+    open_price = price - p[P_SLIPPAGE] * p[P_TICKSIZE]
+    _open(open_price, qty, s, p)
+    _push(sq, sv, sh, open_price, qty)
+    s[S_SPOS]  += qty
+    s[S_SCOST] += open_price * qty
+    _unrealize(open_price, s, p)
+
+
+@jit
+def _close_long(close_price, qty, s, p, lq, lv, lh):
+    total_fee = _close(close_price, qty, s, p)
+    s[S_LPOS] -= qty
+    cost = _pop(lq, lv, lh, qty)
+    s[S_LCOST] = s[S_LCOST] - cost if s[S_LPOS] != 0 else 0.0
+    realized = round((close_price - cost / qty) * p[P_SIZE] * qty, 2)
+    _unrealize(close_price, s, p)
+    s[S_REALIZED] += (realized - total_fee)
+
+
+@jit
+def _close_short(close_price, qty, s, p, sq, sv, sh):
+    total_fee = _close(close_price, qty, s, p)
+    s[S_SPOS] -= qty
+    cost = _pop(sq, sv, sh, qty)
+    s[S_SCOST] = s[S_SCOST] - cost if s[S_SPOS] != 0 else 0.0
+    realized = -1 * round((close_price - cost / qty) * p[P_SIZE] * qty, 2)
+    _unrealize(close_price, s, p)
+    s[S_REALIZED] += (realized - total_fee)
+
+
+@jit
+def _close_all(bp1, ap1, s, p, lq, lv, lh, sq, sv, sh):
+    if s[S_LPOS] > 0:
+        _close_long(bp1 - p[P_SLIPPAGE] * p[P_TICKSIZE], s[S_LPOS], s, p, lq, lv, lh)
+    if s[S_SPOS] > 0:
+        _close_short(ap1 + p[P_SLIPPAGE] * p[P_TICKSIZE], s[S_SPOS], s, p, sq, sv, sh)
+
+
+@jit
+def _reverse_long(price, qty, s, p, lq, lv, lh, sq, sv, sh):
+    close_price = price + p[P_SLIPPAGE] * p[P_TICKSIZE]
+    _close_short(close_price, qty, s, p, sq, sv, sh)
+    _open(close_price, qty, s, p)
+    _push(lq, lv, lh, close_price, qty)
+    s[S_LPOS]  += qty
+    s[S_LCOST] += close_price * qty
+    _unrealize(close_price, s, p)
+
+
+@jit
+def _reverse_short(price, qty, s, p, lq, lv, lh, sq, sv, sh):
+    close_price = price - p[P_SLIPPAGE] * p[P_TICKSIZE]
+    _close_long(close_price, qty, s, p, lq, lv, lh)
+    _open(close_price, qty, s, p)
+    _push(sq, sv, sh, close_price, qty)
+    s[S_SPOS]  += qty
+    s[S_SCOST] += close_price * qty
+    _unrealize(close_price, s, p)
+
+
+@jit
+def _emit(ev_i, ev_c, ev_o, n, i, code, order_id):
+    ev_i[n] = i
+    ev_c[n] = code
+    ev_o[n] = order_id
+    return n + 1
+
+
+@jit
+def RunTicks(bp1, ap1, bv1, av1, price, time, sigl, sigs, qb, qs, upl, lwl, p, s,
+             lq, lv, lh, sq, sv, sh, ev_i, ev_c, ev_o):
+    """
+    Compiled version of backtest.run main loop.
+    qb / qs: max buy / sell qty per tick from the fill model (inf for full fills).
+    Writes events (tick index, event code, order id) into preallocated ev_* arrays,
+    mutates state s and the ledger arrays, returns the number of events.
+    """
+    ticksize  = p[P_TICKSIZE]
+    capital   = p[P_CAPITAL]
+    halt_time = p[P_HALT_TIME]
+    lot       = p[P_LOT]
+    up_trig   = upl - ticksize * p[P_STOPLOSSTICK]
+    dn_trig   = lwl + ticksize * p[P_STOPLOSSTICK]
+    t           = 0.0
+    record_time = 0.0
+    n           = 0
+    for i in range(len(time)):
+        if t > halt_time and (ap1[i] > up_trig or bp1[i] < dn_trig):
+            n = _emit(ev_i, ev_c, ev_o, n, i, LIMIT_STOP, s[S_ORDER_ID])
+            break
+        elif t < halt_time and s[S_HALT] == 1:
+            t = time[i] - record_time
+        elif (s[S_LPOS] > 0 or s[S_SPOS] > 0) and (ap1[i] > up_trig or bp1[i] < dn_trig):
+            _close_all(bp1[i], ap1[i], s, p, lq, lv, lh, sq, sv, sh)
+            n = _emit(ev_i, ev_c, ev_o, n, i, HALT_CLOSE, s[S_ORDER_ID])
+            record_time = time[i]
+            s[S_HALT]   = 1
+        elif (s[S_LPOS] > 0 or s[S_SPOS] > 0) and (sigl[i] == 6 or sigs[i] == 6):
+            _close_all(bp1[i], ap1[i], s, p, lq, lv, lh, sq, sv, sh)
+            n = _emit(ev_i, ev_c, ev_o, n, i, SIGNAL_CLOSE, s[S_ORDER_ID])
+        elif (s[S_LPOS] > 0 or s[S_SPOS] > 0) and (capital + s[S_REALIZED] + _mtm(bp1[i], ap1[i], s, p) < capital * p[P_FREEZE_RATE]):
+            _close_all(bp1[i], ap1[i], s, p, lq, lv, lh, sq, sv, sh)
+            n = _emit(ev_i, ev_c, ev_o, n, i, FREEZE_CLOSE, s[S_ORDER_ID])
+            s[S_TERMINATE] = 1
+            break
+        else:
+            s[S_HALT] = 0
+            if sigl[i] > 0 or sigs[i] < 0:
+                current_capital = capital + s[S_REALIZED] + s[S_UNREALIZED]
+                used_margin     = (s[S_LPOS] + s[S_SPOS]) * p[P_MARGIN] * price[i] * p[P_SIZE]
+                margin          = p[P_MARGIN] * p[P_SIZE] * price[i]
+                max_available_pos = floor((current_capital - used_margin) / margin)
+                abs_pos = s[S_LPOS] + s[S_SPOS]
+                s[S_ORDER_ID] += 1
+                order_id = s[S_ORDER_ID]
+                # Long Position Logic
+                if s[S_LPOS] == 0 and abs_pos < max_available_pos and av1[i] > 0:
+                    if sigl[i] == 1 and min(lot, qb[i]) > 0:
+                        _open_long(ap1[i], min(lot, qb[i]), s, p, lq, lv, lh)
+                        n = _emit(ev_i, ev_c, ev_o, n, i, OPEN_LONG, order_id)
+                elif s[S_LPOS] > 0 and av1[i] > 0:
+                    if sigl[i] == 1 and abs_pos < max_available_pos:
+                        if min(lot, qb[i]) > 0:
+                            _open_long(ap1[i], min(lot, qb[i]), s, p, lq, lv, lh)
+                            n = _emit(ev_i, ev_c, ev_o, n, i, OPEN_LONG, order_id)
+                    elif sigl[i] == 3:
+                        if min(lot, s[S_LPOS], qs[i]) > 0:
+                            _close_long(bp1[i] - p[P_SLIPPAGE] * ticksize, min(lot, s[S_LPOS], qs[i]), s, p, lq, lv, lh)
+                            n = _emit(ev_i, ev_c, ev_o, n, i, MINUS_LONG, order_id)
+                    elif sigl[i] == 4:
+                        if min(s[S_LPOS], qs[i]) > 0:
+                            _close_long(bp1[i] - p[P_SLIPPAGE] * ticksize, min(s[S_LPOS], qs[i]), s, p, lq, lv, lh)
+                            n = _emit(ev_i, ev_c, ev_o, n, i, CLOSE_LONG, order_id)
+                    elif sigl[i] == 5:
+                        if min(lot, s[S_LPOS], qs[i] // 2) > 0:
+                            _reverse_short(ap1[i], min(lot, s[S_LPOS], qs[i] // 2), s, p, lq, lv, lh, sq, sv, sh)
+                            n = _emit(ev_i, ev_c, ev_o, n, i, REVERSE_SHORT, order_id)
+
+                # Short Position Logic
+                if s[S_SPOS] == 0 and abs_pos < max_available_pos and bv1[i] > 0:
+                    if sigs[i] == -1 and min(lot, qs[i]) > 0:
+                        _open_short(ap1[i], min(lot, qs[i]), s, p, sq, sv, sh)
+                        n = _emit(ev_i, ev_c, ev_o, n, i, OPEN_SHORT, order_id)
+                elif s[S_SPOS] > 0 and bv1[i] > 0:
+                    if sigs[i] == -1 and abs_pos < max_available_pos:
+                        if min(lot, qs[i]) > 0:
+                            _open_short(ap1[i], min(lot, qs[i]), s, p, sq, sv, sh)
+                            n = _emit(ev_i, ev_c, ev_o, n, i, OPEN_SHORT, order_id)
+                    elif sigs[i] == -3:
+                        if min(lot, s[S_SPOS], qb[i]) > 0:
+                            _close_short(ap1[i] + p[P_SLIPPAGE] * ticksize, min(lot, s[S_SPOS], qb[i]), s, p, sq, sv, sh)
+                            n = _emit(ev_i, ev_c, ev_o, n, i, MINUS_SHORT, order_id)
+                    elif sigs[i] == -4:
+                        if min(s[S_SPOS], qb[i]) > 0:
+                            _close_short(ap1[i] + p[P_SLIPPAGE] * ticksize, min(s[S_SPOS], qb[i]), s, p, sq, sv, sh)
+                            n = _emit(ev_i, ev_c, ev_o, n, i, CLOSE_SHORT, order_id)
+                    elif sigs[i] == -5:
+                        if min(lot, s[S_SPOS], qb[i] // 2) > 0:
+                            _reverse_long(ap1[i], min(lot, s[S_SPOS], qb[i] // 2), s, p, lq, lv, lh, sq, sv, sh)
+                            n = _emit(ev_i, ev_c, ev_o, n, i, REVERSE_LONG, order_id)
+    return n
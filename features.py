@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+# 信号参数: RSI 窗口, 布林带窗口
+SIGNAL_PARAMS = {'rsi': 6, 'boll': 15}
+
+
+def GetEMA(x, alpha, min_periods=0, state=None):
+    """
+    Same recursion as pandas ewm(alpha=alpha, min_periods=min_periods, adjust=True).mean()
+    state = (weighted, old_wt, nobs) carries the average across calls, returns (ema, state)
+    """
+    x = np.asarray(x, dtype=np.float64)
+    out = np.empty(len(x))
+    weighted, old_wt, nobs = (np.nan, 1.0, 0) if state is None else state
+    for i in range(len(x)):
+        cur = x[i]
+        is_observation = cur == cur
+        nobs += is_observation
+        if weighted == weighted:
+            if is_observation:
+                old_wt *= 1 - alpha
+                if weighted != cur:
+                    weighted = ((old_wt * weighted) + cur) / (old_wt + 1.0)
+                old_wt += 1.0
+            else:
+                old_wt *= 1 - alpha
+        elif is_observation:
+            weighted = cur
+        out[i] = weighted if nobs >= max(min_periods, 1) else np.nan
+    return out, (weighted, old_wt, nobs)
+
+
+def GetRSI(close, n, state=None):
+    """
+    RSI (pandas_ta 口径: Wilder RMA = ewm(alpha=1/n, min_periods=n))
+    state = (last_close, up_state, down_state), returns (rsi, state)
+    """
+    close = np.asarray(close, dtype=np.float64)
+    last_close, up_state, dn_state = (np.nan, None, None) if state is None else state
+    diff = np.diff(np.concatenate([[last_close], close]))
+    up   = np.where(diff > 0, diff, 0.0)
+    dn   = np.where(diff < 0, diff, 0.0)
+    up[np.isnan(diff)] = np.nan
+    dn[np.isnan(diff)] = np.nan
+    up_avg, up_state = GetEMA(up, 1.0 / n, n, up_state)
+    dn_avg, dn_state = GetEMA(dn, 1.0 / n, n, dn_state)
+    rsi = 100 * up_avg / (up_avg + np.abs(dn_avg))
+    last_close = close[-1] if len(close) > 0 else last_close
+    return rsi, (last_close, up_state, dn_state)
+
+
+def GetBBands(close, n, std=2.0, history=None):
+    """
+    Bollinger Bands (SMA +- std * population stdev). Each window is computed on its own,
+    so results do not depend on where the series starts.
+    history: previous closes (the last n-1 are used as warm-up), returns (lower, mid, upper)
+    """
+    close = np.asarray(close, dtype=np.float64)
+    warm  = np.zeros(0) if history is None else np.asarray(history, dtype=np.float64)[-(n - 1):]
+    x     = np.concatenate([warm, close])
+    lower = np.full(len(x), np.nan)
+    mid   = np.full(len(x), np.nan)
+    upper = np.full(len(x), np.nan)
+    if len(x) >= n:
+        win = sliding_window_view(x, n)
+        m   = win.mean(axis=1)
+        s   = win.std(axis=1)
+        mid[n - 1:]   = m
+        lower[n - 1:] = m - std * s
+        upper[n - 1:] = m + std * s
+    k = len(warm)
+    return lower[k:], mid[k:], upper[k:]
+
+
+def GetBollRSISignal(f):
+    """
+    布林带 + RSI 信号, f 需要 close, last_close, lower, mid, upper, rsi
+    """
+    f['sigl'] = np.where((f.close <  f.lower) & (f.rsi <  20)                ,  0,
+                np.where((f.close >  f.upper) & (f.rsi >  80)                ,  5,
+                np.where((f.close <= f.lower) & (f.rsi >= 20) & (f.rsi <= 50),  0,
+                np.where((f.close >= f.upper) & (f.rsi >= 50) & (f.rsi <= 80),  1,
+                np.where((f.close >  f.mid  ) & (f.last_close <  f.mid)      ,  1,
+                np.where((f.close <  f.mid  ) & (f.last_close >  f.mid)      ,  3,
+                0))))))
+    f['sigs'] = np.where((f.close <  f.lower) & (f.rsi <  20)                , -5,
+                np.where((f.close >  f.upper) & (f.rsi >  80)                ,  0,
+                np.where((f.close <= f.lower) & (f.rsi >= 20) & (f.rsi <= 50), -1,
+                np.where((f.close >= f.upper) & (f.rsi >= 50) & (f.rsi <= 80),  0,
+                np.where((f.close >  f.mid  ) & (f.last_close <  f.mid)      , -3,
+                np.where((f.close <  f.mid  ) & (f.last_close >  f.mid)      , -1,
+                0))))))
+    return f
+
+
+def GetIndicators(bars, rsi=SIGNAL_PARAMS['rsi'], boll=SIGNAL_PARAMS['boll'], std=2.0):
+    """
+    bars: DataFrame with close. Returns a copy with last_close, rsi, lower, mid, upper, sigl, sigs
+    """
+    f = bars.copy()
+    close = f['close'].values
+    f['last_close'] = f['close'].shift(1)
+    f['rsi'], _ = GetRSI(close, rsi)
+    f['lower'], f['mid'], f['upper'] = GetBBands(close, boll, std)
+    return GetBollRSISignal(f)
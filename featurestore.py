@@ -0,0 +1,173 @@
+import os
+import time
+import argparse
+import numpy as np
+import pandas as pd
+import database as db
+import features as fe
+import bars as br
+from colstore import colstore
+
+
+# 特征窗口: 信号用 RSI, 慢 RSI, 布林带
+FEATURE_PARAMS = {'rsi': 6, 'rsi_slow': 24, 'boll': 15, 'std': 2.0}
+
+
+def GetDayBars(df, instrument, freqs):
+    """
+    One trading day of ticks -> {freq: OHLC bars with Contract, TradeDate, PreClose} (same as GetFeatures in Boll_RSI.ipynb)
+    All freqs come from one pass of bars.GetBars
+    """
+    res = br.GetBars(df, instrument, freqs)
+    for ohlc in res.values():
+        ohlc['Contract']  = df['InstrumentID'].iloc[0]
+        ohlc['TradeDate'] = int(df['TradingDay'].iloc[0])
+        ohlc['PreClose']  = df['PreClosePrice'].iloc[0]
+    return res
+
+
+def ToState(state):
+    """
+    numpy scalars / tuples -> JSON friendly nested lists
+    """
+    if isinstance(state, (tuple, list)):
+        return [ToState(x) for x in state]
+    if isinstance(state, (np.integer, int)) and not isinstance(state, bool):
+        return int(state)
+    return None if state is None else float(state)
+
+
+def FromState(state):
+    if isinstance(state, list):
+        return tuple(FromState(x) for x in state)
+    return state
+
+
+class featurestore(object):
+    """
+    Append-only feature store for one instrument / freq under <feature_path>/<instrument>/<freq>/
+    Tracks the materialized trade dates and the RSI states, so update() only builds bars and
+    indicators for new days; Bollinger Bands warm up from the last boll-1 stored closes.
+    """
+    def __init__(self, feature_path, instrument, freq, params=None):
+        self.instrument = instrument
+        self.freq       = freq
+        self.store      = colstore(os.path.join(feature_path, instrument, freq))
+        extra = self.store.meta['extra']
+        self.params = extra.get('params', dict(FEATURE_PARAMS, **(params or {})))
+        assert params is None or dict(FEATURE_PARAMS, **params) == self.params, \
+            'Feature params {} not match stored {}'.format(params, self.params)
+
+    def dates(self):
+        return sorted(self.store.meta['extra'].get('dates', {}).keys())
+
+    def missing(self, dates):
+        """
+        Trade dates not in the store yet. Only dates after the last stored date can be appended,
+        an earlier missing date needs a rebuild (remove the directory).
+        """
+        done = self.dates()
+        new  = sorted(d for d in dates if d not in done)
+        assert len(new) == 0 or len(done) == 0 or new[0] > done[-1], \
+            '{} {} missing {} before last stored date {}, rebuild the store'.format(self.instrument, self.freq, new[0], done[-1])
+        return new
+
+    def update(self, data_path, dates=None):
+        """
+        Materialize new trade dates, returns the list of appended dates
+        """
+        return Append(data_path, self.instrument, {self.freq: self}, dates)[self.freq]
+
+    def append(self, days):
+        """
+        days: list of (date, bars) in date order, all after the last stored date
+        """
+        if len(days) == 0:
+            return 0
+        bars = pd.concat([b for _, b in days], axis=0)
+        cols, state = self.compute(bars)
+        index = dict(self.store.meta['extra'].get('dates', {}))
+        rows  = len(self.store)
+        for date, b in days:
+            index[date] = [rows, rows + len(b)]
+            rows += len(b)
+        self.store.append(cols, extra={'dates': index, 'state': ToState(state), 'params': self.params})
+        return 0
+
+    def compute(self, bars):
+        """
+        Indicators for new bars continuing from the stored state. Returns (columns, state)
+        """
+        p     = self.params
+        state = FromState(self.store.meta['extra'].get('state')) or (None, None)
+        close = bars['close'].values
+        f = bars.copy()
+        f['last_close'] = np.concatenate([[np.nan if state[0] is None else state[0][0]], close[:-1]])
+        f['RSI_{}'.format(p['rsi'])], fast_state      = fe.GetRSI(close, p['rsi'], state[0])
+        f['RSI_{}'.format(p['rsi_slow'])], slow_state = fe.GetRSI(close, p['rsi_slow'], state[1])
+        history = np.array(self.store.read('close', max(len(self.store) - p['boll'] + 1, 0))) if len(self.store) else None
+        f['lower'], f['mid'], f['upper'] = fe.GetBBands(close, p['boll'], p['std'], history)
+        f['rsi'] = f['RSI_{}'.format(p['rsi'])]
+        f = fe.GetBollRSISignal(f)
+
+        cols = {'datetime': np.asarray(f.index, dtype='datetime64[ns]').view(np.int64)}
+        for name in f.columns:
+            if name != 'rsi':
+                cols[name] = f[name].values.astype(object) if name == 'Contract' else f[name].values
+        return cols, (fast_state, slow_state)
+
+    def load(self, start_date=None, end_date=None):
+        """
+        Features for start_date .. end_date (inclusive) as the DataFrame the feature CSVs give
+        """
+        index = self.store.meta['extra'].get('dates', {})
+        days  = [d for d in self.dates() if (start_date is None or d >= start_date) and (end_date is None or d <= end_date)]
+        assert len(days) > 0, 'No features for {} {} between {} and {}'.format(self.instrument, self.freq, start_date, end_date)
+        f = self.store.frame(index[days[0]][0], index[days[-1]][1])
+        f.index = pd.DatetimeIndex(f.pop('datetime').values.astype('datetime64[ns]'), name='datetime')
+        f['Contract'] = f['Contract'].astype(str)
+        f['rsi'] = f['RSI_{}'.format(self.params['rsi'])]
+        return f
+
+
+def Append(data_path, instrument, stores, dates=None):
+    """
+    Append new trade dates to {freq: featurestore}, each day's ticks are read
+    and aggregated once for all freqs. Returns {freq: appended dates}
+    """
+    start = time.time()
+    dates = db.GetTradeDates(data_path, instrument) if dates is None else [str(d) for d in dates]
+    new   = {freq: store.missing(dates) for freq, store in stores.items()}
+    days  = {freq: [] for freq in stores}
+    for date in sorted(set(d for v in new.values() for d in v)):
+        need = [freq for freq in stores if date in new[freq]]
+        res  = GetDayBars(db.GetTickData(data_path, instrument, date), instrument, need)
+        for freq in need:
+            days[freq].append((date, res[freq]))
+    for freq, store in stores.items():
+        store.append(days[freq])
+        if len(new[freq]) > 0:
+            print('{} {} Appended {} days, {} bars {}'.format(instrument, freq, len(new[freq]), sum(len(b) for _, b in days[freq]), time.time() - start))
+    return new
+
+
+def Update(data_path, feature_path, instrument, freqs=('5min', '10min', '15min'), dates=None):
+    """
+    Bring the feature stores of every freq up to date with one pass over the new days
+    """
+    return Append(data_path, instrument, {freq: featurestore(feature_path, instrument, freq) for freq in freqs}, dates)
+
+
+def HasStore(feature_path, instrument, freq):
+    return os.path.exists(os.path.join(feature_path, instrument, freq, 'meta.json'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Append new trade dates to the feature store')
+    parser.add_argument('data_path', help='Tick CSV root or tick store, contains <instrument>/<date>.csv')
+    parser.add_argument('feature_path', help='Feature root')
+    parser.add_argument('instruments', nargs='+')
+    parser.add_argument('--freqs', nargs='+', default=['5min', '10min', '15min'])
+    args = parser.parse_args()
+    for instrument in args.instruments:
+        Update(args.data_path, args.feature_path, instrument, args.freqs)
@@ -0,0 +1,95 @@
+import numpy as np
+from engine import jit
+
+
+# 买卖方向: 主动买吃卖一 (AskVolume1), 主动卖吃买一 (BidVolume1)
+BUY, SELL = 0, 1
+
+
+def GetTraded(volume):
+    """
+    Cumulative Volume of a trading day -> volume traded on each tick (0 on the first tick)
+    """
+    volume = np.asarray(volume, dtype=np.float64)
+    return np.diff(volume, prepend=volume[:1]) if len(volume) > 0 else volume
+
+
+class fillmodel(object):
+    """
+    Level-1 fill model for the backtest's aggressive (market) orders.
+    At tick i an order can take at most participation * displayed volume at the touch
+    + traded_rate * volume traded on the tick (hidden / refilled liquidity). Larger orders are
+    partially filled and the rest is cancelled (FAK). Reverse orders trade twice the qty on one side.
+    Caps are computed once per day, vectorized, and shared by the python, event and numba engines.
+    """
+    def __init__(self, participation=1.0, traded_rate=0.0):
+        self.participation = participation
+        self.traded_rate   = traded_rate
+
+    def GetCaps(self, bv1, av1, volume=None):
+        """
+        Max buy / sell qty per tick as float arrays
+        """
+        traded = 0.0 if volume is None else np.maximum(GetTraded(volume), 0) * self.traded_rate
+        buy  = np.floor(np.asarray(av1, dtype=np.float64) * self.participation + traded)
+        sell = np.floor(np.asarray(bv1, dtype=np.float64) * self.participation + traded)
+        return buy, sell
+
+    def GetQueueFills(self, side, level, bp1, ap1, bv1, av1, volume, start, qty, ahead=None):
+        """
+        Passive limit order of qty at price level posted at tick start, see QueueFill.
+        ahead defaults to the displayed volume at the level (back of the queue).
+        Returns (tick index, filled qty) arrays
+        """
+        bp1, ap1 = np.asarray(bp1, dtype=np.float64), np.asarray(ap1, dtype=np.float64)
+        bv1, av1 = np.asarray(bv1, dtype=np.float64), np.asarray(av1, dtype=np.float64)
+        if ahead is None:
+            touch, depth = (bp1, bv1) if side == BUY else (ap1, av1)
+            ahead = depth[start] if touch[start] == level else 0.0
+        out_i = np.zeros(len(bp1), dtype=np.int64)
+        out_q = np.zeros(len(bp1), dtype=np.float64)
+        n = QueueFill(side, float(level), bp1, ap1, bv1, av1, GetTraded(volume), start, float(qty), float(ahead), out_i, out_q)
+        return out_i[:n], out_q[:n]
+
+
+@jit
+def QueueFill(side, level, bp1, ap1, bv1, av1, traded, start, qty, ahead, out_i, out_q):
+    """
+    Queue position of a resting order (side BUY at level <= ask, SELL at level >= bid).
+    Every later tick where the level is at or through the touch, the traded volume first works
+    off the lots queued ahead, the remainder fills the order. The queue ahead can only shrink
+    to the displayed volume at the level (cancels ahead). The opposite side reaching the level
+    fills everything left. Writes (tick, qty) fills, returns their number.
+    """
+    n    = 0
+    left = qty
+    for j in range(start + 1, len(bp1)):
+        if left <= 0:
+            break
+        if side == BUY:
+            crossed = ap1[j] <= level
+            at      = bp1[j] <= level
+            touch   = bp1[j] == level
+            depth   = bv1[j]
+        else:
+            crossed = bp1[j] >= level
+            at      = ap1[j] >= level
+            touch   = ap1[j] == level
+            depth   = av1[j]
+        if crossed:
+            out_i[n] = j
+            out_q[n] = left
+            n   += 1
+            left = 0.0
+        elif at:
+            if touch:
+                ahead = min(ahead, depth)
+            rest  = traded[j] - ahead
+            ahead = max(ahead - traded[j], 0.0)
+            if rest > 0:
+                fill = min(rest, left)
+                out_i[n] = j
+                out_q[n] = fill
+                n    += 1
+                left -= fill
+    return n
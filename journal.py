@@ -0,0 +1,174 @@
+import numpy as np
+import pandas as pd
+
+
+DIRECTIONS = ['多', '空']
+ACTIONS    = ['开', '加', '反开',
+              '减今', '减昨今', '减昨',
+              '平今', '平昨今', '平昨',
+              '清今', '清昨今', '清昨']
+
+
+class journal(object):
+    """
+    成交记录 (Fill Journal)
+    Typed, preallocated NumPy columns which grow by doubling. Direction / action are stored
+    as int8 codes, account / contract as dictionary codes. frame() materializes one cached
+    DataFrame with the same columns as the old list of report dicts.
+    """
+    FLOATS = ['price', 'value', 'ex_fee', 'total_fee', 'u_pnl', 'r_pnl', 'total_pnl', 'total_rpnl']
+    INTS   = ['order_id', 'datetime', 'volume', 'lpos', 'spos']
+    CODES  = ['account_id', 'code', 'direction', 'action']
+
+    def __init__(self, capacity=1024):
+        self.n        = 0
+        self.capacity = capacity
+        self.cols     = {}
+        for name in self.FLOATS:
+            self.cols[name] = np.zeros(capacity, dtype=np.float64)
+        for name in self.INTS:
+            self.cols[name] = np.zeros(capacity, dtype=np.int64)
+        for name in self.CODES:
+            self.cols[name] = np.zeros(capacity, dtype=np.int8 if name in ('direction', 'action') else np.int32)
+        self.categories = {
+            'account_id': [],
+            'code'      : [],
+            'direction' : list(DIRECTIONS),
+            'action'    : list(ACTIONS),
+        }
+        self.lookup = {name: {x: k for k, x in enumerate(cats)} for name, cats in self.categories.items()}
+        self.cache  = None
+
+    def __len__(self):
+        return self.n
+
+    def encode(self, name, value):
+        lookup = self.lookup[name]
+        code = lookup.get(value)
+        if code is None:
+            code = len(self.categories[name])
+            self.categories[name].append(value)
+            lookup[value] = code
+        return code
+
+    def grow(self):
+        self.capacity *= 2
+        for name, col in self.cols.items():
+            new = np.zeros(self.capacity, dtype=col.dtype)
+            new[:self.n] = col[:self.n]
+            self.cols[name] = new
+        return 0
+
+    def append(self, account_id, order_id, datetime, code, price, direction, action, volume,
+               value, ex_fee, total_fee, lpos, spos, u_pnl, r_pnl, total_pnl, total_rpnl):
+        """
+        Write one fill. datetime: int64 nanoseconds
+        """
+        if self.n == self.capacity:
+            self.grow()
+        k    = self.n
+        cols = self.cols
+        cols['account_id'][k] = self.encode('account_id', account_id)
+        cols['order_id'][k]   = order_id
+        cols['datetime'][k]   = datetime
+        cols['code'][k]       = self.encode('code', code)
+        cols['price'][k]      = price
+        cols['direction'][k]  = self.lookup['direction'][direction]
+        cols['action'][k]     = self.lookup['action'][action]
+        cols['volume'][k]     = volume
+        cols['value'][k]      = value
+        cols['ex_fee'][k]     = ex_fee
+        cols['total_fee'][k]  = total_fee
+        cols['lpos'][k]       = lpos
+        cols['spos'][k]       = spos
+        cols['u_pnl'][k]      = u_pnl
+        cols['r_pnl'][k]      = r_pnl
+        cols['total_pnl'][k]  = total_pnl
+        cols['total_rpnl'][k] = total_rpnl
+        self.n     += 1
+        self.cache  = None
+        return 0
+
+    def truncate(self, n):
+        """
+        Keep the first n fills (rewind to a checkpoint)
+        """
+        assert 0 <= n <= self.n, 'Journal has {} fills, cannot truncate to {}'.format(self.n, n)
+        self.n     = n
+        self.cache = None
+        return 0
+
+    def GetState(self, start=0):
+        """
+        Raw columns of the fills from start on and the dictionary categories, as arrays for np.savez
+        """
+        state = {'journal_' + name: self.column(name)[start:].copy() for name in self.cols}
+        for name in ['account_id', 'code']:
+            state['journal_cat_' + name] = np.array(self.categories[name], dtype=str)
+        state['journal_start'] = np.array(start)
+        return state
+
+    def SetState(self, state):
+        """
+        Load a GetState snapshot. A snapshot from start > 0 replaces the fills after start
+        (categories only grow, so the codes of the kept fills stay valid)
+        """
+        start = int(state['journal_start']) if 'journal_start' in state else 0
+        n = start + len(state['journal_order_id'])
+        if start == 0:
+            self.__init__(max(n, 1024))
+        else:
+            assert start <= self.n, 'Journal has {} fills, cannot append from {}'.format(self.n, start)
+            self.n = start
+            while self.capacity < n:
+                self.grow()
+        for name in self.cols:
+            self.cols[name][start:n] = state['journal_' + name]
+        for name in ['account_id', 'code']:
+            self.categories[name] = [str(x) for x in state['journal_cat_' + name]]
+            self.lookup[name]     = {x: k for k, x in enumerate(self.categories[name])}
+        self.n     = n
+        self.cache = None
+        return 0
+
+    def column(self, name):
+        """
+        Zero-copy view of a raw column (codes for categorical columns)
+        """
+        return self.cols[name][:self.n]
+
+    def decode(self, name):
+        return np.array(self.categories[name], dtype=object)[self.column(name)]
+
+    def frame(self, capital=0):
+        """
+        ----- 结算表 -----
+        Cached DataFrame of all fills, capital added to total_pnl / total_rpnl.
+        Treat as read only, copy before modifying.
+        """
+        if self.cache is not None and self.cache[0] == capital:
+            return self.cache[1]
+        lpos = self.column('lpos')
+        spos = self.column('spos')
+        res = pd.DataFrame({
+            'account_id': self.decode('account_id'),
+            'order_id'  : self.column('order_id').copy(),
+            'datetime'  : self.column('datetime').astype('datetime64[ns]'),
+            'code'      : self.decode('code'),
+            'price'     : self.column('price').copy(),
+            'direction' : self.decode('direction'),
+            'action'    : self.decode('action'),
+            'volume'    : self.column('volume').copy(),
+            'value'     : self.column('value').copy(),
+            'ex_fee'    : self.column('ex_fee').copy(),
+            'total_fee' : self.column('total_fee').copy(),
+            'lpos'      : lpos.copy(),
+            'spos'      : spos.copy(),
+            'total_pos' : lpos + spos,
+            'u_pnl'     : self.column('u_pnl').copy(),
+            'r_pnl'     : self.column('r_pnl').copy(),
+            'total_pnl' : self.column('total_pnl') + capital,
+            'total_rpnl': self.column('total_rpnl') + capital,
+        })
+        self.cache = (capital, res)
+        return res
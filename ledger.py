@@ -0,0 +1,90 @@
+import numpy as np
+from collections import deque
+
+
+class ledger(object):
+    """
+    FIFO 持仓队列 (Lot Ledger)
+    Run-length entries [price, qty] in a deque (ring buffer) with running qty and cost,
+    so open is O(1), close is O(runs consumed) and average price is O(1).
+    """
+    def __init__(self):
+        self.lots = deque()
+        self.pos  = 0
+        self.cost = 0
+
+    def __len__(self):
+        return self.pos
+
+    def push(self, price, qty):
+        """
+        开仓: Append qty lots at price
+        """
+        lots = self.lots
+        if lots and lots[-1][0] == price:
+            lots[-1][1] += qty
+        else:
+            lots.append([price, qty])
+        self.pos  += qty
+        self.cost += price * qty
+        return 0
+
+    def pop(self, qty):
+        """
+        平仓 FIFO: Remove the oldest qty lots, return their total cost (sum of open prices)
+        """
+        assert 0 < qty <= self.pos, 'Ledger has {} lots, cannot pop {}'.format(self.pos, qty)
+        lots = self.lots
+        cost = 0
+        left = qty
+        while left > 0:
+            lot = lots[0]
+            if lot[1] > left:
+                cost   += lot[0] * left
+                lot[1] -= left
+                left    = 0
+            else:
+                cost += lot[0] * lot[1]
+                left -= lot[1]
+                lots.popleft()
+        self.pos -= qty
+        if self.pos == 0:
+            # 清空时重置, 避免浮点累计误差
+            self.cost = 0
+        else:
+            self.cost -= cost
+        return cost
+
+    def avg(self):
+        if self.pos != 0:
+            avg_price = self.cost / self.pos
+        else:
+            avg_price = 0
+        return avg_price
+
+    def ToArrays(self, extra=0):
+        """
+        Export runs as (prices, qtys) float arrays, with extra empty slots for appends
+        """
+        n      = len(self.lots)
+        prices = np.zeros(n + extra)
+        qtys   = np.zeros(n + extra)
+        for k, (price, qty) in enumerate(self.lots):
+            prices[k] = price
+            qtys[k]   = qty
+        return prices, qtys
+
+    def FromArrays(self, prices, qtys, cost):
+        """
+        Rebuild the runs exported by ToArrays, cost is the running cost (kept exact, not re-summed)
+        """
+        self.lots = deque([float(price), int(qty)] for price, qty in zip(prices, qtys) if qty > 0)
+        self.pos  = int(np.sum(qtys))
+        self.cost = cost
+        return 0
+
+    def clear(self):
+        self.lots.clear()
+        self.pos  = 0
+        self.cost = 0
+        return 0
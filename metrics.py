@@ -61,50 +61,203 @@ def GetEPO(res, side=None):
         ValueError('Case Not Justify')
     return epo
 
-def GetCounts(res):
+def GetCounts(res, enc=None):
+    enc = EncodeReport(res) if enc is None else enc
+    flags = enc['flags']
+    long  = (res['direction'] == '多').values
+    short = (res['direction'] == '空').values
     counts = pd.DataFrame({
-        '开多': len(res[(res['direction']== '多') & (res['action'].str.contains('开'))]),
-        '开空': len(res[(res['direction']== '空') & (res['action'].str.contains('开'))]),
-        '减多': len(res[(res['direction']== '多') & (res['action'].str.contains('减'))]),
-        '减空': len(res[(res['direction']== '空') & (res['action'].str.contains('减'))]),
-        '反开': len(res[(res['direction']== '多') & (res['action'].str.contains('反'))]),
-        '反空': len(res[(res['direction']== '空') & (res['action'].str.contains('反'))]),
-        '平开': len(res[(res['direction']== '多') & (res['action'].str.contains('平'))]),
-        '平空': len(res[(res['direction']== '空') & (res['action'].str.contains('平'))]),
-        '全平': len(res[(res['action'].str.contains('全'))]),
+        '开多': int(np.sum(long  & flags['开'])),
+        '开空': int(np.sum(short & flags['开'])),
+        '减多': int(np.sum(long  & flags['减'])),
+        '减空': int(np.sum(short & flags['减'])),
+        '反开': int(np.sum(long  & flags['反'])),
+        '反空': int(np.sum(short & flags['反'])),
+        '平开': int(np.sum(long  & flags['平'])),
+        '平空': int(np.sum(short & flags['平'])),
+        '全平': int(np.sum(flags['全'])),
     }, index=['Actions'])
     return counts
 
+def EncodeReport(res):
+    """
+    Encode action / direction once.
+    Substring tests run on the unique action strings only, then map back by integer codes.
+    """
+    codes, uniques = pd.factorize(res['action'])
+    flags = {}
+    for ch in ['开', '加', '减', '反', '平', '全', '清']:
+        flags[ch] = np.array([ch in str(u) for u in uniques], dtype=bool)[codes]
+    dcodes, duniques = pd.factorize(res['direction'])
+    enc = {
+        'flags': flags,
+        'close': flags['减'] | flags['平'],
+        'long' : np.array(['多' in str(u) for u in duniques], dtype=bool)[dcodes],
+        'short': np.array(['空' in str(u) for u in duniques], dtype=bool)[dcodes],
+        'r_pnl': res['r_pnl'].values,
+    }
+    return enc
+
+
+def GetSideStats(res, enc=None):
+    """
+    Win Rate / PnL Ratio / EPO for all, long and short sides from one encoding.
+    Same outputs as GetWinRate / GetPnLRatio / GetEPO.
+    """
+    enc = EncodeReport(res) if enc is None else enc
+    stats = {}
+    for side, mask in [('all', enc['close']), ('long', enc['close'] & enc['long']), ('short', enc['close'] & enc['short'])]:
+        x    = enc['r_pnl'][mask]
+        win  = x > 0
+        wins = np.sum(win)
+        loss = np.sum(~win)
+        if wins > 0 and loss > 0:
+            win_rate  = round(wins / (wins + loss), 2)
+            pnl_ratio = round(abs(np.nansum(x[win])) / abs(np.nansum(x[~win])), 2)
+        elif wins > 0:
+            win_rate, pnl_ratio = 1.0, np.inf
+        elif loss > 0:
+            win_rate, pnl_ratio = 0.0, -np.inf
+        else:
+            raise ValueError('Case not justify')
+        epo = round(np.nanmean(x), 2) if x.shape[0] > 0 else np.nan
+        stats[side] = {'win_rate': win_rate, 'pnl_ratio': pnl_ratio, 'epo': epo}
+    return stats
+
+
+def HasCloses(res, enc=None):
+    """
+    GetSideStats / GetAccount need closing fills on both the long and the short side
+    """
+    if len(res) == 0:
+        return False
+    enc = EncodeReport(res) if enc is None else enc
+    return bool(np.any(enc['close'] & enc['long'])) and bool(np.any(enc['close'] & enc['short']))
+
+
 def GetAccount(res, ticks, capital):
+    st = GetSideStats(res)
+    max_dd, max_ratio = GetMaxDrawdown(res['total_rpnl'].values)
     acc = pd.DataFrame({
         'Ticks Modelled': int(ticks),
         'Initial Capital': capital,
         'Final Capital': res['total_rpnl'].iloc[-1],
         'Realized PnL': res['r_pnl'].sum(),
         'Return': round((res['total_rpnl'].iloc[-1] / capital  - 1) * 100,1) ,
-        'MaxDrawdown': GetDrawdown(res, ratio=False),
-        'MaxDrawdown Ratio': GetDrawdown(res, ratio=True),
-        'Win Rate': GetWinRate(res),
-        'Win Rate (Long)': GetWinRate(res, side='long'),
-        'Win Rate (Short)': GetWinRate(res, side='short'),
-        'PnL Ratio': GetPnLRatio(res),
-        'PnL Ratio (Long)': GetPnLRatio(res, side='long'),
-        'PnL Ratio (Short)': GetPnLRatio(res, side='short'),
-        'EPO': GetEPO(res),
-        'EPO (Long)': GetEPO(res, 'long'),
-        'EPO (Short)': GetEPO(res, 'short'),
+        'MaxDrawdown': max_dd,
+        'MaxDrawdown Ratio': max_ratio,
+        'Win Rate': st['all']['win_rate'],
+        'Win Rate (Long)': st['long']['win_rate'],
+        'Win Rate (Short)': st['short']['win_rate'],
+        'PnL Ratio': st['all']['pnl_ratio'],
+        'PnL Ratio (Long)': st['long']['pnl_ratio'],
+        'PnL Ratio (Short)': st['short']['pnl_ratio'],
+        'EPO': st['all']['epo'],
+        'EPO (Long)': st['long']['epo'],
+        'EPO (Short)': st['short']['epo'],
     }, index=['Stats'])
     return acc
 
 
+def GetDrawdownSeries(equity):
+    """
+    Running peak drawdown in one pass: returns (drawdown, peak), drawdown >= 0
+    """
+    equity = np.asarray(equity, dtype=np.float64)
+    peak   = np.maximum.accumulate(equity)
+    return peak - equity, peak
+
+
+def GetMaxDrawdown(equity):
+    """
+    Max drawdown (peak - trough) and max drawdown ratio (drawdown / peak)
+    """
+    dd, peak = GetDrawdownSeries(equity)
+    if len(dd) == 0:
+        return 0.0, 0.0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(peak != 0, dd / peak, 0.0)
+    return round(np.max(dd), 2), round(np.max(ratio), 2)
+
+
 def GetDrawdown(res, ratio=False):
-    array = res['total_rpnl'].values
-    max_ = np.max(array)
-    idx = np.argmax(array)
-    array = array[idx:]
-    min_ = np.min(array)
-    if ratio == False:
-        res = max_ - min_
+    """
+    Max drawdown of total_rpnl against its running peak
+    """
+    max_dd, max_ratio = GetMaxDrawdown(res['total_rpnl'].values)
+    return max_ratio if ratio else max_dd
+
+
+def GetUnderwater(equity, index=None):
+    """
+    Underwater periods, one row per drawdown episode, vectorized.
+    peak: last point at the high, trough: lowest point, end: first point back at the high (NaN if not recovered).
+    duration = end - peak, measured to the last point for an episode not recovered yet (recovered = False),
+    recovery = end - trough. In points, or in time if index (datetime) is given.
+    """
+    dd, peak = GetDrawdownSeries(equity)
+    n = len(dd)
+    under = dd > 0
+    edges = np.diff(np.concatenate([[False], under, [False]]).astype(np.int8))
+    starts = np.flatnonzero(edges == 1)
+    ends   = np.flatnonzero(edges == -1) # first point after the episode
+    if len(starts) == 0:
+        return pd.DataFrame(columns=['peak', 'trough', 'end', 'depth', 'ratio', 'duration', 'recovery', 'recovered'])
+
+    # Trough: first point of each episode with the max drawdown
+    depth = np.maximum.reduceat(dd, starts)
+    pos   = np.flatnonzero(under)
+    seg   = np.repeat(np.arange(len(starts)), ends - starts)
+    hit   = dd[pos] == depth[seg]
+    pos, seg = pos[hit], seg[hit]
+    trough = pos[np.concatenate([[True], seg[1:] != seg[:-1]])]
+
+    peak_pos = starts - 1
+    peak_pos[peak_pos < 0] = 0
+    end_pos  = ends.astype(np.float64)
+    end_pos[ends >= n] = np.nan
+    recovered = ends < n
+    last_pos  = np.minimum(ends, n - 1) # 未恢复的回撤持续到最后一个点
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(peak[starts] != 0, depth / peak[starts], 0.0)
+
+    if index is None:
+        duration = last_pos - peak_pos
+        recovery = end_pos - trough
+        res = pd.DataFrame({'peak': peak_pos, 'trough': trough, 'end': end_pos})
     else:
-        res = (max_ - min_) / max_
-    return round(res,2)
\ No newline at end of file
+        index    = pd.DatetimeIndex(index)
+        end_time = pd.DatetimeIndex([index[int(e)] if e == e else pd.NaT for e in end_pos])
+        duration = index[last_pos] - index[peak_pos]
+        recovery = end_time - index[trough]
+        res = pd.DataFrame({'peak': index[peak_pos], 'trough': index[trough], 'end': end_time})
+    res['depth']    = depth
+    res['ratio']    = ratio
+    res['duration'] = duration
+    res['recovery'] = recovery
+    res['recovered'] = recovered
+    return res
+
+
+def GetDrawdownReport(res, equity=None):
+    """
+    ----- 回撤分析 -----
+    Max drawdown, ratio, longest underwater duration (including a drawdown not recovered yet),
+    recovery time of the max drawdown, whether the curve ends underwater, for realized (total_rpnl) and mark-to-market (total_pnl, or a tick level equity Series) curves.
+    """
+    curves = {'Realized': res.set_index('datetime')['total_rpnl'],
+              'MTM'     : res.set_index('datetime')['total_pnl'] if equity is None else equity}
+    report = {}
+    for name, curve in curves.items():
+        periods = GetUnderwater(curve.values, curve.index)
+        max_dd, max_ratio = GetMaxDrawdown(curve.values)
+        worst = periods.loc[periods['depth'].idxmax()] if len(periods) > 0 else None
+        report[name] = {
+            'MaxDrawdown'      : max_dd,
+            'MaxDrawdown Ratio': max_ratio,
+            'Max Duration'     : periods['duration'].max() if worst is not None else pd.Timedelta(0),
+            'Recovery'         : worst['recovery'] if worst is not None else pd.Timedelta(0),
+            'Underwater Periods': len(periods),
+            'Underwater Now'   : bool(len(periods) > 0 and not periods['recovered'].iloc[-1]),
+        }
+    return pd.DataFrame(report).T
@@ -0,0 +1,127 @@
+import time
+import numpy as np
+import pandas as pd
+from settlestore import settlestore, Ingest
+from concurrent.futures import ProcessPoolExecutor
+
+
+# 委托状态
+CANCELLED = '已撤销'
+FILLED    = '全部成交'
+
+# 一笔委托的键: 同一个账号同一个交易日内唯一
+ORDER_KEYS = ['account', 'date', 'session', 'orderid']
+
+
+def GetOrderRows(orders, trades):
+    """
+    Hash join: row of each trade's order in orders (by ORDER_KEYS), -1 if the order is missing
+    """
+    index = pd.MultiIndex.from_arrays([np.asarray(orders[k], dtype=object) for k in ORDER_KEYS])
+    if len(trades) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return index.get_indexer(pd.MultiIndex.from_arrays([np.asarray(trades[k], dtype=object) for k in ORDER_KEYS]))
+
+
+def GetLifecycle(orders, trades):
+    """
+    ----- 委托生命周期 -----
+    One row per order (settlestore order frame) with its fills from the trade frame:
+    fills, filled (volume from trades), first / last fill time, time_to_fill (seconds from the order
+    to its first fill), cancelled, and rest: seconds until the next order of the same account, day,
+    contract and direction, an estimate of how long a cancelled order rested (the files have no cancel time).
+    Also returns the trades whose order is not in orders
+    """
+    n      = len(orders)
+    rows   = GetOrderRows(orders, trades)
+    found  = rows >= 0
+    stamps = np.asarray(trades['datetime'], dtype='datetime64[ns]').view(np.int64)
+    volume = np.asarray(trades['volume'], dtype=np.int64)
+
+    fills  = np.bincount(rows[found], minlength=n)
+    filled = np.bincount(rows[found], weights=volume[found], minlength=n).astype(np.int64)
+    first  = np.full(n, np.iinfo(np.int64).max)
+    last   = np.full(n, np.iinfo(np.int64).min)
+    np.minimum.at(first, rows[found], stamps[found])
+    np.maximum.at(last, rows[found], stamps[found])
+    first  = np.where(fills > 0, first, np.iinfo(np.int64).min)
+
+    res = orders.reset_index(drop=True).copy()
+    sent = np.asarray(res['datetime'], dtype='datetime64[ns]').view(np.int64)
+    res['fills']        = fills
+    res['filled']       = filled
+    res['first_fill']   = first.astype('datetime64[ns]')
+    res['last_fill']    = last.astype('datetime64[ns]')
+    res['time_to_fill'] = np.where(fills > 0, (first - sent) / 1e9, np.nan)
+    res['cancelled']    = np.asarray(res['status'], dtype=object) == CANCELLED
+
+    # 同账号 / 日 / 合约 / 方向的下一笔委托
+    keys  = [pd.factorize(res[k])[0] for k in ['account', 'date', 'code', 'direction']]
+    order = np.lexsort([sent] + keys[::-1])
+    group = pd.MultiIndex.from_arrays([k[order] for k in keys]).factorize()[0] if n > 0 else np.zeros(0, dtype=np.int64)
+    gap   = np.full(n, np.nan)
+    same  = group[1:] == group[:-1]
+    gap[order[:-1][same]] = (sent[order[1:]][same] - sent[order[:-1]][same]) / 1e9
+    res['rest'] = gap
+    return res, trades[~found]
+
+
+def GetOrderStats(life, by=('account', 'date', 'code')):
+    """
+    Lifecycle statistics per group of the GetLifecycle frame: orders, volumes, fill ratio (traded / ordered
+    volume), cancel rate, full fill rate, order to trade ratio (orders / fills), time to fill and
+    estimated resting time of cancelled orders (seconds)
+    """
+    by   = list(by)
+    life = life.assign(
+        full   = np.asarray(life['status'], dtype=object) == FILLED,
+        c_rest = life['rest'].where(life['cancelled']),
+    )
+    g   = life.groupby(by, sort=True, observed=True)
+    res = pd.DataFrame({
+        'Orders'        : g.size(),
+        'Order Volume'  : g['volume'].sum(),
+        'Traded Volume' : g['traded'].sum(),
+        'Fills'         : g['fills'].sum(),
+        'Cancelled'     : g['cancelled'].sum(),
+        'Filled'        : g['full'].sum(),
+        'TTF Mean'      : g['time_to_fill'].mean(),
+        'TTF Median'    : g['time_to_fill'].median(),
+        'TTF P90'       : g['time_to_fill'].quantile(0.9),
+        'Rest Median'   : g['c_rest'].median(),
+    })
+    res['Fill Ratio']     = res['Traded Volume'] / res['Order Volume']
+    res['Cancel Rate']    = res['Cancelled'] / res['Orders']
+    res['Full Fill Rate'] = res['Filled'] / res['Orders']
+    res['Order To Trade'] = res['Orders'] / res['Fills'].where(res['Fills'] > 0)
+    return res.round(4)
+
+
+def RunAccount(task):
+    store_path, account, start_date, end_date, by = task
+    start  = time.time()
+    orders = settlestore(store_path, 'order').load(account, start_date, end_date)
+    trades = settlestore(store_path, 'trade').load(account, start_date, end_date)
+    life, orphans = GetLifecycle(orders, trades)
+    stats = GetOrderStats(life, by)
+    print('{} Done Orders {} orders {} trades {} without order {}'.format(account, len(orders), len(trades), len(orphans), time.time() - start))
+    return stats, len(orphans)
+
+
+def OrderAnalytics(store_path, accounts=None, start_date=None, end_date=None, by=('account', 'date', 'code'),
+                   settle_path=None, workers=None):
+    """
+    Order lifecycle statistics of every account in parallel, one task per account.
+    settle_path: ingest new settlement files into store_path first.
+    Returns GetOrderStats rows of all accounts
+    """
+    if settle_path is not None:
+        Ingest(settle_path, store_path, workers=workers)
+    accounts = settlestore(store_path, 'order').accounts() if accounts is None else list(accounts)
+    tasks = [(store_path, account, start_date, end_date, tuple(by)) for account in accounts]
+    if workers == 1:
+        res = [RunAccount(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            res = list(pool.map(RunAccount, tasks))
+    return pd.concat([r[0] for r in res], axis=0)
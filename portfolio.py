@@ -0,0 +1,234 @@
+import time
+import heapq
+import numpy as np
+import pandas as pd
+import database as db
+import metrics as mt
+import runner as rn
+from math import floor
+from backtest1 import backtest
+
+
+class leg(backtest):
+    """
+    One instrument of a portfolio. Trades with the backtest1 logic, but max position and
+    the freeze line are checked against the shared account
+    """
+    def __init__(self, instrument=None, **kwargs):
+        super().__init__(instrument, **kwargs)
+        self.account = None
+        self.cursor  = -1   # 当天最后执行的 tick
+        self.quote   = None # 最后一个 tick 的 (bp1, ap1, MidPrice)
+        self.pnl     = 0    # 最后一个 tick 的 realized + MTM
+
+    def GetMaxPos(self, price):
+        return self.account.GetMaxPos(self, price)
+
+    def IsFrozen(self, bp1, ap1):
+        return self.account.IsFrozen(self, bp1, ap1)
+
+    def hold(self, stamp, date_str=None):
+        """
+        One tick day at stamp on the last quote, for a forced close when the leg has no tick of its own yet.
+        date_str: the trading day, when start() did not run for it (no data that day)
+        """
+        if date_str is not None:
+            self.dates.append(date_str)
+            self.yst_pos  = self.open_pos
+            self.open_pos = 0
+        bp1, ap1, price = self.quote
+        self.index  = pd.DatetimeIndex(np.array([stamp], dtype='datetime64[ns]'))
+        self.stamps = np.array([stamp], dtype=np.int64)
+        zeros = np.zeros(1)
+        self.arrays = (np.array([bp1]), np.array([ap1]), zeros, zeros, np.array([price]), zeros,
+                       np.zeros(1, dtype=np.int8), np.zeros(1, dtype=np.int8))
+        self.path   = []
+        self.mark(-1)
+        self.cursor = -1
+        return 0
+
+
+class portfolio(object):
+    """
+    Multi-instrument backtest on one account: shared capital and margin, max position over all
+    instruments and one freeze line. Each day the tick streams of all instruments are heap-merged
+    in timestamp order, one day per instrument in memory (zero-copy from the tickstore when ingested).
+    """
+    def __init__(self, instruments, params=None, capital=100000, freeze_rate=0.4, acc_id='001'):
+        """
+        Kwargs:
+        1. instruments: list of str
+        2. params: dict of backtest kwargs and attributes for every leg, or {instrument: dict}
+        3. capital: float, shared by all legs
+        4. freeze_rate: float, account equity under capital * freeze_rate closes all legs and ends trading
+        """
+        params = {} if params is None else params
+        self.capital     = capital
+        self.freeze_rate = freeze_rate
+        self.acc_id      = acc_id
+        self.terminate   = False
+        self.dates       = []
+        self.legs        = {}
+        for instrument in instruments:
+            p = params.get(instrument, {}) if all(k in instruments for k in params) else params
+            p = dict(p, capital=capital, freeze_rate=freeze_rate, acc_id=acc_id)
+            self.legs[instrument] = rn.NewBacktest(instrument, p, cls=leg)
+            self.legs[instrument].account = self
+        self.total = 0 # 所有 leg 最后一个 tick 的 pnl 之和
+
+    def GetMaxPos(self, leg, price):
+        """
+        Same as backtest.GetMaxPos on the account: equity and used margin of all legs,
+        other legs valued at their last MidPrice
+        """
+        current_capital = self.capital
+        used_margin     = 0
+        for x in self.legs.values():
+            current_capital += x.realized + x.unrealized
+            if x.lpos + x.spos > 0:
+                used_margin += (x.lpos + x.spos) * x.margin * (price if x is leg else x.quote[2]) * x.size
+        margin = leg.margin * leg.size * price
+        return floor((current_capital - used_margin) / margin)
+
+    def IsFrozen(self, leg, bp1, ap1):
+        """
+        Account equity (other legs at their last quotes) under the freeze line
+        """
+        pnl = self.total - leg.pnl + leg.realized + leg.GetMTM(bp1, ap1)
+        return self.capital + pnl < self.capital * self.freeze_rate
+
+    def update(self, leg, i):
+        """
+        Last quote and pnl of a leg after its tick i
+        """
+        bp1, ap1, bv1, av1, price = leg.arrays[:5]
+        leg.cursor = i
+        leg.quote  = (bp1[i], ap1[i], price[i])
+        pnl = leg.realized + leg.GetMTM(bp1[i], ap1[i])
+        self.total += pnl - leg.pnl
+        leg.pnl = pnl
+        return 0
+
+    def freeze(self, stamp, legs):
+        """
+        Account under the freeze line at stamp: close every leg at its last quote, trading ends for all legs.
+        A leg without a tick of its own yet today is closed on a one tick day at stamp (leg.hold) and
+        added to the day's legs, so the close is stamped at the freeze and its end() records the equity
+        """
+        for x in self.legs.values():
+            if x.quote is not None and (x.lpos > 0 or x.spos > 0):
+                if x not in legs:
+                    x.hold(stamp, self.dates[-1])
+                    legs.append(x)
+                elif x.cursor < 0:
+                    x.hold(stamp)
+                i = max(x.cursor, 0)
+                x.close_all(x.quote[0], x.quote[1], i)
+                x.mark(i)
+                self.update(x, i)
+                print('{} {} Account Under Margin: Close all, End Trading'.format(x.index[i], x.instrument))
+            x.terminate = True
+        self.terminate = True
+        return 0
+
+    def run(self, df_dict, date_str):
+        """
+        One trading day. df_dict: {instrument: tick DataFrame with sigl / sigs}, instruments without
+        data that day are skipped (their positions are carried)
+        """
+        if self.terminate:
+            print('Date {} will not run: Portfolio is terminated'.format(date_str))
+            return None
+        self.dates.append(date_str)
+        legs = [x for instrument, x in self.legs.items() if instrument in df_dict and x.start(df_dict[instrument], date_str)]
+        for x in legs:
+            x.cursor = -1
+
+        # 按 (下一个 tick 时间, leg 序号) 归并, 每次执行一个 leg 到其他 leg 的下一个 tick 为止
+        heap = [(x.stamps[0], k) for k, x in enumerate(legs) if len(x.stamps) > 0]
+        heapq.heapify(heap)
+        while heap:
+            stamp, k = heapq.heappop(heap)
+            x = legs[k]
+            i = x.cursor + 1
+            n = len(x.stamps)
+            if heap:
+                stop = np.searchsorted(x.stamps, heap[0][0], side='right' if k < heap[0][1] else 'left')
+                stop = max(stop, i + 1)
+            else:
+                stop = n
+            done = False
+            for j in range(i, stop):
+                done = x.step(j)
+                if done:
+                    break
+            self.update(x, j)
+            if x.terminate:
+                self.freeze(x.stamps[j], legs)
+                break
+            if not done and stop < n:
+                heapq.heappush(heap, (x.stamps[stop], k))
+
+        for x in legs:
+            x.end()
+        return None
+
+    def RunRange(self, dates, data_path, feature_path='./feature/'):
+        """
+        Run dates in order, loading each instrument's ticks and signals one day at a time
+        """
+        start = time.time()
+        features = {instrument: rn.GetFeature(feature_path, instrument, x.freq) for instrument, x in self.legs.items()}
+        traded   = {instrument: set(db.GetTradeDates(data_path, instrument)) for instrument in self.legs}
+        for date in [str(d) for d in dates]:
+            df_dict = {}
+            for instrument, f in features.items():
+                if date in traded[instrument]:
+                    df = db.GetTickData(data_path, instrument, date)
+                    df_dict[instrument] = rn.GetSignals(df, f[f.TradeDate == int(date)])
+            self.run(df_dict, date)
+        print('Portfolio {} instruments {} days {}'.format(len(self.legs), len(self.dates), time.time() - start))
+        return self
+
+    def result(self):
+        """
+        ----- 结算表 -----
+        Fills of all legs in time order, total_pnl / total_rpnl on the account
+        """
+        frames = []
+        for x in self.legs.values():
+            res = x.reports.frame(0).copy()
+            res['d_pnl']  = np.diff(res['total_pnl'].values, prepend=0)
+            res['d_rpnl'] = np.diff(res['total_rpnl'].values, prepend=0)
+            frames.append(res)
+        res = pd.concat(frames, axis=0, ignore_index=True)
+        res = res.iloc[np.argsort(res['datetime'].values, kind='stable')].reset_index(drop=True)
+        res['total_pnl']  = self.capital + np.cumsum(res.pop('d_pnl').values)
+        res['total_rpnl'] = self.capital + np.cumsum(res.pop('d_rpnl').values)
+        return res
+
+    def equity(self):
+        """
+        ----- 逐 tick 盯市权益 -----
+        Account pnl, equity, used margin and usage on the merged tick clock
+        """
+        frames = [x.equity() for x in self.legs.values() if len(x.mtm) > 0]
+        stamps = np.concatenate([np.asarray(e.index, dtype='datetime64[ns]').view(np.int64) for e in frames])
+        d_pnl  = np.concatenate([np.diff(e['pnl'].values, prepend=0) for e in frames])
+        d_mgn  = np.concatenate([np.diff(e['margin'].values, prepend=0) for e in frames])
+        order  = np.argsort(stamps, kind='stable')
+        stamps = stamps[order]
+        pnl    = np.cumsum(d_pnl[order])
+        margin = np.cumsum(d_mgn[order])
+        # 同一时间戳保留最后一个
+        last = np.flatnonzero(np.diff(stamps, append=stamps[-1] + 1))
+        res = pd.DataFrame({'pnl': pnl[last], 'equity': self.capital + pnl[last], 'margin': margin[last]},
+                           index=pd.DatetimeIndex(stamps[last].astype('datetime64[ns]'), name='datetime'))
+        res['usage'] = res['margin'] / res['equity']
+        return res
+
+    def metric(self):
+        res = self.result()
+        metric = mt.GetAccount(res, sum(x.ticks for x in self.legs.values()), self.capital)
+        metric.index = ['Value']
+        return metric
@@ -0,0 +1,247 @@
+import time
+import numpy as np
+import pandas as pd
+import specs as sp
+import runner as rn
+import roundtrips as rt
+from engine import jit
+from settlestore import settlestore
+from concurrent.futures import ProcessPoolExecutor
+
+
+# 对账结果
+MATCHED, MISSED, EXTRA = 'matched', 'missed', 'extra'
+
+
+def GetBacktestFills(bt):
+    """
+    backtest1 reports -> fills with trade date, lower case code, buy / open flags, int64 ns time.
+    The trade date of a fill is the last day whose first tick (bt.mtm) is at or before it
+    """
+    res    = bt.reports.frame(0)
+    stamps = np.asarray(res['datetime'].values, dtype='datetime64[ns]').view(np.int64)
+    starts = np.array([x[0] for x in bt.mtm], dtype=np.int64)
+    dates  = np.array([int(d) for d in bt.dates[:len(starts)]], dtype=np.int64)
+    day    = np.searchsorted(starts, stamps, side='right') - 1
+    codes, uniques = pd.factorize(res['action'])
+    opens  = np.array([('开' in str(u)) or ('加' in str(u)) for u in uniques], dtype=bool)[codes] if len(res) > 0 else np.zeros(0, dtype=bool)
+    return pd.DataFrame({
+        'date'    : dates[np.maximum(day, 0)] if len(dates) > 0 else np.zeros(len(res), dtype=np.int64),
+        'code'    : res['code'].str.lower().values,
+        'buy'     : (res['direction'].values == '多') == opens,
+        'open'    : opens,
+        'datetime': stamps,
+        'price'   : res['price'].values,
+        'volume'  : res['volume'].values.astype(np.int64),
+        'fee'     : res['total_fee'].values,
+        'r_pnl'   : res['r_pnl'].values,
+    })
+
+
+def GetTotalFee(ex_fee, volume, bt):
+    """
+    Exchange fees -> total fees with the broker fee and rebates of bt (same formula as backtest.GetFees)
+    """
+    br_fee = ex_fee * (1 + bt.broker_rate) if bt.broker_rate < 1 else volume * bt.broker_rate
+    return np.round(ex_fee + br_fee - ex_fee * bt.ex_rebate * bt.br_rebate, 2)
+
+
+def GetLiveFills(trades, bt):
+    """
+    settlestore trade frame -> fills in the GetBacktestFills layout. fee: exchange fees from the specs
+    plus the broker fee and rebates of bt, so it compares with the backtest's total_fee
+    """
+    offset = np.asarray(trades['offset'], dtype=object)
+    price  = np.asarray(trades['price'], dtype=np.float64)
+    volume = np.asarray(trades['volume'], dtype=np.int64)
+    unit, size = rt.GetUnitFees(np.asarray(trades['code'], dtype=object), offset, price)
+    return pd.DataFrame({
+        'date'    : np.asarray(trades['date'], dtype=np.int64),
+        'code'    : np.asarray(trades['code'], dtype=str),
+        'buy'     : np.asarray(trades['direction'], dtype=object) == '多',
+        'open'    : offset == '开',
+        'datetime': np.asarray(trades['datetime'], dtype='datetime64[ns]').view(np.int64),
+        'price'   : price,
+        'volume'  : volume,
+        'fee'     : GetTotalFee(np.round(unit * volume, 2), volume, bt),
+        'orderid' : np.asarray(trades['orderid'], dtype=np.int64),
+    })
+
+
+@jit
+def MatchWindow(g_a, t_a, q_a, g_b, t_b, q_b, window, out_a, out_b, out_q):
+    """
+    Interval join of two fill streams sorted by (group, time): each lot of a is matched to the
+    earliest unmatched lot of b in the same group within [t - window, t + window].
+    Writes pieces (a index or -1, b index or -1, qty), returns their number
+    """
+    na, nb = len(g_a), len(g_b)
+    i, j, n = 0, 0, 0
+    ra = q_a[0] if na > 0 else 0
+    rb = q_b[0] if nb > 0 else 0
+    while i < na or j < nb:
+        if i < na and j < nb and g_a[i] == g_b[j] and abs(t_b[j] - t_a[i]) <= window:
+            q = min(ra, rb)
+            out_a[n], out_b[n], out_q[n] = i, j, q
+            ra -= q
+            rb -= q
+        elif j < nb and (i >= na or g_b[j] < g_a[i] or (g_b[j] == g_a[i] and t_b[j] < t_a[i])):
+            # b 在窗口前面: 多出来的成交
+            out_a[n], out_b[n], out_q[n] = -1, j, rb
+            rb = 0
+        else:
+            # a 在窗口里没有对应: 漏掉的成交
+            out_a[n], out_b[n], out_q[n] = i, -1, ra
+            ra = 0
+        n += 1
+        if i < na and ra == 0:
+            i += 1
+            ra = q_a[i] if i < na else 0
+        if j < nb and rb == 0:
+            j += 1
+            rb = q_b[j] if j < nb else 0
+    return n
+
+
+def MatchFills(bt_fills, live_fills, window=30):
+    """
+    Pieces of backtest and live fills: same code, buy / sell and open / close, live time within window
+    seconds of the backtest time. Returns one row per piece with status matched / missed / extra
+    """
+    keys = [np.concatenate([bt_fills[k].values, live_fills[k].values]) for k in ['code', 'buy', 'open']]
+    group = pd.MultiIndex.from_arrays(keys).factorize()[0] if len(keys[0]) > 0 else np.zeros(0, dtype=np.int64)
+    g_a, g_b = group[:len(bt_fills)], group[len(bt_fills):]
+    t_a, t_b = bt_fills['datetime'].values, live_fills['datetime'].values
+    o_a = np.lexsort((t_a, g_a))
+    o_b = np.lexsort((t_b, g_b))
+    size  = len(o_a) + len(o_b)
+    out_a = np.zeros(size, dtype=np.int64)
+    out_b = np.zeros(size, dtype=np.int64)
+    out_q = np.zeros(size, dtype=np.int64)
+    n = MatchWindow(g_a[o_a], t_a[o_a], bt_fills['volume'].values[o_a], g_b[o_b], t_b[o_b], live_fills['volume'].values[o_b],
+                    int(window * 1e9), out_a, out_b, out_q)
+    a = np.where(out_a[:n] >= 0, o_a[np.maximum(out_a[:n], 0)] if len(o_a) > 0 else -1, -1)
+    b = np.where(out_b[:n] >= 0, o_b[np.maximum(out_b[:n], 0)] if len(o_b) > 0 else -1, -1)
+    q = out_q[:n]
+
+    def take(df, idx, name, fill):
+        values = df[name].values
+        return np.where(idx >= 0, values[np.maximum(idx, 0)] if len(values) > 0 else fill, fill)
+
+    res = pd.DataFrame({
+        'status'    : np.where(a < 0, EXTRA, np.where(b < 0, MISSED, MATCHED)),
+        'date'      : np.where(a >= 0, take(bt_fills, a, 'date', -1), take(live_fills, b, 'date', -1)),
+        'code'      : np.where(a >= 0, take(bt_fills, a, 'code', ''), take(live_fills, b, 'code', '')),
+        'buy'       : np.where(a >= 0, take(bt_fills, a, 'buy', False), take(live_fills, b, 'buy', False)),
+        'open'      : np.where(a >= 0, take(bt_fills, a, 'open', False), take(live_fills, b, 'open', False)),
+        'bt_time'   : take(bt_fills, a, 'datetime', np.iinfo(np.int64).min).astype('datetime64[ns]'),
+        'live_time' : take(live_fills, b, 'datetime', np.iinfo(np.int64).min).astype('datetime64[ns]'),
+        'bt_price'  : take(bt_fills, a, 'price', np.nan),
+        'live_price': take(live_fills, b, 'price', np.nan),
+        'orderid'   : take(live_fills, b, 'orderid', -1),
+        'volume'    : q,
+    })
+    # 滑点: 正数为实盘比回测差
+    res['slippage'] = np.where(res['buy'].values, 1, -1) * (res['live_price'].values - res['bt_price'].values)
+    res['lag']      = res['live_time'] - res['bt_time']
+    res = res.sort_values(['date', 'bt_time', 'live_time'], kind='stable').reset_index(drop=True)
+    return res
+
+
+def GetDays(fills, bt_fills, live_fills, trips, ticksize, size):
+    """
+    Per trade date: volumes, match rate, slippage distribution (ticks, per lot) and pnl attribution.
+    Live PnL - BT PnL = Slippage PnL (price of matched lots) + Fee PnL (backtest - live fees)
+    + Residual (missed / extra fills and timing).
+    Both sides are net of total fees: the backtest's total_fee, and the live exchange fees with the
+    backtest's broker_rate / ex_rebate / br_rebate applied (GetLiveFills), so equal fills pay equal fees
+    """
+    lots  = fills[fills['status'] == MATCHED]
+    ticks = np.repeat(lots['slippage'].values / ticksize, lots['volume'].values)
+    dates = np.repeat(lots['date'].values, lots['volume'].values)
+    lags  = np.repeat(lots['lag'].values.astype('timedelta64[ns]').astype(np.int64) / 1e9, lots['volume'].values)
+    slip  = pd.DataFrame({'date': dates, 'ticks': ticks, 'lag': lags}).groupby('date')
+
+    volume = fills.pivot_table(index='date', columns='status', values='volume', aggfunc='sum', fill_value=0)
+    volume = volume.reindex(columns=[MATCHED, MISSED, EXTRA], fill_value=0)
+    res = pd.DataFrame(index=volume.index)
+    res['BT Volume']   = volume[MATCHED] + volume[MISSED]
+    res['Live Volume'] = volume[MATCHED] + volume[EXTRA]
+    res['Matched']     = volume[MATCHED]
+    res['Missed']      = volume[MISSED]
+    res['Extra']       = volume[EXTRA]
+    res['Match Rate']  = (res['Matched'] / res['BT Volume'].where(res['BT Volume'] > 0)).round(4)
+    res['Slippage Mean']   = slip['ticks'].mean()
+    res['Slippage Median'] = slip['ticks'].median()
+    res['Slippage P90']    = slip['ticks'].quantile(0.9)
+    res['Lag Median']      = slip['lag'].median()
+
+    bt_pnl   = bt_fills.groupby('date')['r_pnl'].sum()
+    live_fee = live_fills.groupby('date')['fee'].sum()
+    live_pnl = trips.groupby('close_date')['pnl'].sum().sub(live_fee, fill_value=0)
+    fee_pnl  = bt_fills.groupby('date')['fee'].sum().sub(live_fee, fill_value=0)
+    slip_pnl = (-lots['slippage'] * lots['volume'] * size).groupby(lots['date']).sum()
+    res['BT PnL']       = bt_pnl.reindex(res.index).fillna(0)
+    res['Live PnL']     = live_pnl.reindex(res.index).fillna(0)
+    res['Slippage PnL'] = slip_pnl.reindex(res.index).fillna(0)
+    res['Fee PnL']      = fee_pnl.reindex(res.index).fillna(0)
+    res['Residual']     = res['Live PnL'] - res['BT PnL'] - res['Slippage PnL'] - res['Fee PnL']
+    return res.round(2)
+
+
+def GetSlippage(fills, ticksize, by=('buy', 'open')):
+    """
+    Slippage distribution in ticks per lot of the matched fills, by buy / open (or any fills columns)
+    """
+    lots = fills[fills['status'] == MATCHED]
+    lots = lots.loc[lots.index.repeat(lots['volume'].values)]
+    ticks = (lots['slippage'] / ticksize).rename('ticks')
+    return ticks.groupby([lots[k] for k in by]).describe(percentiles=[0.1, 0.25, 0.5, 0.75, 0.9])
+
+
+def Reconcile(bt, trades, window=30):
+    """
+    ----- 实盘对账 -----
+    Backtest fills of bt against the live fills (settlestore trade frame) of its instrument on its dates.
+    window: seconds a live fill may be away from the backtest fill.
+    Returns (fills, days): matched / missed / extra pieces and the per day report of GetDays
+    """
+    dates  = [int(d) for d in bt.dates]
+    codes  = np.asarray(trades['code'], dtype=str)
+    keep   = np.isin(np.asarray(trades['date'], dtype=np.int64), dates)
+    keep  &= np.array([sp.SplitContract(c)[0] == bt.instrument.upper() for c in codes], dtype=bool) if len(codes) > 0 else keep
+    trades = trades[keep]
+    bt_fills   = GetBacktestFills(bt)
+    live_fills = GetLiveFills(trades, bt)
+    fills = MatchFills(bt_fills, live_fills, window)
+    days  = GetDays(fills, bt_fills, live_fills, rt.GetRoundTrips(trades), bt.ticksize, bt.size)
+    return fills, days
+
+
+def RunAccount(task):
+    account, instrument, params, checkpoint, store_path, window = task
+    start = time.time()
+    bt = rn.NewBacktest(instrument, params)
+    bt.restore(checkpoint)
+    trades = settlestore(store_path, 'trade').load(account, min(bt.dates), max(bt.dates))
+    fills, days = Reconcile(bt, trades, window)
+    print('{} Done Reconcile {} days {}'.format(account, len(days), time.time() - start))
+    return account, fills, days
+
+
+def ReconcileAccounts(store_path, checkpoints, instrument, params=None, window=30, workers=None):
+    """
+    Reconcile many accounts in parallel.
+    checkpoints: {account: backtest checkpoint (.npz saved with history, see backtest.save, or a
+                  runner.GetBacktest checkpoint directory)}
+    Returns (fills, days) of all accounts with an account column
+    """
+    tasks = [(account, instrument, params or {}, path, store_path, window) for account, path in checkpoints.items()]
+    if workers == 1:
+        res = [RunAccount(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            res = list(pool.map(RunAccount, tasks))
+    fills = pd.concat([f.assign(account=a) for a, f, d in res], axis=0, ignore_index=True)
+    days  = pd.concat({a: d for a, f, d in res}, axis=0, names=['account', 'date'])
+    return fills, days
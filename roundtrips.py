@@ -0,0 +1,192 @@
+import time
+import numpy as np
+import pandas as pd
+import metrics as mt
+import specs as sp
+
+
+# 平今只平当天开的仓, 平昨 / 平 按 FIFO 平剩下的仓
+SIDES = ['多', '空']
+
+
+def MatchFIFO(o_pool, o_qty, c_pool, c_qty):
+    """
+    FIFO matching of many pools at once on cumulative quantities.
+    Opens and closes are sorted by (pool, time), pools are int codes. The k-th lot closed in a pool
+    is the k-th lot opened in it, so matches are the overlaps of the cumulative [start, end) ranges.
+    Returns (open index, close index, qty) per matched piece, open index -1 for closed lots beyond
+    the pool's opens (position opened before the data)
+    """
+    o_qty  = np.asarray(o_qty, dtype=np.int64)
+    c_qty  = np.asarray(c_qty, dtype=np.int64)
+    npool  = int(max(np.max(o_pool, initial=-1), np.max(c_pool, initial=-1))) + 1
+    o_tot  = np.bincount(o_pool, weights=o_qty, minlength=npool).astype(np.int64)
+    c_tot  = np.bincount(c_pool, weights=c_qty, minlength=npool).astype(np.int64)
+    # 每个 pool 占 [base, base + max(开, 平)) 一段
+    base   = np.concatenate([[0], np.cumsum(np.maximum(o_tot, c_tot))])
+    o_end  = base[o_pool] + np.cumsum(o_qty) - np.concatenate([[0], np.cumsum(o_tot)])[o_pool]
+    c_end  = base[c_pool] + np.cumsum(c_qty) - np.concatenate([[0], np.cumsum(c_tot)])[c_pool]
+
+    points = np.unique(np.concatenate([base, o_end, c_end]))
+    starts = points[:-1]
+    qty    = np.diff(points)
+    pool   = np.searchsorted(base, starts, side='right') - 1
+    oi     = np.searchsorted(o_end, starts, side='right')
+    ci     = np.searchsorted(c_end, starts, side='right')
+    keep   = ci < len(c_end)
+    keep[keep] &= c_pool[ci[keep]] == pool[keep]
+    oi, ci, qty, pool = oi[keep], ci[keep], qty[keep], pool[keep]
+    found  = oi < len(o_end)
+    found[found] &= o_pool[oi[found]] == pool[found]
+    oi[~found] = -1
+    return oi, ci, qty
+
+
+def Match(opens, o_qty, closes, c_qty, keys, stamps):
+    """
+    Match open rows to close rows FIFO within groups of keys (list of per row arrays), in time order.
+    Returns (open row or -1, close row, qty)
+    """
+    rows  = np.concatenate([opens, closes])
+    pools = pd.MultiIndex.from_arrays([k[rows] for k in keys]).factorize()[0] if len(rows) > 0 else np.zeros(0, dtype=np.int64)
+    o_pool, c_pool = pools[:len(opens)], pools[len(opens):]
+    o_ord = np.lexsort((opens, stamps[opens], o_pool))
+    c_ord = np.lexsort((closes, stamps[closes], c_pool))
+    oi, ci, qty = MatchFIFO(o_pool[o_ord], o_qty[o_ord], c_pool[c_ord], c_qty[c_ord])
+    o_row = np.where(oi >= 0, opens[o_ord][np.maximum(oi, 0)] if len(opens) > 0 else -1, -1)
+    return o_row, closes[c_ord][ci], qty
+
+
+def GetUnitFees(codes, offsets, prices):
+    """
+    Exchange fee of one lot per fill from the instrument specs:
+    开 -> open, 平今 -> closeT, 平昨 / 平 -> closeN. Returns (unit fee, contract size)
+    """
+    codes, uniques = pd.factorize(codes)
+    rows   = np.array([sp.GetRow(sp.SplitContract(str(u))[0], str(u)) for u in uniques], dtype=np.int64)
+    specs  = sp.SPECS[rows]
+    kernel = np.stack([sp.GetFeeKernel(spec) for spec in specs]) if len(specs) > 0 else np.zeros((0, 3, 2))
+    action = np.where(offsets == '开', sp.FEE_ACTIONS['open'], np.where(offsets == '平今', sp.FEE_ACTIONS['closeT'], sp.FEE_ACTIONS['closeN']))
+    rate   = kernel[codes, action, 0]
+    flat   = kernel[codes, action, 1]
+    size   = specs['size'][codes].astype(np.float64)
+    return prices * rate * size + flat, size
+
+
+def GetRoundTrips(trades):
+    """
+    ----- 开平配对 -----
+    Live fills (settlestore trade frame: account, date, code, orderid, direction, offset, price,
+    volume, datetime) -> one row per matched (open fill, close fill) piece, FIFO per account,
+    contract and position side, across days.
+    平今 closes the day's own opens, 平昨 / 平 close the oldest lots left.
+
+    Returns side (position 多 / 空), offset of the close, open / close date, time, orderid and
+    price, volume, pnl (before fees), fee (exchange fees of both legs), net pnl and holding time.
+    Closes without an open in the data have NaN open fields
+    """
+    start   = time.time()
+    n       = len(trades)
+    account = np.asarray(trades['account'], dtype=object)
+    code    = np.asarray(trades['code'], dtype=object)
+    offset  = np.asarray(trades['offset'], dtype=object)
+    buy     = np.asarray(trades['direction'], dtype=object) == '多'
+    date    = np.asarray(trades['date'], dtype=np.int64)
+    price   = np.asarray(trades['price'], dtype=np.float64)
+    volume  = np.asarray(trades['volume'], dtype=np.int64)
+    stamps  = np.asarray(trades['datetime'], dtype='datetime64[ns]').view(np.int64)
+    is_open = offset == '开'
+    # 持仓方向: 买开 / 卖平 为多头
+    side    = np.where(buy == is_open, 0, 1)
+
+    # 1. 平今 对当天的开仓
+    opens   = np.flatnonzero(is_open)
+    today   = np.flatnonzero(offset == '平今')
+    o1, c1, q1 = Match(opens, volume[opens], today, volume[today], [account, code, side, date], stamps)
+    left    = volume - np.bincount(o1[o1 >= 0], weights=q1[o1 >= 0], minlength=n).astype(np.int64)
+
+    # 2. 平昨 / 平 对剩下的仓
+    opens   = opens[left[opens] > 0]
+    others  = np.flatnonzero(~is_open & (offset != '平今'))
+    o2, c2, q2 = Match(opens, left[opens], others, volume[others], [account, code, side], stamps)
+
+    o_row   = np.concatenate([o1, o2])
+    c_row   = np.concatenate([c1, c2])
+    qty     = np.concatenate([q1, q2])
+    order   = np.lexsort((o_row, c_row))
+    o_row, c_row, qty = o_row[order], c_row[order], qty[order]
+
+    unit, size = GetUnitFees(code, offset, price)
+    found   = o_row >= 0
+    o_safe  = np.maximum(o_row, 0)
+    sign    = np.where(side[c_row] == 0, 1.0, -1.0)
+    o_price = np.where(found, price[o_safe], np.nan)
+    o_time  = np.where(found, stamps[o_safe], np.iinfo(np.int64).min).astype('datetime64[ns]')
+    pnl     = sign * (price[c_row] - o_price) * qty * size[c_row]
+    fee     = (np.where(found, unit[o_safe], 0) + unit[c_row]) * qty
+    res = pd.DataFrame({
+        'account'      : account[c_row],
+        'code'         : code[c_row],
+        'side'         : np.array(SIDES, dtype=object)[side[c_row]],
+        'offset'       : offset[c_row],
+        'open_date'    : np.where(found, date[o_safe], -1),
+        'close_date'   : date[c_row],
+        'open_time'    : o_time,
+        'close_time'   : stamps[c_row].astype('datetime64[ns]'),
+        'open_orderid' : np.where(found, np.asarray(trades['orderid'])[o_safe], -1),
+        'close_orderid': np.asarray(trades['orderid'])[c_row],
+        'open_price'   : o_price,
+        'close_price'  : price[c_row],
+        'volume'       : qty,
+        'pnl'          : np.round(pnl, 2),
+        'fee'          : np.round(fee, 2),
+        'net_pnl'      : np.round(pnl - fee, 2),
+    })
+    res['holding'] = res['close_time'] - res['open_time']
+    print('Done Round Trips {} fills {} trips {}'.format(n, len(res), time.time() - start))
+    return res
+
+
+def ToReport(trips, capital=100000):
+    """
+    Matched round trips as a backtest style report (close rows only, r_pnl = net pnl, total_rpnl on capital),
+    so metrics.GetSideStats / GetAccount / GetDrawdownReport work on live fills
+    """
+    trips = trips[trips['open_date'] >= 0]
+    trips = trips.iloc[np.argsort(trips['close_time'].values, kind='stable')]
+    res = pd.DataFrame({
+        'account_id': trips['account'].values,
+        'datetime'  : trips['close_time'].values,
+        'code'      : trips['code'].values,
+        'price'     : trips['close_price'].values,
+        'direction' : trips['side'].values,
+        'action'    : trips['offset'].values,
+        'volume'    : trips['volume'].values,
+        'total_fee' : trips['fee'].values,
+        'r_pnl'     : trips['net_pnl'].values,
+    })
+    res['total_rpnl'] = capital + np.cumsum(res['r_pnl'].values)
+    res['total_pnl']  = res['total_rpnl']
+    return res
+
+
+def GetTripMetrics(trips, capital=100000, by='account'):
+    """
+    metrics.GetAccount of the live round trips per group (account, code, ...), plus trip counts,
+    volume, fees and mean holding time
+    """
+    rows = {}
+    for key, group in trips.groupby(by, sort=True, observed=True):
+        res = ToReport(group, capital)
+        if mt.HasCloses(res):
+            acc = mt.GetAccount(res, 0, capital).iloc[0].drop('Ticks Modelled').to_dict()
+        else:
+            # 没有平仓或单边没有平仓
+            acc = {'Initial Capital': capital}
+        acc['Trips']   = len(res)
+        acc['Volume']  = int(group['volume'].sum())
+        acc['Fees']    = round(group['fee'].sum(), 2)
+        acc['Holding'] = group['holding'].mean()
+        acc['Unmatched'] = int(group.loc[group['open_date'] < 0, 'volume'].sum())
+        rows[key] = acc
+    return pd.DataFrame(rows).T
@@ -0,0 +1,189 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+import database as db
+import featurestore as fs
+import tickstore as ts
+from backtest1 import backtest
+from concurrent.futures import ProcessPoolExecutor
+
+
+# backtest.__init__ 参数, 其余参数 (freeze_rate, stoplosstick, lot, halt_time) 作为属性设置
+CTOR_PARAMS = ['freq', 'slippage', 'acc_id', 'capital', 'broker_rate', 'ex_rebate', 'br_rebate']
+
+
+def AlignSignals(time, bar_time, bar_sigl, bar_sigs, tick_day=None, bar_day=None, tolerance='30s'):
+    """
+    Map bar signals onto ticks for a whole date range in one pass (same result as per-day
+    merge_asof(direction='backward', tolerance) + SignalFilter):
+    each tick takes the signal of the last bar at or before it if the bar is within tolerance
+    (and on the same trade day when tick_day / bar_day are given), NaN -> 0, and only the first
+    tick of each run of the same signal keeps it. Returns (sigl, sigs) int8 arrays
+    """
+    time     = np.asarray(time, dtype=np.int64)
+    bar_time = np.asarray(bar_time, dtype=np.int64)
+    k     = np.searchsorted(bar_time, time, side='right') - 1
+    valid = k >= 0
+    k[~valid] = 0
+    valid &= time - bar_time[k] <= pd.Timedelta(tolerance).value
+    if tick_day is not None:
+        valid &= np.asarray(bar_day)[k] == np.asarray(tick_day)
+        start = np.concatenate([[True], np.diff(tick_day) != 0])
+    else:
+        start = np.zeros(len(time), dtype=bool)
+        start[:1] = True
+    res = []
+    for sig in [bar_sigl, bar_sigs]:
+        sig = np.nan_to_num(np.asarray(sig, dtype=np.float64))
+        out = np.zeros(len(time), dtype=np.int8)
+        out[valid] = sig[k[valid]]
+        prev = np.concatenate([[0], out[:-1]])
+        prev[start] = 0
+        out[out == prev] = 0
+        res.append(out)
+    return res[0], res[1]
+
+
+def GetTickTimes(data_path, instrument, dates, load=None):
+    """
+    Tick timestamps (int64 ns) and trade day of every tick for dates, plus {date: (start, stop)} slices.
+    Zero-copy from the tickstore when data_path has been ingested. load: date -> tick DataFrame the
+    caller already holds (or caches), so CSV days are not parsed once more just for their index
+    """
+    if ts.HasStore(data_path, instrument):
+        store = ts.Open(data_path, instrument)
+        parts = [store.load(date, columns=['datetime'])['datetime'] for date in dates]
+    else:
+        load  = load or (lambda date: db.GetTickData(data_path, instrument, date))
+        parts = [np.asarray(load(date).index, dtype='datetime64[ns]').view(np.int64) for date in dates]
+    stops = np.cumsum([len(x) for x in parts])
+    slices = {date: (stop - len(x), stop) for date, x, stop in zip(dates, parts, stops)}
+    time = np.concatenate(parts) if len(parts) > 0 else np.zeros(0, dtype=np.int64)
+    days = np.repeat([int(date) for date in dates], [len(x) for x in parts])
+    return time, days, slices
+
+
+def GetRangeSignals(data_path, instrument, dates, f, tolerance='30s', load=None):
+    """
+    {date: (sigl, sigs)} tick signals for every date with one alignment call per instrument
+    """
+    time, days, slices = GetTickTimes(data_path, instrument, dates, load)
+    f = f[f.TradeDate.isin([int(date) for date in dates])]
+    bar_time = np.asarray(f.index, dtype='datetime64[ns]').view(np.int64)
+    sigl, sigs = AlignSignals(time, bar_time, f['sigl'].values, f['sigs'].values, days, f['TradeDate'].values, tolerance)
+    return {date: (sigl[start:stop], sigs[start:stop]) for date, (start, stop) in slices.items()}
+
+
+def GetSignals(df, f, tolerance='30s'):
+    """
+    One day: map bar signals onto ticks of df
+    """
+    time = np.asarray(df.index, dtype='datetime64[ns]').view(np.int64)
+    bar_time = np.asarray(f.index, dtype='datetime64[ns]').view(np.int64)
+    df['sigl'], df['sigs'] = AlignSignals(time, bar_time, f['sigl'].values, f['sigs'].values, tolerance=tolerance)
+    return df
+
+
+# 每个进程各自缓存特征, 同一进程内的多组参数不重复读取
+FEATURES = {}
+
+def GetFeature(feature_path, instrument, freq):
+    """
+    Features from the featurestore if materialized, else from <feature_path>/<instrument>/<freq>.csv
+    """
+    path = os.path.join(feature_path, instrument, freq + '.csv')
+    if path not in FEATURES:
+        if fs.HasStore(feature_path, instrument, freq):
+            FEATURES[path] = fs.featurestore(feature_path, instrument, freq).load()
+        else:
+            FEATURES[path] = pd.read_csv(path, index_col=0, parse_dates=True)
+    return FEATURES[path]
+
+
+def NewBacktest(instrument, params, cls=backtest):
+    """
+    backtest1.backtest (or a subclass) from a param dict: constructor kwargs + attributes
+    """
+    kwargs = {k: v for k, v in params.items() if k in CTOR_PARAMS}
+    bt = cls(instrument, **kwargs)
+    for k, v in params.items():
+        if k not in CTOR_PARAMS:
+            assert hasattr(bt, k), 'No such backtest param = {}'.format(k)
+            setattr(bt, k, v)
+    return bt
+
+
+def GetBacktest(instrument, params, dates, data_path, feature_path, engine='python', checkpoint=None):
+    """
+    Run backtest1.backtest for one instrument and one parameter set over dates.
+    checkpoint: directory, after every day the state and only that day's fills / equity are saved to
+    <day number>_<date>.npz, so the writes stay linear in days; a rerun resumes after the last saved day.
+    Returns (backtest, seconds)
+    """
+    start = time.time()
+    bt = NewBacktest(instrument, params)
+    if checkpoint is not None:
+        os.makedirs(checkpoint, exist_ok=True)
+        bt.restore(checkpoint)
+        if bt.dates:
+            print('{} Resume from {} after {}'.format(instrument, checkpoint, bt.dates[-1]))
+    dates = [date for date in dates if date not in bt.dates]
+    ff = GetFeature(feature_path, instrument, bt.freq)
+    # tickstore: 整段一次对齐 (只读 datetime 列); CSV: 每天对齐已经读入的 df, 不重复解析
+    store = ts.HasStore(data_path, instrument)
+    signals = GetRangeSignals(data_path, instrument, dates, ff) if store else {}
+    for date in dates:
+        df = db.GetTickData(data_path, instrument, date)
+        if store:
+            df['sigl'], df['sigs'] = signals[date]
+        else:
+            df = GetSignals(df, ff[ff.TradeDate == int(date)])
+        fills, days = len(bt.reports), len(bt.mtm)
+        bt.run(df, date, engine=engine)
+        if checkpoint is not None:
+            bt.save(os.path.join(checkpoint, '{:05d}_{}.npz'.format(len(bt.dates), date)), fills=fills, days=days)
+    return bt, time.time() - start
+
+
+def GetReport(bt, seconds):
+    res = pd.concat([bt.account(), bt.stats(), bt.metric()], axis=1)
+    res['Seconds'] = round(seconds, 2)
+    return res
+
+
+def RunTask(task):
+    instrument, params, dates, data_path, feature_path, engine = task
+    bt, seconds = GetBacktest(instrument, params, dates, data_path, feature_path, engine)
+    print('{} Done Backtest {}'.format(instrument, seconds))
+    return GetReport(bt, seconds)
+
+
+def RunBacktests(instruments, param_sets, dates, data_path, feature_path='./feature/', engine='python', workers=None):
+    """
+    Fan out (instrument x param set) backtests over a process pool.
+    Workers only receive paths and params; ticks come from the memory-mapped tickstore
+    (shared page cache) when data_path has been ingested, features are cached per worker.
+
+    Kwargs:
+    1. instruments: list of str
+    2. param_sets: dict or list of dict, backtest kwargs and attributes
+    3. dates: list of str
+    4. workers: int, 1 runs in this process
+
+    Returns account / stats / metric table, one row per run, with param set number and seconds
+    """
+    param_sets = [param_sets] if isinstance(param_sets, dict) else list(param_sets)
+    dates = [str(d) for d in dates]
+    tasks = [(instrument, params, dates, data_path, feature_path, engine) for instrument in instruments for params in param_sets]
+    start = time.time()
+    if workers == 1:
+        res = [RunTask(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            res = list(pool.map(RunTask, tasks))
+    for k, r in enumerate(res):
+        r.insert(0, 'Param Set', k % len(param_sets))
+    res = pd.concat(res, axis=0, ignore_index=True)
+    print('Done {} Backtests {}'.format(len(tasks), time.time() - start))
+    return res
@@ -0,0 +1,80 @@
+import numpy as np
+import specs as sp
+
+
+# 交易所日盘时段
+SCHEDULES = {
+    'DCE'  : ['09:00-10:15', '10:30-11:30', '13:30-15:00'],
+    'ZCE'  : ['09:00-10:15', '10:30-11:30', '13:30-15:00'],
+    'SHFE' : ['09:00-10:15', '10:30-11:30', '13:30-15:00'],
+    'INE'  : ['09:00-10:15', '10:30-11:30', '13:30-15:00'],
+    'CFFEX': ['09:30-11:30', '13:00-15:00'],
+}
+
+
+def ToSeconds(hhmm):
+    h, m = hhmm.split(':')
+    return int(h) * 3600 + int(m) * 60
+
+
+# 18:00 以后的 tick 属于下一个交易日的夜盘
+NIGHT_CUTOFF = 18 * 3600
+
+
+def ParseSession(text):
+    """
+    Session text -> [start, end) on the trading day axis: seconds since midnight of the night session's
+    calendar day. '21:00-01:00' -> (75600, 90000), '09:00-10:15' -> (118800, 123300)
+    """
+    start, end = [ToSeconds(x) for x in text.split('-')]
+    start = start if start >= NIGHT_CUTOFF else start + 86400
+    end   = end if end >= NIGHT_CUTOFF else end + 86400
+    return start, end
+
+
+def ToAxis(time):
+    """
+    int64 ns (exchange local time) -> float seconds on the trading day axis
+    """
+    sec = (np.asarray(time, dtype=np.int64) % 86_400_000_000_000) / 1e9
+    return np.where(sec >= NIGHT_CUTOFF, sec, sec + 86400)
+
+
+# 按品种缓存
+SESSIONS = {}
+
+def GetSessions(instrument):
+    """
+    (k, 2) int64 array of [start, end) trading day axis seconds in trading order: night first, then day sessions
+    """
+    if instrument not in SESSIONS:
+        spec  = sp.GetSpec(instrument)
+        texts = ([str(spec['night'])] if spec['night'] else []) + SCHEDULES[str(spec['exchange'])]
+        SESSIONS[instrument] = np.array([ParseSession(x) for x in texts], dtype=np.int64)
+    return SESSIONS[instrument]
+
+
+def GetSessionID(time, sessions, grace=60):
+    """
+    time: int64 ns (exchange local time). Returns int8 session number per tick, -1 outside every session.
+    Ticks up to grace seconds after a session end still belong to it (late ticks at 10:15:00.5, 15:00:00.5)
+    """
+    x   = ToAxis(time)
+    sid = np.full(len(x), -1, dtype=np.int8)
+    for k, (start, end) in enumerate(sessions):
+        sid[(x >= start) & (x < end + grace) & (sid < 0)] = k
+    return sid
+
+
+def GetTradingSeconds(time, instrument):
+    """
+    int64 ns timestamps of one trading day -> trading seconds since the
+    first session open, with the night/day gap, 10:15 break and lunch removed in one vectorized pass.
+    Ticks outside the sessions (auction, late ticks) are clipped to the nearest session edge, and a
+    missing session (no night session after a holiday) simply contributes nothing.
+    """
+    x   = ToAxis(time)
+    res = np.zeros(len(x))
+    for start, end in GetSessions(instrument):
+        res += np.clip(x - start, 0, end - start)
+    return res
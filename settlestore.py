@@ -0,0 +1,190 @@
+import os
+import re
+import glob
+import time
+import shutil
+import argparse
+import numpy as np
+import pandas as pd
+from colstore import colstore
+from concurrent.futures import ProcessPoolExecutor
+
+
+# 结算文件: settlement/<account>/data_<kind>_<YYYY-MM-DD>.csv
+# 列名 -> dtype, 'cat' 为分类列 (colstore 存 int32 编码)
+SCHEMAS = {
+    'trade': {
+        'account'  : 'cat',
+        'date'     : '<i4', # 交易日 YYYYMMDD (文件日期)
+        'code'     : 'cat',
+        'exchange' : 'cat',
+        'session'  : 'cat', # orderid 前缀 (front_session)
+        'orderid'  : '<i8',
+        'tradeid'  : '<i8', # 没有 tradeid 列的文件为 -1
+        'direction': 'cat',
+        'offset'   : 'cat',
+        'price'    : '<f8',
+        'volume'   : '<i8',
+        'datetime' : '<i8', # int64 nanoseconds
+    },
+    'order': {
+        'account'  : 'cat',
+        'date'     : '<i4',
+        'code'     : 'cat',
+        'exchange' : 'cat',
+        'session'  : 'cat',
+        'orderid'  : '<i8',
+        'direction': 'cat',
+        'type'     : 'cat',
+        'offset'   : 'cat',
+        'price'    : '<f8',
+        'volume'   : '<i8',
+        'traded'   : '<i8',
+        'status'   : 'cat',
+        'datetime' : '<i8',
+    },
+}
+
+FILE_PATTERN = re.compile(r'^data_(trade|order)_(\d{4})-(\d{2})-(\d{2})\.csv$')
+
+
+def GetFiles(settle_path, kind):
+    """
+    {'<account>/<file>': (account, date)} of one kind, sorted by account then date
+    """
+    files = {}
+    for path in sorted(glob.glob(os.path.join(settle_path, '*', 'data_{}_*.csv'.format(kind)))):
+        m = FILE_PATTERN.match(os.path.basename(path))
+        if m is not None:
+            account = os.path.basename(os.path.dirname(path))
+            files[account + '/' + os.path.basename(path)] = (account, int(m.group(2) + m.group(3) + m.group(4)))
+    return dict(sorted(files.items(), key=lambda x: x[1]))
+
+
+def ReadFile(task):
+    """
+    One settlement CSV -> dict of typed columns in SCHEMAS[kind] order. Exports without fills ("") give 0 rows
+    """
+    path, kind, account, date = task
+    schema = SCHEMAS[kind]
+    df = pd.read_csv(path, index_col=0, dtype={'orderid': str, 'tradeid': str})
+    if 'code' not in df.columns:
+        df = pd.DataFrame(columns=[k for k in schema if k not in ('account', 'date', 'session')])
+    n = len(df)
+    ids = df['orderid'].astype(str).str.extract(r'^(.*?)_?\s*(\d+)$')
+    cols = {
+        'account': np.full(n, account, dtype=object),
+        'date'   : np.full(n, date, dtype=np.int32),
+        'session': ids[0].fillna('').values.astype(object),
+        'orderid': pd.to_numeric(ids[1]).fillna(-1).values.astype(np.int64),
+    }
+    if kind == 'trade':
+        cols['tradeid'] = pd.to_numeric(df['tradeid'].str.strip()).values.astype(np.int64) if 'tradeid' in df.columns else np.full(n, -1, dtype=np.int64)
+    cols['datetime'] = np.asarray(pd.to_datetime(df['datetime'], format='%Y-%m-%d %H:%M:%S'), dtype='datetime64[ns]').view(np.int64)
+    for name, dtype in schema.items():
+        if name not in cols:
+            cols[name] = df[name].values.astype(object) if dtype == 'cat' else df[name].values.astype(dtype)
+    return {name: cols[name] for name in schema}
+
+
+def Ingest(settle_path, store_path, kinds=('trade', 'order'), workers=None):
+    """
+    Parse new settlement files of every account in parallel and append them to store_path/<kind>/.
+    Files already in the store are skipped. A file that changed since ingestion (size / mtime)
+    triggers a rebuild of that kind. Returns {kind: number of files appended}
+    """
+    res = {}
+    for kind in kinds:
+        start = time.time()
+        store = colstore(os.path.join(store_path, kind))
+        done  = store.meta['extra'].get('files', {})
+        files = GetFiles(settle_path, kind)
+        stats = {f: os.stat(os.path.join(settle_path, f)) for f in files}
+        if any(f in files and [stats[f].st_size, stats[f].st_mtime_ns] != v[2:] for f, v in done.items()):
+            print('{} Files changed, rebuild {}'.format(kind, os.path.join(store_path, kind)))
+            shutil.rmtree(os.path.join(store_path, kind))
+            store = colstore(os.path.join(store_path, kind))
+            done  = {}
+        new   = [f for f in files if f not in done]
+        tasks = [(os.path.join(settle_path, f), kind, *files[f]) for f in new]
+        if workers == 1 or len(tasks) < 2:
+            parts = [ReadFile(task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                parts = list(pool.map(ReadFile, tasks, chunksize=4))
+
+        index = dict(done)
+        rows  = len(store)
+        for f, part in zip(new, parts):
+            n = len(part['date'])
+            index[f] = [rows, rows + n, stats[f].st_size, stats[f].st_mtime_ns]
+            rows += n
+        if len(new) > 0:
+            cols = {name: np.concatenate([part[name] for part in parts]) for name in SCHEMAS[kind]}
+            store.append(cols, extra={'files': index})
+            print('{} Ingested {} files, {} rows {}'.format(kind, len(new), len(cols['date']), time.time() - start))
+        res[kind] = len(new)
+    return res
+
+
+class settlestore(object):
+    """
+    Typed columnar settlement data of one kind (trade / order) for all accounts.
+    Each (account, date) file is one contiguous row range, so selections read only their rows.
+    """
+    def __init__(self, store_path, kind):
+        self.kind  = kind
+        self.store = colstore(os.path.join(store_path, kind))
+        assert len(self.store.meta['columns']) > 0, 'No {} data in {}, run Ingest first'.format(kind, store_path)
+
+    def index(self):
+        """
+        DataFrame of account, date, start, stop: row range of every ingested file, and its size / mtime
+        """
+        files = self.store.meta['extra'].get('files', {})
+        res = pd.DataFrame([(f.split('/')[0], int(FILE_PATTERN.match(f.split('/')[1]).expand(r'\2\3\4')), *v)
+                            for f, v in files.items()], columns=['account', 'date', 'start', 'stop', 'size', 'mtime'])
+        return res.sort_values(['account', 'date']).reset_index(drop=True)
+
+    def accounts(self):
+        return sorted(self.index()['account'].unique().tolist())
+
+    def dates(self, account=None):
+        index = self.index()
+        if account is not None:
+            index = index[index['account'] == account]
+        return sorted(index['date'].unique().tolist())
+
+    def load(self, accounts=None, start_date=None, end_date=None, columns=None):
+        """
+        Rows of the selected accounts and trade dates (YYYYMMDD int, inclusive) as a DataFrame:
+        categorical columns as pd.Categorical, datetime as datetime64
+        """
+        index = self.index()
+        if accounts is not None:
+            index = index[index['account'].isin([accounts] if isinstance(accounts, str) else accounts)]
+        if start_date is not None:
+            index = index[index['date'] >= int(start_date)]
+        if end_date is not None:
+            index = index[index['date'] <= int(end_date)]
+        # 相邻的行区间合并成一次读取
+        spans = []
+        for start, stop in zip(index['start'].tolist(), index['stop'].tolist()):
+            if len(spans) > 0 and spans[-1][1] == start:
+                spans[-1][1] = stop
+            elif stop > start:
+                spans.append([start, stop])
+        frames = [self.store.frame(start, stop, columns) for start, stop in spans]
+        res = pd.concat(frames, axis=0, ignore_index=True) if len(frames) > 1 else frames[0] if frames else self.store.frame(0, 0, columns)
+        if 'datetime' in res.columns:
+            res['datetime'] = res['datetime'].values.astype('datetime64[ns]')
+        return res
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Ingest settlement trade / order CSVs into a columnar store')
+    parser.add_argument('settle_path', help='Settlement root, contains <account>/data_<kind>_<date>.csv')
+    parser.add_argument('store_path', help='Output directory')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    Ingest(args.settle_path, args.store_path, workers=args.workers)
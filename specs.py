@@ -0,0 +1,97 @@
+import os
+import re
+import json
+import numpy as np
+
+
+VERSION   = 1
+SPEC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instruments.json')
+
+# 手续费动作 -> fee kernel 行号
+FEE_ACTIONS = {'open': 0, 'closeT': 1, 'closeN': 2}
+
+SPEC_DTYPE = np.dtype([
+    ('product'    , 'U8'),
+    ('month'      , 'U4'),  # '' 为品种默认, 否则为合约月份 YYMM
+    ('exchange'   , 'U8'),
+    ('ticksize'   , 'f8'),
+    ('size'       , 'f8'),
+    ('margin'     , 'f8'),
+    ('open_rate'  , 'f8'),
+    ('open_flat'  , 'f8'),
+    ('closeT_rate', 'f8'),
+    ('closeT_flat', 'f8'),
+    ('closeN_rate', 'f8'),
+    ('closeN_flat', 'f8'),
+    ('night'      , 'U16'), # '' 为没有夜盘
+])
+
+
+def SplitContract(contract):
+    """
+    'eg2105' -> ('EG', '2105'), 'EG' -> ('EG', '')
+    """
+    m = re.match(r'^([A-Za-z]+)(\d*)$', contract)
+    assert m is not None, 'Cannot parse contract = {}'.format(contract)
+    return m.group(1).upper(), m.group(2)
+
+
+def ToRow(product, month, spec):
+    return (product, month, spec['exchange'], spec['ticksize'], spec['size'], spec['margin'],
+            spec['open'][0], spec['open'][1], spec['closeT'][0], spec['closeT'][1],
+            spec['closeN'][0], spec['closeN'][1], spec.get('night', ''))
+
+
+def Load(path=SPEC_PATH):
+    """
+    Versioned instrument file -> (record array, {(product, month): row}).
+    products: full spec per product, fees as [rate, flat]
+    contracts: per contract overrides of the product spec, e.g. {"EG2105": {"margin": 0.15}}
+    """
+    with open(path) as f:
+        raw = json.load(f)
+    assert raw['version'] == VERSION, 'Instrument spec version {} not supported'.format(raw['version'])
+    rows = [ToRow(product, '', spec) for product, spec in raw['products'].items()]
+    for contract, override in raw.get('contracts', {}).items():
+        product, month = SplitContract(contract)
+        rows.append(ToRow(product, month, dict(raw['products'][product], **override)))
+    specs = np.array(rows, dtype=SPEC_DTYPE)
+    index = {(product, month): k for k, (product, month) in enumerate(zip(specs['product'].tolist(), specs['month'].tolist()))}
+    return specs, index
+
+
+SPECS = None
+INDEX = None
+
+def GetRow(instrument, contract=None):
+    """
+    Row number of the spec for a product, or of a contract month override when there is one
+    """
+    global SPECS, INDEX
+    if SPECS is None:
+        SPECS, INDEX = Load()
+    product = instrument.upper()
+    if contract is not None:
+        key = SplitContract(contract)
+        if key in INDEX:
+            return INDEX[key]
+    assert (product, '') in INDEX, 'No instrument spec for {}'.format(instrument)
+    return INDEX[(product, '')]
+
+
+def GetSpec(instrument, contract=None):
+    """
+    Spec record (product default or contract override)
+    """
+    row = GetRow(instrument, contract)
+    return SPECS[row]
+
+
+def GetFeeKernel(spec):
+    """
+    (3, 2) array of (rate, flat) for open, closeT, closeN:
+    ex_fee = price * qty * rate * size + qty * flat
+    """
+    return np.array([[spec['open_rate'], spec['open_flat']],
+                     [spec['closeT_rate'], spec['closeT_flat']],
+                     [spec['closeN_rate'], spec['closeN_flat']]], dtype=np.float64)
@@ -0,0 +1,121 @@
+import os
+import io
+import re
+import glob
+import numpy as np
+import pandas as pd
+from settlestore import GetFiles
+
+
+# 券商导出的汇总表: 资金信息 / 持仓合计 / 成交合计, 可以按日期另存为 <kind>_YYYY-MM-DD.csv
+KINDS = {
+    'funds'    : '资金信息',
+    'positions': '持仓合计',
+    'trades'   : '成交合计',
+}
+
+# 保持文本的列 (账号 / 合约 / 委托号不能转成数字)
+TEXT_COLUMNS = ['资金账号', '合约', '委托号', '币种', '名称', '品种']
+
+PADDING = re.compile(r' *\t')
+SUFFIX  = re.compile(r'_(\d{4})-(\d{2})-(\d{2})\.csv$')
+
+
+def ReadSummary(path):
+    """
+    One broker summary file -> typed DataFrame in a single pass: BOM dropped, the tab padding removed
+    from the whole text with one regex, quotes / thousands separators handled by the csv parser,
+    percentage columns as fractions. Rows without an account (持仓合计 totals) are dropped
+    """
+    with open(path, encoding='utf-8-sig') as f:
+        text = PADDING.sub('', f.read())
+    df = pd.read_csv(io.StringIO(text), thousands=',', dtype={name: str for name in TEXT_COLUMNS})
+    df = df.loc[:, ~df.columns.str.startswith('Unnamed')]
+    for name in df.columns:
+        if name in TEXT_COLUMNS or df[name].dtype.kind in 'biuf':
+            continue
+        values = df[name].dropna()
+        if len(values) > 0 and values.str.endswith('%').all():
+            df[name] = pd.to_numeric(df[name].str[:-1]) / 100
+    return df[df['资金账号'].notna()].reset_index(drop=True)
+
+
+def GetSummaryDate(path):
+    """
+    Trade date (YYYYMMDD int) of a summary file: its _YYYY-MM-DD suffix, otherwise the last
+    data_trade_ file of the account (the summaries are exported after the last trading day)
+    """
+    m = SUFFIX.search(os.path.basename(path))
+    if m is not None:
+        return int(m.group(1) + m.group(2) + m.group(3))
+    files = GetFiles(os.path.dirname(os.path.dirname(os.path.abspath(path))), 'trade')
+    account = os.path.basename(os.path.dirname(os.path.abspath(path)))
+    dates = [date for acc, date in files.values() if acc == account]
+    return max(dates) if len(dates) > 0 else -1
+
+
+def GetSummary(settle_path, kind):
+    """
+    All accounts' summaries of one kind (funds / positions / trades) with account (directory) and date columns
+    """
+    frames = []
+    for path in sorted(glob.glob(os.path.join(settle_path, '*', KINDS[kind] + '*.csv'))):
+        df = ReadSummary(path)
+        df.insert(0, 'account', os.path.basename(os.path.dirname(path)))
+        df.insert(1, 'date', GetSummaryDate(path))
+        frames.append(df)
+    res = pd.concat(frames, axis=0, ignore_index=True) if len(frames) > 0 else pd.DataFrame(columns=['account', 'date'])
+    if kind == 'trades' and len(res) > 0:
+        res['成交时间'] = pd.to_datetime(res.pop('成交日期') + ' ' + res['成交时间'], format='%Y-%m-%d %H:%M:%S')
+    return res.sort_values(['account', 'date'], kind='stable').reset_index(drop=True)
+
+
+def GetEquitySeries(funds):
+    """
+    ----- 账户权益 -----
+    Per account and date from the 资金信息 snapshots: equity, margin, risk rate, fees and pnl.
+    Each snapshot also gives the previous day's close (昨权益), so one file yields two points;
+    the previous point is only used where no snapshot of that day exists.
+    pnl = equity change net of deposits / withdrawals
+    """
+    if len(funds) == 0:
+        return pd.DataFrame(columns=['account', 'date', 'equity', 'margin', 'risk', 'fee', 'pnl'])
+    res = pd.DataFrame({
+        'account'  : funds['account'].values,
+        'date'     : funds['date'].values,
+        'equity'   : funds['今权益'].values,
+        'available': funds['今可用'].values,
+        'margin'   : funds['保证金'].values,
+        'risk'     : funds['风险率'].values,
+        'fee'      : funds['手续费'].values,
+        'pnl'      : (funds['今权益'] - funds['昨权益'] - funds['入金'] + funds['出金']).values,
+    })
+    # 第一份快照之前一天的权益 (日期未知, 记为 -1)
+    first = funds.sort_values('date', kind='stable').groupby('account', sort=False).head(1)
+    prev  = pd.DataFrame({'account': first['account'].values, 'date': -1, 'equity': first['昨权益'].values,
+                          'available': first['昨可用'].values, 'margin': np.nan, 'risk': np.nan, 'fee': 0.0, 'pnl': 0.0})
+    res = pd.concat([prev, res], axis=0, ignore_index=True)
+    res = res.drop_duplicates(['account', 'date'], keep='last').sort_values(['account', 'date'], kind='stable')
+    res['total_pnl'] = res.groupby('account')['pnl'].cumsum()
+    return res.reset_index(drop=True)
+
+
+def GetBacktestDays(bt):
+    """
+    Daily mark to market pnl of a backtest: last tick of each day in bt.mtm, as {date: pnl}
+    """
+    return pd.Series([x[2][-1] if len(x[2]) > 0 else np.nan for x in bt.mtm],
+                     index=[int(d) for d in bt.dates[:len(bt.mtm)]], dtype=np.float64).ffill()
+
+
+def CompareEquity(series, bt, account):
+    """
+    Live account daily pnl (GetEquitySeries) next to the backtest's mark to market pnl on the same dates
+    """
+    live = series[(series['account'] == account) & (series['date'] >= 0)].set_index('date')
+    days = GetBacktestDays(bt)
+    bt_pnl = days.diff().fillna(days)
+    res = pd.DataFrame({'Live Equity': live['equity'], 'Live PnL': live['pnl'], 'Risk': live['risk']})
+    res = res.join(pd.DataFrame({'BT PnL': bt_pnl, 'BT Total PnL': days}), how='outer')
+    res['Diff'] = res['Live PnL'] - res['BT PnL']
+    return res
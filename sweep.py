@@ -0,0 +1,173 @@
+import time
+import itertools
+import numpy as np
+import pandas as pd
+import database as db
+import metrics as mt
+import features as fe
+import runner as rn
+from concurrent.futures import ProcessPoolExecutor
+
+
+def GetGrid(space):
+    """
+    space: dict of param -> list of values. Returns every combination as a list of dict
+    """
+    keys = list(space.keys())
+    return [dict(zip(keys, values)) for values in itertools.product(*[space[k] for k in keys])]
+
+
+def GetRandom(space, n, seed=0):
+    """
+    n points, each param drawn uniformly from its list of values
+    """
+    rng = np.random.default_rng(seed)
+    return [{k: v[rng.integers(len(v))] for k, v in space.items()} for _ in range(n)]
+
+
+# 每个进程缓存: 当天的 tick 数据, 信号 bar 按 (freq, rsi, boll) 组合 (组合的 chunk 跑完即删除)
+TICK_COLUMNS = ['InstrumentID', 'BidPrice1', 'BidVolume1', 'AskPrice1', 'AskVolume1', 'MidPrice',
+                'UpperLimitPrice', 'LowerLimitPrice', 'Volume']
+TICKS   = {}
+SIGNALS = {}
+
+def GetTicks(data_path, instrument, date):
+    """
+    Tick columns backtest.start needs for one day. Only the last day is kept: RunPoints runs
+    each day for every point before moving to the next
+    """
+    key = (data_path, instrument, date)
+    if key not in TICKS:
+        df = db.GetTickData(data_path, instrument, date)
+        df = df[[name for name in TICK_COLUMNS if name in df.columns]].copy()
+        df['InstrumentID'] = df['InstrumentID'].astype('category')
+        TICKS.clear()
+        TICKS[key] = df
+    return TICKS[key]
+
+
+def GetSignalBars(feature_path, instrument, freq, signal):
+    """
+    Feature bars with sigl / sigs for one signal param combination, computed once per process
+    """
+    key = (feature_path, instrument, freq, tuple(sorted(signal.items())))
+    if key not in SIGNALS:
+        SIGNALS[key] = fe.GetIndicators(rn.GetFeature(feature_path, instrument, freq), **signal)
+    return SIGNALS[key]
+
+
+def DropSignalBars(feature_path, instrument, freq, signal):
+    SIGNALS.pop((feature_path, instrument, freq, tuple(sorted(signal.items()))), None)
+    return 0
+
+
+def SplitPoint(point, freq='15min'):
+    """
+    Sweep point -> (signal params in features.SIGNAL_PARAMS, backtest kwargs / attributes).
+    The bar freq stays in the backtest params (params['freq']) and selects the signal bars
+    """
+    point  = dict(point)
+    signal = {name: point.pop(name, default) for name, default in fe.SIGNAL_PARAMS.items()}
+    point.setdefault('freq', freq)
+    return signal, point
+
+
+def RunPoints(instrument, points, dates, data_path, engine):
+    """
+    Run many points over dates day by day: each day's ticks are loaded once and run for every point,
+    signals aligned once per day for each signal bar frame.
+    points: list of (backtest params, signal bars from GetSignalBars).
+    Returns (backtests, seconds spent in each backtest)
+    """
+    bts     = [rn.NewBacktest(instrument, params) for params, _ in points]
+    seconds = np.zeros(len(points))
+    for date in dates:
+        df  = GetTicks(data_path, instrument, date)
+        day = {}
+        for k, (bt, (_, bars)) in enumerate(zip(bts, points)):
+            start = time.time()
+            if id(bars) not in day:
+                rn.GetSignals(df, bars[bars.TradeDate == int(date)])
+                day[id(bars)] = (df['sigl'].values, df['sigs'].values)
+            df['sigl'], df['sigs'] = day[id(bars)]
+            bt.run(df, date, engine=engine)
+            seconds[k] += time.time() - start
+    return bts, seconds
+
+
+def RunPoint(instrument, params, dates, data_path, bars, engine):
+    """
+    Run the backtest of one point over dates
+    """
+    return RunPoints(instrument, [(params, bars)], dates, data_path, engine)[0][0]
+
+
+def GetAccount(bt):
+    """
+    metrics.GetAccount of a backtest as a dict
+    """
+    res = bt.result()
+    if not mt.HasCloses(res):
+        # 没有成交或单边没有平仓
+        return {'Ticks Modelled': bt.ticks, 'Initial Capital': bt.capital}
+    return mt.GetAccount(res, bt.ticks, bt.capital).iloc[0].to_dict()
+
+
+def RunChunk(task):
+    """
+    Points of one signal combination, run side by side. Equity is kept per day only (mtm_freq)
+    unless a point sets it: the sweep reports fills based metrics, and all backtests of the chunk
+    stay in memory until the last date
+    """
+    instrument, signal, points, dates, data_path, feature_path, freq, engine = task
+    bars = GetSignalBars(feature_path, instrument, freq, signal)
+    bts, seconds = RunPoints(instrument, [(dict({'mtm_freq': '1D'}, **params), bars) for _, params in points],
+                             dates, data_path, engine)
+    DropSignalBars(feature_path, instrument, freq, signal)
+    res = []
+    for (k, _), bt, sec in zip(points, bts, seconds):
+        acc = GetAccount(bt)
+        acc['Seconds'] = round(sec, 2)
+        res.append((k, acc))
+    return res
+
+
+def Sweep(instrument, points, dates, data_path, feature_path='./feature/', freq='15min',
+          engine='numba', workers=None, chunks=None):
+    """
+    Evaluate backtest configurations for one instrument.
+
+    Kwargs:
+    1. points: list of dict (GetGrid / GetRandom), backtest kwargs / attributes
+       plus signal params in features.SIGNAL_PARAMS (rsi, boll)
+    2. dates: list of str
+    3. engine: backtest.run engine, numba by default
+    4. workers: int, 1 runs in this process
+    5. chunks: number of tasks per signal combination, default workers
+
+    Points sharing signal params and bar freq go to the same tasks. A task runs its points day by day,
+    so each day's ticks are loaded once per task and its signals aligned once for all points.
+    Returns one row per point: params + metrics.GetAccount
+    """
+    dates  = [str(d) for d in dates]
+    groups = {}
+    for k, point in enumerate(points):
+        signal, point = SplitPoint(point, freq)
+        groups.setdefault((point['freq'], tuple(sorted(signal.items()))), []).append((k, point))
+
+    chunks = chunks or workers or 4
+    tasks  = []
+    for (bar_freq, signal), group in groups.items():
+        for c in range(min(chunks, len(group))):
+            tasks.append((instrument, dict(signal), group[c::chunks], dates, data_path, feature_path, bar_freq, engine))
+
+    start = time.time()
+    if workers == 1:
+        res = [RunChunk(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            res = list(pool.map(RunChunk, tasks))
+    res = dict(r for chunk in res for r in chunk)
+    table = pd.DataFrame([{**points[k], **res[k]} for k in range(len(points))])
+    print('{} Done Sweep {} points {}'.format(instrument, len(points), time.time() - start))
+    return table
@@ -0,0 +1,169 @@
+import os
+import glob
+import json
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+
+
+VERSION = 1
+
+# 列存储: 列名 -> dtype. CSV 里没有的列跳过
+TICK_COLUMNS = {
+    'datetime'       : '<i8', # int64 nanoseconds
+    'LastPrice'      : '<f8',
+    'Volume'         : '<i8',
+    'BidPrice1'      : '<f8',
+    'BidVolume1'     : '<i8',
+    'AskPrice1'      : '<f8',
+    'AskVolume1'     : '<i8',
+    'UpperLimitPrice': '<f8',
+    'LowerLimitPrice': '<f8',
+    'PreClosePrice'  : '<f8',
+}
+
+
+def ReadCSV(path):
+    """
+    Read one CTP tick CSV into typed column arrays + per-day constants
+    """
+    df = pd.read_csv(path, index_col=0)
+    cols = {'datetime': np.asarray(pd.to_datetime(df.index), dtype='datetime64[ns]').view(np.int64)}
+    for name, dtype in TICK_COLUMNS.items():
+        if name in df.columns:
+            x = df[name]
+            if dtype == '<i8':
+                x = x.fillna(0)
+            cols[name] = x.values.astype(dtype)
+    meta = {
+        'contract'  : str(df['InstrumentID'].iloc[0]) if 'InstrumentID' in df.columns else '',
+        'tradingday': int(df['TradingDay'].iloc[0]) if 'TradingDay' in df.columns else 0,
+    }
+    return cols, meta
+
+
+def Ingest(data_path, store_path, instrument):
+    """
+    Convert data_path/<instrument>/<date>.csv into store_path/<instrument>.bin + <instrument>.json
+    One contiguous block per column, each day is the row range [start, stop) of every column.
+    Days are streamed through per-column temp files so memory is one day at a time.
+    """
+    files = sorted(glob.glob(os.path.join(data_path, instrument, '*.csv')))
+    assert len(files) > 0, 'No CSV found for {} under {}'.format(instrument, data_path)
+    os.makedirs(store_path, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=store_path)
+    try:
+        names = None
+        dates = {}
+        rows  = 0
+        outs  = {}
+        for path in files:
+            date = os.path.basename(path)[:-4]
+            cols, meta = ReadCSV(path)
+            if names is None:
+                names = list(cols.keys())
+                outs  = {name: open(os.path.join(tmp, name), 'wb') for name in names}
+            assert list(cols.keys()) == names, 'Columns of {} not match {}'.format(path, names)
+            n = len(cols['datetime'])
+            for name in names:
+                outs[name].write(np.ascontiguousarray(cols[name]).tobytes())
+            dates[date] = {'start': rows, 'stop': rows + n, 'contract': meta['contract'], 'tradingday': meta['tradingday']}
+            rows += n
+        for f in outs.values():
+            f.close()
+
+        # Concatenate Columns into One File
+        columns = {}
+        offset  = 0
+        with open(os.path.join(store_path, instrument + '.bin'), 'wb') as out:
+            for name in names:
+                with open(os.path.join(tmp, name), 'rb') as f:
+                    shutil.copyfileobj(f, out)
+                columns[name] = {'dtype': TICK_COLUMNS[name], 'offset': offset}
+                offset += rows * np.dtype(TICK_COLUMNS[name]).itemsize
+        index = {'version': VERSION, 'instrument': instrument, 'rows': rows, 'columns': columns, 'dates': dates}
+        with open(os.path.join(store_path, instrument + '.json'), 'w') as f:
+            json.dump(index, f)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    STORES.pop((os.path.abspath(store_path), instrument), None)
+    print('{} Ingested {} days, {} ticks'.format(instrument, len(dates), rows))
+    return 0
+
+
+def HasStore(store_path, instrument):
+    return os.path.exists(os.path.join(store_path, instrument + '.json'))
+
+
+class tickstore(object):
+    """
+    Memory-mapped reader. load() returns zero-copy views of the columns for a date range.
+    """
+    def __init__(self, store_path, instrument):
+        with open(os.path.join(store_path, instrument + '.json')) as f:
+            self.index = json.load(f)
+        assert self.index['version'] == VERSION, 'Tick store version {} not supported'.format(self.index['version'])
+        self.instrument = instrument
+        self.rows       = self.index['rows']
+        self.mm         = np.memmap(os.path.join(store_path, instrument + '.bin'), dtype=np.uint8, mode='r')
+        self.columns    = {}
+        for name, col in self.index['columns'].items():
+            dtype = np.dtype(col['dtype'])
+            self.columns[name] = self.mm[col['offset']: col['offset'] + self.rows * dtype.itemsize].view(dtype)
+
+    def dates(self):
+        return sorted(self.index['dates'].keys())
+
+    def span(self, start_date, end_date=None):
+        """
+        Row range [start, stop) covering start_date .. end_date (inclusive)
+        """
+        end_date = start_date if end_date is None else end_date
+        days = [d for d in self.dates() if start_date <= d <= end_date]
+        assert len(days) > 0, 'No data for {} between {} and {}'.format(self.instrument, start_date, end_date)
+        return self.index['dates'][days[0]]['start'], self.index['dates'][days[-1]]['stop']
+
+    def load(self, start_date, end_date=None, columns=None):
+        """
+        Dict of zero-copy (read only) NumPy views for the date range
+        """
+        start, stop = self.span(start_date, end_date)
+        columns = self.columns.keys() if columns is None else columns
+        return {name: self.columns[name][start:stop] for name in columns}
+
+    def frame(self, date):
+        """
+        One trading day as the DataFrame backtest.run expects
+        """
+        day  = self.index['dates'][date]
+        cols = self.load(date)
+        index = pd.DatetimeIndex(cols.pop('datetime').astype('datetime64[ns]'), name='datetime')
+        df = pd.DataFrame(cols, index=index)
+        df.insert(0, 'InstrumentID', day['contract'])
+        df.insert(1, 'TradingDay', day['tradingday'])
+        df['MidPrice'] = 0.5 * (df['BidPrice1'] + df['AskPrice1'])
+        return df
+
+
+STORES = {}
+
+def Open(store_path, instrument):
+    """
+    Cached tickstore per (store_path, instrument)
+    """
+    key = (os.path.abspath(store_path), instrument)
+    if key not in STORES:
+        STORES[key] = tickstore(store_path, instrument)
+    return STORES[key]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert CTP tick CSVs into a memory-mapped tick store')
+    parser.add_argument('data_path', help='CSV root, contains <instrument>/<date>.csv')
+    parser.add_argument('store_path', help='Output directory')
+    parser.add_argument('instruments', nargs='+')
+    args = parser.parse_args()
+    for instrument in args.instruments:
+        Ingest(args.data_path, args.store_path, instrument)
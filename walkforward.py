@@ -0,0 +1,112 @@
+import time
+import numpy as np
+import pandas as pd
+import database as db
+import sweep as sw
+from concurrent.futures import ProcessPoolExecutor
+
+
+def GetWindows(dates, train, test, step=None, anchored=False):
+    """
+    Walk-forward folds over trade dates: list of (train dates, test dates).
+    Test windows follow each other every step (default test) dates; anchored folds
+    train from the first date, otherwise on the last train dates. The last test window may be shorter.
+    step must be at least test: overlapping test windows would count their shared days twice in Stitch
+    """
+    dates = [str(d) for d in dates]
+    step  = step or test
+    assert step >= test, 'step = {} < test = {}: test windows overlap'.format(step, test)
+    folds = []
+    for end in range(train, len(dates), step):
+        folds.append((dates[0 if anchored else end - train: end], dates[end: end + test]))
+    return folds
+
+
+def RunFold(task):
+    """
+    Pick the point with the best target on the train dates, then run it out of sample on the test dates.
+    Train runs all points day by day (sweep.RunPoints), so each train day is loaded once per fold;
+    signal bars are cached per worker (sweep.SIGNALS) and shared by folds
+    """
+    instrument, k, train, test, points, data_path, feature_path, freq, engine, target = task
+    start  = time.time()
+    scores = np.full(len(points), np.nan)
+    if len(points) > 1:
+        runs = []
+        for point in points:
+            signal, params = sw.SplitPoint(point, freq)
+            runs.append((dict({'mtm_freq': '1D'}, **params), sw.GetSignalBars(feature_path, instrument, params['freq'], signal)))
+        bts, _ = sw.RunPoints(instrument, runs, train, data_path, engine)
+        scores = np.array([sw.GetAccount(bt).get(target, np.nan) for bt in bts], dtype=np.float64)
+    best = int(np.nanargmax(scores)) if np.any(scores == scores) else 0
+
+    signal, params = sw.SplitPoint(points[best], freq)
+    bars = sw.GetSignalBars(feature_path, instrument, params['freq'], signal)
+    bt   = sw.RunPoint(instrument, params, test, data_path, bars, engine)
+    row = {'Fold': k, 'Point': best,
+           'Train': '{} - {}'.format(train[0], train[-1]) if len(train) > 0 else '',
+           'Test' : '{} - {}'.format(test[0], test[-1]),
+           'Train ' + target: scores[best], **points[best], **sw.GetAccount(bt)}
+    row['Seconds'] = round(time.time() - start, 2)
+    print('{} Done Fold {} {}'.format(instrument, k, row['Seconds']))
+    return row, bt.result(), bt.equity()
+
+
+def Stitch(results, equities, capital):
+    """
+    Chain out of sample folds into one account: each fold continues from the previous fold's
+    final realized (reports) and mark to market (equity) pnl
+    """
+    reports, curves = [], []
+    rpnl, pnl = 0, 0
+    for k, (res, eq) in enumerate(zip(results, equities)):
+        res = res.copy()
+        res['total_pnl']  += rpnl
+        res['total_rpnl'] += rpnl
+        res.insert(0, 'fold', k)
+        eq = eq.copy()
+        eq['pnl']    += pnl
+        eq['equity'] += pnl
+        eq['usage']   = eq['margin'] / eq['equity']
+        eq['fold']    = k
+        if len(res) > 0:
+            rpnl = res['total_rpnl'].iloc[-1] - capital
+        if len(eq) > 0:
+            pnl = eq['pnl'].iloc[-1]
+        reports.append(res)
+        curves.append(eq)
+    return pd.concat(reports, axis=0, ignore_index=True), pd.concat(curves, axis=0)
+
+
+def WalkForward(instrument, points, dates, data_path, feature_path='./feature/', train=20, test=5,
+                step=None, anchored=False, freq='15min', target='Final Capital', engine='numba', workers=None):
+    """
+    Walk-forward / rolling window backtest for one instrument.
+
+    Kwargs:
+    1. points: list of dict (sweep.GetGrid / GetRandom), candidates chosen on each train window by target.
+       With a single point every fold just runs it out of sample
+    2. dates: list of str, None for database.GetTradeDates
+    3. train, test, step: window lengths in trade dates (GetWindows)
+    4. target: metrics.GetAccount column to maximize
+    5. workers: int, folds run in parallel, 1 runs in this process
+
+    Returns (folds, report, equity): one row per fold with the chosen point, its train score and the
+    out of sample metrics.GetAccount, the stitched out of sample fills and tick equity
+    """
+    points = [points] if isinstance(points, dict) else list(points)
+    dates  = db.GetTradeDates(data_path, instrument) if dates is None else [str(d) for d in dates]
+    folds  = GetWindows(dates, train, test, step, anchored)
+    assert len(folds) > 0, 'Not enough dates for train = {} test = {}: {} dates'.format(train, test, len(dates))
+    tasks  = [(instrument, k, tr, te, points, data_path, feature_path, freq, engine, target) for k, (tr, te) in enumerate(folds)]
+
+    start = time.time()
+    if workers == 1:
+        res = [RunFold(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            res = list(pool.map(RunFold, tasks))
+    table = pd.DataFrame([r[0] for r in res])
+    report, equity = Stitch([r[1] for r in res], [r[2] for r in res], table['Initial Capital'].iloc[0])
+    print('{} Done Walk Forward {} folds {}'.format(instrument, len(folds), time.time() - start))
+    return table, report, equity